@@ -0,0 +1,34 @@
+# %%
+"""
+Helpers shared by the benchmarks: a capture from the simulated PicoScope and the timers.
+
+    from _common import make_capture, timed, timeit     # the folder of a benchmark script is on sys.path
+
+The repository root has to be on sys.path first, as every benchmark does.
+"""
+import time as time_lib
+
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+
+
+def make_capture(n_samples):
+    """One block of 4 channels (A on 20 V, the others on 2 V) at 0.5 MS/s, in the session's ctypes buffers."""
+    session = PicoScopeSession(driver=FakePs5000a())
+    for ch, v_range in zip('ABCD', ('20V', '2V', '2V', '2V')):
+        session.set_channel(ch, range=v_range)
+    session.set_timebase(128, n_samples, min(10000, n_samples))
+    session.open()
+    return session.capture_block()
+
+
+def timed(function, *args):
+    """(result, seconds) of one call of ``function(*args)``."""
+    start = time_lib.perf_counter()
+    result = function(*args)
+    return result, time_lib.perf_counter() - start
+
+
+def timeit(function, *args, repeats=1):
+    """Shortest time in seconds of ``repeats`` calls of ``function(*args)``."""
+    return min(timed(function, *args)[1] for _ in range(repeats))
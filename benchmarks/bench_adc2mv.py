@@ -0,0 +1,69 @@
+# %%
+"""
+ADC -> mV conversion: picosdk's adc2mV against the vectorised path.
+
+Converts four channels of 1.5 M samples (one capture of picoscope_script.py)
+held in ctypes buffers and prints the time per capture of
+
+- adc2mV: picosdk's per-sample list comprehension, then the DataFrame build,
+- adc_to_mv: zero-copy view + one float32 multiply into a new array,
+- MillivoltConverter: the same into float32 arrays reused between captures,
+- raw view: only the zero-copy int16 views, no conversion at all.
+
+    python benchmarks/bench_adc2mv.py --samples 1500000 --repeats 5
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _common import make_capture, timeit
+from picoscope_convert import adc_to_mv, capture_views, MillivoltConverter, channelInputRanges
+
+try:
+    from picosdk.functions import adc2mV
+except ImportError:
+    def adc2mV(bufferADC, range, maxADC):
+        # Same as picosdk.functions.adc2mV
+        vRange = channelInputRanges[range]
+        return [(x * vRange) / maxADC.value for x in bufferADC]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=1500000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    capture = make_capture(args.samples)
+    converter = MillivoltConverter()
+
+    def old_path():
+        mV = {ch: adc2mV(capture['buffers'][ch], capture['ranges'][ch], capture['maxADC']) for ch in 'ABCD'}
+        pd.DataFrame(mV)
+
+    def new_path():
+        views = capture_views(capture)
+        mV = {ch: adc_to_mv(views[ch], capture['ranges'][ch], capture['maxADC']) for ch in 'ABCD'}
+        pd.DataFrame(mV)
+
+    def reused():
+        pd.DataFrame(converter.convert(capture))
+
+    # Same numbers from both conversions
+    reference = adc2mV(capture['buffers']['A'], capture['ranges']['A'], capture['maxADC'])
+    assert np.allclose(reference, converter.convert(capture)['A'], rtol=1e-6)
+
+    results = {
+        'adc2mV (picosdk)': timeit(old_path, repeats=min(args.repeats, 2)),
+        'adc_to_mv': timeit(new_path, repeats=args.repeats),
+        'MillivoltConverter': timeit(reused, repeats=args.repeats),
+        'raw view': timeit(lambda: pd.DataFrame(capture_views(capture)), repeats=args.repeats),
+    }
+    print(f"4 channels x {args.samples} samples, conversion + DataFrame build")
+    for name, seconds in results.items():
+        print(f"{name:>20}: {seconds * 1e3:10.2f} ms  ({results['adc2mV (picosdk)'] / seconds:8.0f}x)")
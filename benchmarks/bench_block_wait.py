@@ -0,0 +1,80 @@
+# %%
+"""
+CPU use and latency of the ways to wait for a block capture.
+
+Compares the old ps5000aIsReady busy loop ('spin') with the block-ready
+callback ('callback'), the back-off poll ('poll') and the asyncio interface,
+on the simulated PicoScope running in real time. For every mode it prints
+
+- cpu: CPU time of this process during the capture, as a share of the wall
+  time (100% = one core spinning); idle is the rest,
+- latency: time from the end of the capture to the data being available in
+  the host buffers, which includes the download of the samples.
+
+    python benchmarks/bench_block_wait.py --capture-time 0.5 --repeats 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time as time_lib
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+
+
+def make_session(wait_mode, capture_time):
+    ps = FakePs5000a(time_scale=1.0, noise=0)
+    session = PicoScopeSession(driver=ps, wait_mode=wait_mode)
+    for ch in 'ABCD':
+        session.set_channel(ch, range='2V')
+    session.set_trigger(['A', 'B', 'C', 'D'], level=1)
+    # timebase 128 at 12 bit = 2 us per sample
+    session.set_timebase(128, int(capture_time / 2e-6), 1000)
+    return ps, session
+
+
+def bench(wait_mode, capture_time, repeats, use_asyncio=False):
+    ps, session = make_session(wait_mode, capture_time)
+    cpu, latency, ticks = [], [], []
+    with session:
+        session.apply()
+        for _ in range(repeats):
+            wall_0, cpu_0 = time_lib.perf_counter(), time_lib.process_time()
+            if use_asyncio:
+                n_ticks = asyncio.run(_capture_async(session))
+                ticks.append(n_ticks)
+            else:
+                session.capture_block()
+            wall_1, cpu_1 = time_lib.perf_counter(), time_lib.process_time()
+            cpu.append((cpu_1 - cpu_0) / (wall_1 - wall_0))
+            latency.append(wall_1 - ps.ready_at)
+    return np.median(cpu), np.median(latency), (np.median(ticks) if ticks else None)
+
+
+async def _capture_async(session):
+    """Run a capture while another coroutine does 'host work' every 10 ms."""
+    task = asyncio.ensure_future(session.capture_block_async())
+    n_ticks = 0
+    while not task.done():
+        n_ticks += 1
+        await asyncio.sleep(0.01)
+    await task
+    return n_ticks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--capture-time', type=float, default=0.5, help='seconds per capture')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'wait':>16} {'cpu':>6} {'idle':>6} {'latency':>10} {'loop ticks':>11}")
+    for wait_mode, use_asyncio in (('spin', False), ('poll', False), ('callback', False), ('callback', True)):
+        cpu, latency, ticks = bench(wait_mode, args.capture_time, args.repeats, use_asyncio)
+        name = wait_mode + (' (asyncio)' if use_asyncio else '')
+        print(f"{name:>16} {cpu:>6.0%} {1 - cpu:>6.0%} {latency * 1e3:>8.2f}ms {'' if ticks is None else int(ticks):>11}")
@@ -0,0 +1,95 @@
+# %%
+"""
+Finding captures in a large archive: directory listings and file reads against the catalog.
+
+Writes ``--files`` small captures, one every ``--interval`` minutes, both in
+one flat folder and in YYYY/MM/DD day folders, and indexes the partitioned
+copy in a Catalog. Then it times three lookups. The first lists one day's
+files: glob and sort of the flat folder, list_archive of the partitioned
+archive, and the catalog. The second finds the captures of that day where
+channel B peaks above a threshold, by opening every file or from the
+catalog. The third is the same query over the whole archive.
+
+    python benchmarks/bench_catalog.py --files 5000
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _common import timed
+from picoscope_catalog import Catalog
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+from picoscope_spectra import file_timestamp, list_archive
+from picoscope_storage import partitioned_name, read_capture, write_capture
+
+
+def peaks_from_files(paths, threshold):
+    """The captures whose channel B peaks above ``threshold`` mV, reading every file."""
+    found = []
+    for path in paths:
+        if np.abs(read_capture(path).mV('B')).max() > threshold:
+            found.append(path)
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=3000)
+    parser.add_argument('--samples', type=int, default=10000)
+    parser.add_argument('--interval', type=float, default=10.0, help='minutes between captures')
+    parser.add_argument('--threshold', type=float, default=1075.0, help='mV')
+    args = parser.parse_args()
+
+    session = PicoScopeSession(driver=FakePs5000a())
+    for ch, v_range in zip('ABCD', ('20V', '2V', '2V', '2V')):
+        session.set_channel(ch, range=v_range)
+    session.set_timebase(128, args.samples, 0)
+    folder = tempfile.mkdtemp()
+    first = datetime(2025, 1, 1)
+    os.makedirs(f'{folder}/flat')
+    with session:
+        for i in range(args.files):
+            capture = session.capture_block()
+            capture['timestamp'] = first + timedelta(minutes=i * args.interval)
+            filename = f"aquisition_{capture['timestamp'].strftime('%Y-%m-%d_%H-%M-%S')}.parquet"
+            write_capture(capture, f'{folder}/flat/{filename}')
+            path = f'{folder}/dated/{partitioned_name(filename, capture["timestamp"])}'
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_capture(capture, path)
+
+    with Catalog(f'{folder}/dated') as catalog:
+        _, index_s = timed(catalog.update)
+        day = first + timedelta(minutes=args.files * args.interval / 2)
+        start, end = datetime(day.year, day.month, day.day), datetime(day.year, day.month, day.day) + timedelta(days=1)
+
+        def flat_listing():
+            paths = sorted(glob.glob(f'{folder}/flat/*.parquet'))
+            return [path for path in paths if start <= file_timestamp(path) < end]
+
+        rows = [
+            ('glob + sort, flat', *timed(flat_listing)),
+            ('list_archive, days', *timed(lambda: list_archive(f'{folder}/dated', start, end))),
+            ('catalog', *timed(lambda: catalog.paths(start, end))),
+        ]
+        day_files = rows[1][1]
+        rows += [
+            ('peak, read files', *timed(lambda: peaks_from_files(day_files, args.threshold))),
+            ('peak, catalog', *timed(lambda: list(catalog.find(start, end, 'B', min_peak=args.threshold)['path']))),
+            ('peak all, read', *timed(lambda: peaks_from_files(list_archive(f'{folder}/dated'), args.threshold))),
+            ('peak all, catalog', *timed(lambda: list(catalog.find(channel='B', min_peak=args.threshold)['path']))),
+        ]
+    shutil.rmtree(folder)
+
+    print(f"{args.files} files of 4 x {args.samples} samples, catalog built in {index_s:.1f} s")
+    print(f"{'lookup':>20} {'found':>6} {'time':>10}")
+    for name, found, seconds in rows:
+        print(f"{name:>20} {len(found):>6} {seconds * 1e3:>8.1f}ms")
@@ -0,0 +1,79 @@
+# %%
+"""
+Peak memory of long captures written whole or chunk by chunk, and cost of windowed reads.
+
+Writes the same 4-channel capture of ``--samples`` samples per channel twice.
+The first time, one capture_block() is followed by write_capture(). The
+second time, capture_block_chunks() is followed by CaptureWriter. For each,
+it prints the time and the peak Python memory (tracemalloc; the ctypes
+capture buffers are not counted). Then it reads one channel over a
+``--window`` second slice, once through ``Acquisition.read()`` and once
+through read_dataframe(), and prints the time and peak memory of each.
+
+    python benchmarks/bench_chunked.py --samples 20000000 --chunk 1048576 --window 10
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time as time_lib
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+from picoscope_storage import CaptureWriter, read_capture, read_dataframe, write_capture
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time_lib.perf_counter()
+    result = function()
+    seconds = time_lib.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=20000000)
+    parser.add_argument('--chunk', type=int, default=1024 * 1024)
+    parser.add_argument('--timebase', type=int, default=128)
+    parser.add_argument('--window', type=float, default=10.0, help='seconds read back from the middle of the file')
+    args = parser.parse_args()
+
+    session = PicoScopeSession(driver=FakePs5000a(memory_samples=4 * args.samples))
+    for ch, v_range in zip('ABCD', ('20V', '2V', '2V', '2V')):
+        session.set_channel(ch, range=v_range)
+    session.set_timebase(args.timebase, args.samples, 10000)
+    folder = tempfile.mkdtemp()
+
+    def whole():
+        return write_capture(session.capture_block(), f'{folder}/whole.parquet')
+
+    def chunked():
+        with CaptureWriter(f'{folder}/chunked.parquet') as writer:
+            for chunk in session.capture_block_chunks(args.chunk):
+                writer.write(chunk)
+        return writer.path
+
+    with session:
+        rows = [('whole', *measure(whole)), ('chunked', *measure(chunked))]
+    print(f"4 channels x {args.samples} samples, chunks of {args.chunk}, simulated PicoScope")
+    print(f"{'write':>10} {'time':>9} {'peak':>10} {'file':>9}")
+    for name, path, seconds, peak in rows:
+        print(f"{name:>10} {seconds:>8.2f}s {peak / 1e6:>8.1f}MB {os.path.getsize(path) / 1e6:>7.1f}MB")
+
+    path = rows[1][1]
+    duration_ns = args.samples * session.time_interval_ns
+    start_ns = max(0.0, duration_ns / 2 - args.window * 5e8)
+    end_ns = start_ns + args.window * 1e9
+    _, read_s, read_peak = measure(lambda: read_capture(path).read(['B'], start_ns, end_ns))
+    _, df_s, df_peak = measure(lambda: read_dataframe(path)['adc2mVChBMax'])
+    print(f"\nchannel B, {args.window:g} s of {duration_ns * 1e-9:g} s")
+    print(f"{'Acquisition.read':>18} {read_s:>8.3f}s {read_peak / 1e6:>8.1f}MB")
+    print(f"{'read_dataframe':>18} {df_s:>8.3f}s {df_peak / 1e6:>8.1f}MB")
+    shutil.rmtree(folder)
@@ -0,0 +1,66 @@
+# %%
+"""
+Transfer time and file size of block captures downsampled on the scope.
+
+Captures the same 4-channel block (1.5 M samples per channel by default)
+with every ratio mode and prints the time spent in ps5000aGetValues, the
+bytes that crossed USB and the size of the raw Parquet file.
+
+By default it runs against the simulated PicoScope, with USB modelled by
+``--transfer-rate`` bytes/s. Its GetValues also synthesises all the raw
+samples on the CPU, which is included in the time. With ``--real`` it uses
+picosdk and the connected scope.
+
+    python benchmarks/bench_downsampling.py --samples 1500000 --ratio 64
+    python benchmarks/bench_downsampling.py --real --samples 10000000 --ratio 256
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+from picoscope_storage import write_capture
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=1500000)
+    parser.add_argument('--ratio', type=int, default=64)
+    parser.add_argument('--timebase', type=int, default=128)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--transfer-rate', type=float, default=100e6, help='simulated USB bytes/s')
+    parser.add_argument('--real', action='store_true', help='use the connected PicoScope')
+    args = parser.parse_args()
+
+    driver = None if args.real else FakePs5000a(transfer_rate=args.transfer_rate)
+    session = PicoScopeSession(driver=driver)
+    for ch, v_range in zip('ABCD', ('20V', '2V', '2V', '2V')):
+        session.set_channel(ch, range=v_range)
+    session.set_trigger(['A', 'B', 'C', 'D'], level=1)
+    session.set_timebase(args.timebase, args.samples, 10000)
+
+    folder = tempfile.mkdtemp()
+    rows = []
+    with session:
+        for mode in ('NONE', 'AGGREGATE', 'DECIMATE', 'AVERAGE'):
+            session.set_downsampling(mode, args.ratio)
+            best = None
+            for _ in range(args.repeats):
+                capture = session.capture_block()
+                if best is None or capture['transfer_s'] < best['transfer_s']:
+                    best = {'transfer_s': capture['transfer_s'], 'transfer_bytes': capture['transfer_bytes']}
+            path = write_capture(capture, f'{folder}/{mode}.parquet')
+            rows.append((mode, capture['n_samples'], best['transfer_s'], best['transfer_bytes'], os.path.getsize(path)))
+    shutil.rmtree(folder)
+
+    none_s, none_bytes, none_size = rows[0][2], rows[0][3], rows[0][4]
+    print(f"4 channels x {args.samples} samples, ratio {args.ratio}, {'PicoScope' if args.real else 'simulated'}")
+    print(f"{'mode':>10} {'values':>9} {'GetValues':>10} {'faster':>7} {'USB':>9} {'file':>9} {'smaller':>8}")
+    for mode, n_values, seconds, n_bytes, size in rows:
+        print(f"{mode:>10} {n_values:>9} {seconds * 1e3:>8.0f}ms {none_s / seconds:>6.1f}x {n_bytes / 1e6:>7.2f}MB "
+              f"{size / 1e6:>7.2f}MB {none_size / size:>7.1f}x")
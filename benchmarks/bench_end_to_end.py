@@ -0,0 +1,149 @@
+# %%
+"""
+End-to-end throughput of the acquisition script against the simulated PicoScope, per acquisition and storage mode.
+
+Every mode runs ``--cycles`` acquisitions back to back through the functions
+of picoscope_script.py: the config, the session, the writers and, where the
+mode uses it, the WritePipeline with a copy to a second folder. The driver is
+``FakePs5000a.realistic()``: blocks take their real duration to record and
+the download is limited to the USB rate. Each mode runs in its own process,
+so the peak memory is its own. For each mode it prints:
+
+* cycles/hour, counted until the pipeline has written and copied everything,
+* dead time, the share of that time during which the scope was not recording,
+* MB/s written to the local folder,
+* the number of files, as a check that no file overwrote another (event
+  windows add their own files),
+* the peak memory traced by tracemalloc (Python and NumPy allocations),
+* the peak resident memory of the process (not on Windows).
+
+The filenames have a resolution of one second, so keep ``--duration`` at 1 s
+or more.
+
+    python benchmarks/bench_end_to_end.py --cycles 10 --duration 1
+    python benchmarks/bench_end_to_end.py --modes "block raw" events
+"""
+import os
+
+# picoscope_script.py picks the simulated driver instead of picosdk
+os.environ['PICOSCOPE_DRIVER'] = 'fake'
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import time as time_lib
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_config import validate_config
+from picoscope_events import make_detector
+from picoscope_fake import FakePs5000a
+from picoscope_io import WritePipeline
+from picoscope_metrics import Metrics
+from picoscope_script import collect_data, collect_long, collect_rapid_block, configure_session
+from picoscope_session import PicoScopeSession
+
+# name: (config overrides, how the cycle collects, whether it goes through the WritePipeline)
+MODES = {
+    'block raw': ({}, 'block', True),
+    'block raw, no pipeline': ({}, 'block', False),
+    'block mV': ({'output': {'file_format': 'mV'}}, 'block', True),
+    'aggregate x64': ({'capture': {'downsampling': {'mode': 'AGGREGATE', 'ratio': 64}}}, 'block', True),
+    'rapid block x100': ({'capture': {'n_samples': 10000, 'duration': None}}, 'rapid', True),
+    'long, chunked': ({}, 'long', True),
+    'events': ({'events': {'enabled': True, 'rules': [
+        {'type': 'line', 'channel': 'B', 'frequency': 20000, 'min_mV': 100, 'nperseg': 512}]}}, 'block', True),
+}
+
+
+def folder_size(folder):
+    sizes = [os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(folder) for name in names
+             if name.endswith('.parquet')]
+    return sum(sizes), len(sizes)
+
+
+def run_mode(name, args):
+    """Run one mode in a fresh temporary folder and return its numbers."""
+    overrides, kind, use_pipeline = MODES[name]
+    folder = tempfile.mkdtemp()
+    local_folder = f'{folder}/local'
+    given = {'capture': {'duration': args.duration}}
+    for section, values in overrides.items():
+        given.setdefault(section, {}).update(values)
+    config = validate_config(given)
+    config['output'].update(local_folder=local_folder, destinations=[f'{folder}/copy'], layout='flat')
+    os.makedirs(local_folder)
+    detector = make_detector(config['events'])
+    metrics = Metrics(enabled=True)
+    # Opening the unit is not part of the cycles
+    driver = FakePs5000a.realistic(open_latency=0.0, bursts=args.bursts)
+    session = PicoScopeSession(driver=driver, resolution=config['resolution'], metrics=metrics)
+
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()), session:
+        configure_session(session, config)
+        session.apply()
+        pipeline = WritePipeline(local_folder=local_folder, destinations=config['output']['destinations'],
+                                 metrics=metrics) if use_pipeline else None
+        start = time_lib.perf_counter()
+        for _ in range(args.cycles):
+            with metrics.cycle():
+                if kind == 'rapid':
+                    collect_rapid_block(session, 100, local_folder, config['output']['file_format'], pipeline,
+                                        layout='flat')
+                elif kind == 'long':
+                    collect_long(session, 256 * 1024, local_folder, pipeline, metrics, layout='flat')
+                else:
+                    collect_data(session, local_folder, file_format=config['output']['file_format'],
+                                 pipeline=pipeline, metrics=metrics, layout='flat', detector=detector)
+        if pipeline is not None:
+            # Everything queued has to be written and copied before the clock stops
+            pipeline.close()
+        seconds = time_lib.perf_counter() - start
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    written, files = folder_size(local_folder)
+    shutil.rmtree(folder)
+    if kind == 'rapid':
+        # collect_rapid_block does not count its samples; the time between the triggers is dead time
+        live = args.cycles * 100 * 10000 * session.time_interval_ns * 1e-9
+    else:
+        live = metrics.live_seconds_total
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    rss = None
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return {'cycles_per_hour': args.cycles / seconds * 3600, 'dead_time': max(0.0, 1 - live / seconds),
+            'mb_per_s': written / seconds / 1e6, 'files': files, 'traced_peak': traced_peak, 'max_rss': rss}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=1.0, help='seconds per block at 0.5 MS/s')
+    parser.add_argument('--bursts', type=float, default=1.0, help='simulated bursts per second on channel B')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    # A new process per mode, so that the peak resident memory is not the one of an earlier mode
+    context = multiprocessing.get_context('spawn')
+    print(f"{args.cycles} cycles per mode, 4 channels, {args.duration:g} s blocks at 0.5 MS/s, "
+          f"simulated 5442A on USB 3")
+    print(f"{'mode':>24} {'cycles/h':>9} {'dead':>7} {'MB/s':>7} {'files':>6} {'traced':>9} {'max RSS':>9}")
+    for name in args.modes:
+        with context.Pool(1) as pool:
+            r = pool.apply(run_mode, (name, args))
+        rss = f"{r['max_rss'] / 1e6:>7.0f}MB" if r['max_rss'] is not None else f"{'-':>9}"
+        print(f"{name:>24} {r['cycles_per_hour']:>9.0f} {r['dead_time'] * 100:>6.1f}% {r['mb_per_s']:>7.2f} "
+              f"{r['files']:>6} {r['traced_peak'] / 1e6:>7.0f}MB {rss}")
@@ -0,0 +1,103 @@
+# %%
+"""
+Event detection against the acquisition rate, on one core.
+
+Takes ``--captures`` captures of 4 channels x ``--samples`` samples from the
+simulated PicoScope. In each one it adds ``--events`` short 24 kHz bursts
+on channel B and one step on channel A at random places. Then it runs an
+EventDetector with an excursion rule and a spectral line rule on B and an
+edge rule on A. It prints:
+
+* the time the detection and the reduction take per capture,
+* that time as a fraction of the capture duration (below 1 keeps up),
+* the hits of every rule and the windows kept against the events inserted,
+* the size of the stored files against the full capture.
+
+BLAS is limited to one thread before NumPy is imported.
+
+    python benchmarks/bench_events.py --samples 1500000 --events 5
+"""
+import os
+
+for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ[variable] = '1'
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time as time_lib
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_convert import buffer_view, mv_per_count
+from picoscope_events import Edge, EventDetector, Excursion, SpectralLine
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+from picoscope_storage import write_capture
+
+
+def add_events(capture, n_events, length, rng):
+    """Bursts of 800 mV at 0.3 rad/sample on channel B and a 3 V step on channel A, written into the buffers."""
+    n = capture['n_samples']
+    b = buffer_view(capture['buffers']['B'])[:n]
+    a = buffer_view(capture['buffers']['A'])[:n]
+    starts = np.sort(rng.choice(n - length, n_events, replace=False))
+    scale_b = mv_per_count(capture['ranges']['B'], capture['maxADC'])
+    burst = (800 / scale_b * np.sin(np.arange(length) * 0.3)).astype(np.int16)
+    for start in starts:
+        b[start:start + length] += burst
+    step = rng.integers(n // 2, n)
+    a[step:] += np.int16(3000 / mv_per_count(capture['ranges']['A'], capture['maxADC']))
+    return starts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--captures', type=int, default=5)
+    parser.add_argument('--samples', type=int, default=1500000)
+    parser.add_argument('--events', type=int, default=5, help='bursts inserted per capture')
+    parser.add_argument('--length', type=int, default=2000, help='samples per burst')
+    args = parser.parse_args()
+
+    session = PicoScopeSession(driver=FakePs5000a(memory_samples=4 * args.samples))
+    for ch, v_range in zip('ABCD', ('20V', '2V', '2V', '2V')):
+        session.set_channel(ch, range=v_range)
+    session.set_sample_rate(500000, n_samples=args.samples, pre_trigger_samples=10000)
+    # B is a 1 V sine at 120 Hz and A has 200 mV of noise, see FakePs5000a.SIGNALS
+    burst_hz = 0.3 / (2 * np.pi) * 500000
+    detector = EventDetector([Excursion('B', 1300), Edge('A', 2000, lag=4), SpectralLine('B', burst_hz, 200, 1024)],
+                             pre_samples=5000, post_samples=20000, background_ratio=1000)
+    rng = np.random.default_rng(0)
+    folder = tempfile.mkdtemp()
+    detect_s, reduce_s, stored, full, windows = [], [], 0, 0, 0
+    hits = {repr(rule): 0 for rule in detector.rules}
+    with session:
+        for i in range(args.captures):
+            capture = session.capture_block()
+            add_events(capture, args.events, args.length, rng)
+            start = time_lib.perf_counter()
+            detector.detect(capture)
+            detect_s.append(time_lib.perf_counter() - start)
+            start = time_lib.perf_counter()
+            events, background = detector.reduce(capture)
+            reduce_s.append(time_lib.perf_counter() - start)
+            windows += len(detector.last_windows)
+            for rule, found in detector.last_events.items():
+                hits[rule] += len(found)
+            full += os.path.getsize(write_capture(capture, f'{folder}/full_{i}.parquet'))
+            stored += os.path.getsize(write_capture(background, f'{folder}/background_{i}.parquet'))
+            if events is not None:
+                stored += os.path.getsize(write_capture(events, f'{folder}/events_{i}.parquet'))
+    duration_s = args.samples * session.time_interval_ns * 1e-9
+    shutil.rmtree(folder)
+
+    print(f"{args.captures} captures of 4 x {args.samples} samples ({duration_s:g} s each), one core")
+    print(f"{'detect':>10} {np.median(detect_s) * 1e3:>8.1f} ms  {np.median(detect_s) / duration_s:>7.4f} x real time")
+    print(f"{'reduce':>10} {np.median(reduce_s) * 1e3:>8.1f} ms  {np.median(reduce_s) / duration_s:>7.4f} x real time")
+    print(f"inserted {args.captures * args.events} bursts and {args.captures} steps, kept {windows} windows")
+    for rule, count in hits.items():
+        print(f"{rule:>50} {count:>6} hits")
+    print(f"stored {stored / 1e6:.1f} MB instead of {full / 1e6:.1f} MB ({stored / full:.1%})")
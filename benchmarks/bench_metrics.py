@@ -0,0 +1,78 @@
+# %%
+"""
+Cost of the stage timers, and a per-stage breakdown of acquisition cycles.
+
+First times ``metrics.stage()`` disabled and enabled around an empty block.
+Then it runs ``--cycles`` capture-and-save cycles, as in picoscope_script.py,
+against the simulated PicoScope (writing through the WritePipeline), and
+prints the stage table,
+the dead time and the samples/s. The Prometheus file and the JSON lines end
+up in a temporary folder, and their sizes are printed.
+
+    python benchmarks/bench_metrics.py --cycles 5 --samples 1500000
+    python benchmarks/bench_metrics.py --cycles 5 --file-format mV --profile tracemalloc
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time as time_lib
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_fake import FakePs5000a
+from picoscope_io import WritePipeline
+from picoscope_metrics import Metrics
+from picoscope_session import PicoScopeSession
+from picoscope_storage import write_capture, write_capture_mV
+
+
+def stage_overhead(metrics, n):
+    start = time_lib.perf_counter()
+    for _ in range(n):
+        with metrics.stage('empty'):
+            pass
+    return (time_lib.perf_counter() - start) / n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--samples', type=int, default=1500000)
+    parser.add_argument('--timebase', type=int, default=128)
+    parser.add_argument('--file-format', choices=('raw', 'mV'), default='raw')
+    parser.add_argument('--profile', choices=('cprofile', 'tracemalloc'), default=None)
+    parser.add_argument('--time-scale', type=float, default=1.0, help='simulated capture time / real capture time')
+    args = parser.parse_args()
+
+    n = 200000
+    disabled = stage_overhead(Metrics(enabled=False), n)
+    enabled = stage_overhead(Metrics(enabled=True), n)
+    print(f"stage() overhead: {disabled * 1e9:.0f} ns disabled, {enabled * 1e9:.0f} ns enabled")
+
+    folder = tempfile.mkdtemp()
+    metrics = Metrics(enabled=True, prometheus_path=f'{folder}/picoscope.prom', jsonl_path=f'{folder}/cycles.jsonl',
+                      profile=args.profile, profile_folder=f'{folder}/profiles')
+    session = PicoScopeSession(driver=FakePs5000a(time_scale=args.time_scale), metrics=metrics)
+    for ch, v_range in zip('ABCD', ('20V', '2V', '2V', '2V')):
+        session.set_channel(ch, range=v_range)
+    session.set_trigger(['A', 'B', 'C', 'D'], level=1)
+    session.set_timebase(args.timebase, args.samples, 10000)
+    writer = write_capture if args.file_format == 'raw' else write_capture_mV
+    pipeline = WritePipeline(local_folder=f'{folder}/local', destinations=[f'{folder}/eos'], metrics=metrics,
+                             writer=partial(writer, metrics=metrics))
+
+    with session, pipeline:
+        for i in range(args.cycles):
+            with metrics.cycle():
+                capture = session.capture_block()
+                metrics.record_capture(capture)
+                pipeline.submit(capture, f'aquisition_{i:04d}.parquet')
+
+    print(f"\n{args.cycles} cycles of 4 x {args.samples} samples, {args.file_format} files, simulated PicoScope")
+    metrics.print_summary()
+    print(f"\n{metrics.prometheus_path}: {os.path.getsize(metrics.prometheus_path)} bytes, "
+          f"{metrics.jsonl_path}: {os.path.getsize(metrics.jsonl_path)} bytes")
+    shutil.rmtree(folder)
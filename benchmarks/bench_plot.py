@@ -0,0 +1,74 @@
+# %%
+"""
+Time to save the signal figure of one capture: all samples against the min/max envelope.
+
+Uses one 4-channel capture from the simulated PicoScope (1.5 M samples per
+channel by default) and times
+
+- full: the old collect_data(plots_signal=True) figure, a new pyplot figure
+  with every sample converted to mV and plotted,
+- decimate: the min/max envelope on the int16 counts (what the acquisition
+  thread pays with SignalPlotter),
+- render: drawing and saving the envelope on the reused Agg figure.
+
+    python benchmarks/bench_plot.py --samples 1500000 --repeats 3
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _common import make_capture, timeit
+from picoscope_convert import MillivoltConverter
+from picoscope_plot import SignalPlotter, decimate_capture
+
+
+def full_figure(capture, folder):
+    """collect_data(plots_signal=True) before the decimation."""
+    mV = MillivoltConverter().convert(capture)
+    timeIntervalns = capture['time_interval_ns']
+    time = np.linspace(0, (capture['n_samples'] - 1) * timeIntervalns, capture['n_samples'])
+    plt.figure(figsize=(7, 5), dpi=300)
+    for ch in 'ABCD':
+        plt.plot(time/1e9, mV[ch], label=f'Channel {ch}')
+    plt.xlabel('Time (s)', size=16)
+    plt.legend()
+    plt.grid(True)
+    plt.ylabel('Voltage (mV)', size=16)
+    plt.savefig(f'{folder}/full.png')
+    plt.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=1500000)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    capture = make_capture(args.samples)
+    folder = tempfile.mkdtemp()
+    plotter = SignalPlotter(folder=folder, verbose=False)
+    timestamp_str = capture['timestamp'].strftime("%Y-%m-%d_%H-%M-%S")
+    rate = 1 / (capture['time_interval_ns'] * 1e-9)
+    traces = decimate_capture(capture, plotter.n_bins)
+    results = {
+        'full (pyplot, all samples)': timeit(lambda: full_figure(capture, folder), repeats=args.repeats),
+        'decimate (min/max)': timeit(lambda: decimate_capture(capture, plotter.n_bins), repeats=args.repeats),
+        'render (reused Agg figure)': timeit(lambda: plotter.render(traces, timestamp_str, rate), repeats=args.repeats),
+    }
+    plotter.close()
+    shutil.rmtree(folder)
+
+    print(f"4 channels x {args.samples} samples, {len(traces['A'][0])} points per trace after decimation")
+    for name, seconds in results.items():
+        print(f"{name:>28}: {seconds * 1e3:8.0f} ms")
+    print(f"{'decimate + render':>28}: {(results['decimate (min/max)'] + results['render (reused Agg figure)']) * 1e3:8.0f} ms"
+          f"  ({results['full (pyplot, all samples)'] / (results['decimate (min/max)'] + results['render (reused Agg figure)']):.0f}x)")
@@ -0,0 +1,80 @@
+# %%
+"""
+Spectra of an archive: the loop of picoscope_fft.py against SpectrumEngine.
+
+Writes ``--files`` 4-channel captures from the simulated PicoScope to a
+temporary archive, then times
+
+- old: read_dataframe + complex np.fft.fft of the four columns, per file,
+- engine, 1 process and ``--workers`` processes: rfft with a Hann window,
+  spectrum table written,
+- engine rerun: every file is up to date and skipped.
+
+    python benchmarks/bench_spectra.py --files 8 --samples 1500000 --workers 4
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _common import timeit
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+from picoscope_spectra import SpectrumEngine, list_archive
+from picoscope_storage import read_dataframe, write_capture
+
+
+def make_archive(folder, n_files, n_samples):
+    session = PicoScopeSession(driver=FakePs5000a())
+    for ch, v_range in zip('ABCD', ('20V', '2V', '2V', '2V')):
+        session.set_channel(ch, range=v_range)
+    session.set_timebase(128, n_samples, 10000)
+    session.open()
+    start = datetime(2025, 4, 11, 17, 0, 0)
+    for i in range(n_files):
+        capture = session.capture_block()
+        timestamp = start + timedelta(minutes=i)
+        write_capture(capture, f'{folder}/aquisition_{timestamp:%Y-%m-%d_%H-%M-%S}.parquet')
+
+
+def old_loop(folder):
+    for file in list_archive(folder):
+        df = read_dataframe(file)
+        for ch in 'ABCD':
+            fft = np.fft.fft(df[f'adc2mVCh{ch}Max'])
+            abs(fft) / len(abs(fft)) * 2
+        np.linspace(0, np.unique(df.sampling_rate), len(fft))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=8)
+    parser.add_argument('--samples', type=int, default=1500000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--nperseg', type=int, default=None, help='Welch frame length, whole record if not given')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    make_archive(folder, args.files, args.samples)
+    serial = SpectrumEngine(output=f'{folder}/spectra_1', nperseg=args.nperseg, max_freq=5000, workers=0)
+    pool = SpectrumEngine(output=f'{folder}/spectra_n', nperseg=args.nperseg, max_freq=5000, workers=args.workers)
+    results = {
+        'old fft loop': timeit(old_loop, folder),
+        'engine, 1 process': timeit(serial.run, folder),
+        f'engine, {args.workers} processes': timeit(pool.run, folder),
+        'engine, rerun (skipped)': timeit(pool.run, folder),
+    }
+    table_size = sum(os.path.getsize(path) for path in list_archive(f'{folder}/spectra_n'))
+    shutil.rmtree(folder)
+
+    print(f"{args.files} files of 4 channels x {args.samples} samples, {os.cpu_count()} CPUs")
+    for name, seconds in results.items():
+        print(f"{name:>26}: {seconds:7.2f} s  {seconds / args.files * 1e3:8.0f} ms/file  "
+              f"({results['old fft loop'] / seconds:5.1f}x)")
+    print(f"spectrum table: {table_size / 1e3:.0f} kB")
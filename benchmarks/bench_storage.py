@@ -0,0 +1,78 @@
+# %%
+"""
+File size and write/read time of the old mV Parquet format against the raw int16 format.
+
+Uses one 4-channel capture from the simulated PicoScope (1.5 M samples per
+channel by default, as picoscope_script.py) and writes it
+
+- as the old DataFrame: float mV columns, float64 time, constant columns,
+- with ``write_capture`` for several codecs and row group sizes.
+
+Reading is timed as getting all four channels back in mV.
+
+    python benchmarks/bench_storage.py --samples 1500000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _common import make_capture, timeit
+from picoscope_convert import MillivoltConverter
+from picoscope_storage import write_capture, read_capture
+
+
+def write_old(capture, path):
+    """collect_data() before the raw format: float64 mV, as written by adc2mV."""
+    mV = MillivoltConverter().convert(capture)
+    n = capture['n_samples']
+    df = pd.DataFrame({f'adc2mVCh{ch}Max': values.astype(np.float64) for ch, values in mV.items()})
+    df['time'] = np.linspace(0, (n - 1) * capture['time_interval_ns'], n)
+    df['sampling_rate'] = 1 / (capture['time_interval_ns'] * 1e-9)
+    df['time_unit'] = 'ns'
+    df['voltage_unit'] = 'mV'
+    df['timestamp'] = capture['timestamp'].strftime("%Y-%m-%d_%H-%M-%S")
+    df.to_parquet(path, engine='pyarrow')
+
+
+def read_old(path):
+    df = pd.read_parquet(path)
+    return [df[f'adc2mVCh{ch}Max'].to_numpy() for ch in 'ABCD']
+
+
+def read_raw(path):
+    acq = read_capture(path)
+    return [acq.mV(ch) for ch in acq.channels]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=1500000)
+    args = parser.parse_args()
+
+    capture = make_capture(args.samples)
+    folder = tempfile.mkdtemp()
+    rows = []
+    path = f'{folder}/old.parquet'
+    rows.append(('old mV format (snappy)', timeit(write_old, capture, path), os.path.getsize(path),
+                 timeit(read_old, path)))
+    for compression in ('none', 'snappy', 'lz4', 'zstd'):
+        for row_group_size in (64 * 1024, 1024 * 1024):
+            path = f'{folder}/raw_{compression}_{row_group_size}.parquet'
+            write = timeit(write_capture, capture, path, compression, None, row_group_size)
+            rows.append((f'raw {compression}, {row_group_size // 1024}k rows', write, os.path.getsize(path),
+                         timeit(read_raw, path)))
+    shutil.rmtree(folder)
+
+    old_size, old_write = rows[0][2], rows[0][1]
+    print(f"4 channels x {args.samples} samples")
+    print(f"{'format':>28} {'write':>9} {'size':>9} {'smaller':>8} {'faster':>7} {'read mV':>9}")
+    for name, write, size, read in rows:
+        print(f"{name:>28} {write * 1e3:>7.0f}ms {size / 1e6:>7.1f}MB {old_size / size:>7.1f}x {old_write / write:>6.1f}x "
+              f"{read * 1e3:>7.0f}ms")
@@ -0,0 +1,51 @@
+# %%
+"""
+Streaming throughput on the simulated PicoScope.
+
+Runs ``StreamingAcquisition`` against ``picoscope_fake`` for a few sample
+rates and prints the sustained MS/s per channel, overruns and samples lost in
+the driver. The fake synthesises the signal inside the polling thread, so the
+numbers are a lower bound for what the host side can sustain.
+
+    python benchmarks/bench_streaming.py --duration 5 --out stream_bench
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+from picoscope_streaming import StreamingAcquisition, RawFileSink, RunningStats
+
+
+def bench(sample_interval_ns, duration, folder, n_channels=4):
+    ps = FakePs5000a(noise=0)
+    session = PicoScopeSession(driver=ps)
+    for i, ch in enumerate('ABCD'):
+        session.set_channel(ch, enabled=i < n_channels, range='2V')
+    with session:
+        stream = StreamingAcquisition(session, sample_interval_ns, sinks=[RawFileSink(folder), RunningStats()])
+        stats = stream.run(duration)
+    stats['lost_in_driver'] = ps.stream_lost
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--out', default=None, help='folder for the streamed files (default: temporary)')
+    args = parser.parse_args()
+
+    folder = args.out or tempfile.mkdtemp()
+    print(f"{'interval':>10} {'target':>10} {'achieved':>10} {'overruns':>9} {'dropped':>9} {'lost':>9} {'ring':>6}")
+    for interval in (2000, 1000, 400, 200):
+        stats = bench(interval, args.duration, folder, args.channels)
+        print(f"{interval:>8}ns {stats['target_MSps_per_channel']:>8.2f}MS {stats['throughput_MSps_per_channel']:>8.2f}MS "
+              f"{stats['overruns']:>9} {stats['dropped_samples']:>9} {stats['lost_in_driver']:>9} {stats['max_ring_fill']:>6.0%}")
+    if args.out is None:
+        shutil.rmtree(folder)
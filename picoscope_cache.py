@@ -0,0 +1,281 @@
+# %%
+"""
+Persistent cache of the products derived from each acquisition file.
+
+Acquisition files never change once written, so their spectra and features
+(RMS, peak and mean per channel, dominant frequencies) only have to be
+computed once. They are kept in an SQLite file, keyed by the file path, size
+and mtime and by a fingerprint of the analysis parameters. A file that was
+rewritten, or a change of parameters, gives a new key and is computed again.
+
+The features are a few numbers per file and channel and are always kept, so
+trends over months are answered from the cache without reading raw samples.
+They grow with the archive, not with the use of the cache: a full
+``update(folder)`` (no time range) drops the rows of the files that are no
+longer in the folder. The spectra are larger; their total size is bounded by
+``max_bytes``, and the least recently used ones are dropped first (they are
+recomputed when asked for again).
+
+Spectra and features come from one read of the signals (``file_products``
+of picoscope_spectra.py). Given the output folder of a SpectrumEngine run
+with the same parameters, the cache takes them from its up to date spectrum
+files instead of transforming the archive a second time.
+
+    cache = FeatureCache('ffts/cache.sqlite', max_freq=5000, spectra='ffts/spectra')
+    cache.update('try')                                  # only new or changed files
+    cache.trend('A', 'rms', start='2025-04-01')          # DataFrame: time, path, rms
+    frequencies, amplitude = cache.spectrum('try/aquisition_2025-04-11_17-43-19.parquet', 'A')
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time as time_lib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from picoscope_spectra import WINDOWS, dominant_frequencies, file_products, list_archive, read_file_products
+from picoscope_storage import time_key
+
+FEATURES = ('rms', 'peak', 'mean', 'dominant_hz', 'dominant_mV')
+# Parameters of the spectra, as in SpectrumEngine; the others only change the features
+SPECTRUM_PARAMS = ('window', 'nperseg', 'overlap', 'max_freq', 'channels', 'pad')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT, fingerprint TEXT, size INTEGER, mtime_ns INTEGER, timestamp TEXT, sampling_rate REAL,
+    computed_at REAL, PRIMARY KEY (path, fingerprint));
+CREATE TABLE IF NOT EXISTS features (
+    path TEXT, fingerprint TEXT, channel TEXT, timestamp TEXT, rms REAL, peak REAL, mean REAL,
+    dominant_hz REAL, dominant_mV REAL, peaks TEXT, PRIMARY KEY (path, fingerprint, channel));
+CREATE INDEX IF NOT EXISTS features_time ON features (fingerprint, channel, timestamp);
+CREATE TABLE IF NOT EXISTS spectra (
+    path TEXT, fingerprint TEXT, channel TEXT, df_hz REAL, amplitude BLOB, n_bytes INTEGER, last_access REAL,
+    PRIMARY KEY (path, fingerprint, channel));
+CREATE INDEX IF NOT EXISTS spectra_access ON spectra (last_access);
+"""
+
+
+def parameter_fingerprint(params):
+    """Short hash of the analysis parameters; results computed with other parameters are not reused."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def compute_products(path, params, spectra=None):
+    """
+    Spectra and features of one acquisition file (runs in the worker processes).
+
+    An up to date spectrum file of ``path`` in ``spectra`` (a SpectrumEngine
+    output folder) is read instead of the signals. Returns {'sampling_rate',
+    'timestamp', 'channels': {ch: {features..., 'peaks', 'df_hz', 'amplitude'}}}.
+    """
+    spectrum_params = {key: params[key] for key in SPECTRUM_PARAMS}
+    products = None
+    if spectra is not None:
+        products = read_file_products(os.path.join(spectra, os.path.basename(path)), path, spectrum_params)
+    if products is None:
+        products = file_products(path, spectrum_params)
+    for p in products['channels'].values():
+        frequencies = np.arange(len(p['amplitude'])) * p['df_hz']
+        peaks_hz, peaks_mV = dominant_frequencies(frequencies, p['amplitude'], params['n_peaks'])
+        p['peaks'] = list(zip(peaks_hz, peaks_mV))
+        p['dominant_hz'] = peaks_hz[0] if peaks_hz else None
+        p['dominant_mV'] = peaks_mV[0] if peaks_mV else None
+    return products
+
+
+class FeatureCache:
+    """
+    SQLite cache of spectra and features per acquisition file.
+
+    The analysis parameters (``window``, ``nperseg``, ``overlap``,
+    ``max_freq``, ``channels``, ``pad`` as in SpectrumEngine, plus the number
+    of dominant frequencies ``n_peaks``) are part of the key. ``max_bytes``
+    bounds the stored spectra. ``spectra`` is the output folder of a
+    SpectrumEngine with the same parameters to take the spectra from when
+    they are up to date there. ``workers`` processes compute the missing
+    entries in ``update()``, 0 to compute in this process.
+    """
+
+    def __init__(self, path='ffts/cache.sqlite', max_bytes=256 * 1024 * 1024, window='hann', nperseg=None,
+                 overlap=0.5, max_freq=5000, channels=None, pad=True, n_peaks=3, workers=None, spectra=None):
+        if window not in WINDOWS:
+            raise ValueError(f"Unknown window {window!r}, use one of {list(WINDOWS)}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.params = {'window': window, 'nperseg': nperseg, 'overlap': overlap, 'max_freq': max_freq,
+                       'channels': list(channels) if channels is not None else None, 'pad': pad, 'n_peaks': n_peaks}
+        self.fingerprint = parameter_fingerprint(self.params)
+        self.spectra = spectra
+        self.workers = os.cpu_count() if workers is None else workers
+        self.hits = 0
+        self.misses = 0
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_cached(self, path):
+        """True if ``path`` was computed with these parameters and has not changed since."""
+        stat = os.stat(path)
+        row = self.db.execute("SELECT size, mtime_ns FROM files WHERE path = ? AND fingerprint = ?",
+                              (os.path.abspath(path), self.fingerprint)).fetchone()
+        return row is not None and tuple(row) == (stat.st_size, stat.st_mtime_ns)
+
+    def _store(self, path, stat, products):
+        key = (os.path.abspath(path), self.fingerprint)
+        now = time_lib.time()
+        with self.db:
+            self.db.execute("DELETE FROM features WHERE path = ? AND fingerprint = ?", key)
+            self.db.execute("DELETE FROM spectra WHERE path = ? AND fingerprint = ?", key)
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            key + (stat.st_size, stat.st_mtime_ns, products['timestamp'],
+                                   products['sampling_rate'], now))
+            for ch, p in products['channels'].items():
+                self.db.execute("INSERT INTO features VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                key + (ch, products['timestamp'], p['rms'], p['peak'], p['mean'], p['dominant_hz'],
+                                       p['dominant_mV'], json.dumps(p['peaks'])))
+                amplitude = np.ascontiguousarray(p['amplitude'], dtype=np.float32)
+                self.db.execute("INSERT INTO spectra VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                key + (ch, p['df_hz'], amplitude.tobytes(), amplitude.nbytes, now))
+        self.evict()
+
+    def evict(self):
+        """Drop the least recently used spectra until they fit in ``max_bytes``. Returns the number dropped."""
+        total = self.db.execute("SELECT COALESCE(SUM(n_bytes), 0) FROM spectra").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        dropped = []
+        for rowid, n_bytes in self.db.execute("SELECT rowid, n_bytes FROM spectra ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            dropped.append((rowid,))
+            total -= n_bytes
+        with self.db:
+            self.db.executemany("DELETE FROM spectra WHERE rowid = ?", dropped)
+        return len(dropped)
+
+    def forget_missing(self, folder, files):
+        """Drop the entries, with any parameters, of the files under ``folder`` that are not in ``files``."""
+        root = os.path.join(os.path.abspath(folder), '')
+        present = {os.path.abspath(path) for path in files}
+        gone = [(path,) for path, in self.db.execute("SELECT DISTINCT path FROM files")
+                if path.startswith(root) and path not in present]
+        with self.db:
+            for table in ('files', 'features', 'spectra'):
+                self.db.executemany(f"DELETE FROM {table} WHERE path = ?", gone)
+        return len(gone)
+
+    def get(self, path):
+        """Compute and store the products of ``path`` unless they are cached. Returns True on a cache hit."""
+        if self.is_cached(path):
+            self.hits += 1
+            return True
+        self.misses += 1
+        stat = os.stat(path)
+        self._store(path, stat, compute_products(path, self.params, self.spectra))
+        return False
+
+    def update(self, folder, start=None, end=None):
+        """
+        Bring the cache up to date with the acquisition files of ``folder`` between ``start`` and ``end``.
+
+        Without a time range, what is cached for files no longer in ``folder`` is dropped.
+        """
+        begin = time_lib.perf_counter()
+        files = list_archive(folder, start, end)
+        if start is None and end is None:
+            self.forget_missing(folder, files)
+        missing = [path for path in files if not self.is_cached(path)]
+        self.hits += len(files) - len(missing)
+        self.misses += len(missing)
+        stats = {path: os.stat(path) for path in missing}
+        failed = 0
+        if self.workers == 0 or len(missing) <= 1:
+            for path in missing:
+                try:
+                    self._store(path, stats[path], compute_products(path, self.params, self.spectra))
+                except Exception as e:
+                    print(f"❌ Features of {path} failed: {e}")
+                    failed += 1
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = {path: pool.submit(compute_products, path, self.params, self.spectra) for path in missing}
+                for path, future in futures.items():
+                    try:
+                        self._store(path, stats[path], future.result())
+                    except Exception as e:
+                        print(f"❌ Features of {path} failed: {e}")
+                        failed += 1
+        print(f"✅ Cache of {len(files)} files updated in {time_lib.perf_counter() - begin:.1f} s: "
+              f"{len(missing) - failed} computed, {len(files) - len(missing)} cached, {failed} failed")
+        return len(missing) - failed
+
+    def spectrum(self, path, channel):
+        """(frequencies in Hz, float32 amplitudes in mV) of one channel of ``path``, computed if needed."""
+        key = (os.path.abspath(path), self.fingerprint, channel)
+        row = None
+        if self.is_cached(path):
+            row = self.db.execute("SELECT df_hz, amplitude FROM spectra WHERE path = ? AND fingerprint = ? "
+                                  "AND channel = ?", key).fetchone()
+        if row is None:
+            # Never computed, changed on disk, or evicted
+            self.misses += 1
+            products = compute_products(path, self.params, self.spectra)
+            self._store(path, os.stat(path), products)
+            if channel not in products['channels']:
+                raise KeyError(f"{path} has no channel {channel}")
+            amplitude = products['channels'][channel]['amplitude']
+            return np.arange(len(amplitude)) * products['channels'][channel]['df_hz'], amplitude
+        self.hits += 1
+        with self.db:
+            self.db.execute("UPDATE spectra SET last_access = ? WHERE path = ? AND fingerprint = ? AND channel = ?",
+                            (time_lib.time(),) + key)
+        df_hz, blob = row
+        amplitude = np.frombuffer(blob, dtype=np.float32)
+        return np.arange(len(amplitude)) * df_hz, amplitude
+
+    def features(self, start=None, end=None, channels=None):
+        """Cached features of the files between ``start`` and ``end`` as a DataFrame, in time order."""
+        query = ("SELECT timestamp, path, channel, rms, peak, mean, dominant_hz, dominant_mV, peaks "
+                 "FROM features WHERE fingerprint = ?")
+        args = [self.fingerprint]
+        if start is not None:
+            query += " AND timestamp >= ?"
+            args.append(time_key(start))
+        if end is not None:
+            query += " AND timestamp < ?"
+            args.append(time_key(end))
+        if channels is not None:
+            query += f" AND channel IN ({', '.join('?' * len(channels))})"
+            args.extend(channels)
+        df = pd.read_sql_query(query + " ORDER BY timestamp, channel", self.db, params=args)
+        df['time'] = pd.to_datetime(df['timestamp'], format="%Y-%m-%d_%H-%M-%S")
+        df['peaks'] = df['peaks'].map(json.loads)
+        return df
+
+    def trend(self, channel, feature='rms', start=None, end=None):
+        """One feature of one channel over time: DataFrame with time, path and the feature column."""
+        if feature not in FEATURES:
+            raise ValueError(f"Unknown feature {feature!r}, use one of {FEATURES}")
+        df = self.features(start, end, channels=[channel])
+        return df[['time', 'path', feature]].reset_index(drop=True)
+
+    def stats(self):
+        files, spectra_bytes = self.db.execute(
+            "SELECT (SELECT COUNT(*) FROM files WHERE fingerprint = ?), COALESCE(SUM(n_bytes), 0) FROM spectra",
+            (self.fingerprint,)).fetchone()
+        return {'files': files, 'spectra_bytes': spectra_bytes, 'max_bytes': self.max_bytes, 'hits': self.hits,
+                'misses': self.misses}
@@ -0,0 +1,277 @@
+# %%
+"""
+Catalog of an acquisition archive: what every file holds, answered without opening it.
+
+One SQLite file (``<root>/catalog.sqlite`` by default) has a row per
+capture with its timestamp, format, sampling rate, sample and segment
+counts and downsampling. It also has a row per capture and channel with the
+channel range and the min, max, peak (largest absolute value), mean and RMS
+in mV. Both tables are indexed by time, and the channel table also by peak,
+so a query like "captures between T1 and T2 where channel B peaks above
+500 mV" only reads the index:
+
+    catalog = Catalog('try')
+    catalog.update()                                    # files not in the catalog yet
+    df = catalog.find('2025-04-11', '2025-04-12', channel='B', min_peak=500)
+
+The WritePipeline adds every file it writes, taking the statistics from the
+capture still in memory. ``update()`` indexes archives written before, reading
+each file one row group at a time. Paths are stored relative to the root, so
+the catalog stays valid when the archive is moved or copied. Event windows
+files are not indexed: the background file of their acquisition is.
+"""
+import os
+import sqlite3
+import threading
+import time as time_lib
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from picoscope_convert import capture_views, mv_per_count
+from picoscope_storage import archive_files, is_raw_capture, read_capture, time_key
+
+STATISTICS = ('min_mV', 'max_mV', 'peak_mV', 'mean_mV', 'rms_mV')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    file TEXT PRIMARY KEY, timestamp TEXT, format TEXT, sampling_rate REAL, n_samples INTEGER, n_segments INTEGER,
+    ratio_mode TEXT, downsample_ratio INTEGER, size INTEGER, mtime_ns INTEGER);
+CREATE INDEX IF NOT EXISTS captures_time ON captures (timestamp);
+CREATE TABLE IF NOT EXISTS channels (
+    file TEXT, channel TEXT, timestamp TEXT, range_mV REAL, min_mV REAL, max_mV REAL, peak_mV REAL, mean_mV REAL,
+    rms_mV REAL, PRIMARY KEY (file, channel));
+CREATE INDEX IF NOT EXISTS channels_time ON channels (channel, timestamp);
+CREATE INDEX IF NOT EXISTS channels_peak ON channels (channel, peak_mV);
+"""
+
+
+class SummaryStats:
+    """
+    Running min, max, sum and sum of squares per channel, fed a capture, a chunk or a column at a time.
+
+    Sums are taken in float64 over slices of ``block`` values, so int16
+    captures of any length need no large temporary array. For min/max
+    envelopes (AGGREGATE downsampling, event backgrounds) the mean and RMS
+    are those of the midpoint of every block.
+    """
+
+    def __init__(self, block=1024 * 1024):
+        self.block = block
+        self._channels = {}
+
+    def add(self, channel, values, scale=1.0, low_values=None):
+        """Add ``values`` (counts times ``scale`` give mV); with ``low_values`` they are the max and min of blocks."""
+        values = np.asarray(values).ravel()
+        stats = self._channels.setdefault(channel, {'n': 0, 'min': np.inf, 'max': -np.inf, 'sum': 0.0,
+                                                    'sum2': 0.0, 'scale': scale})
+        if len(values) == 0:
+            return
+        low = values if low_values is None else np.asarray(low_values).ravel()
+        stats['min'] = min(stats['min'], float(low.min()))
+        stats['max'] = max(stats['max'], float(values.max()))
+        for i in range(0, len(values), self.block):
+            block = values[i:i + self.block].astype(np.float64)
+            if low_values is not None:
+                block += low[i:i + self.block]
+                block *= 0.5
+            stats['sum'] += block.sum()
+            stats['sum2'] += block @ block
+        stats['n'] += len(values)
+
+    def add_capture(self, capture):
+        """Add every channel of a capture dictionary (or of a chunk from ``capture_block_chunks``)."""
+        lows = capture_views(capture, 'buffers_min')
+        for ch, counts in capture_views(capture).items():
+            self.add(ch, counts, mv_per_count(capture['ranges'][ch], capture['maxADC']), lows.get(ch))
+
+    def result(self):
+        """{channel: {'min_mV', 'max_mV', 'peak_mV', 'mean_mV', 'rms_mV'}}."""
+        result = {}
+        for ch, stats in self._channels.items():
+            if stats['n'] == 0:
+                continue
+            scale = stats['scale']
+            low, high = stats['min'] * scale, stats['max'] * scale
+            result[ch] = {'min_mV': low, 'max_mV': high, 'peak_mV': max(abs(low), abs(high)),
+                          'mean_mV': stats['sum'] / stats['n'] * scale,
+                          'rms_mV': np.sqrt(stats['sum2'] / stats['n']) * scale}
+        return result
+
+
+def file_info(path):
+    """
+    What the catalog keeps of an acquisition file of either format, from its metadata only.
+
+    Returns ({timestamp, format, sampling_rate, n_samples, n_segments, ratio_mode, downsample_ratio},
+    {channel: range in mV, None for mV files}).
+    """
+    if is_raw_capture(path):
+        acq = read_capture(path)
+        ratio_mode, ratio = acq.downsampling
+        n_segments = acq.metadata.get('n_segments', 1)
+        info = {'timestamp': acq.timestamp, 'format': 'raw', 'sampling_rate': acq.sampling_rate,
+                'n_samples': acq.n_samples // n_segments, 'n_segments': n_segments, 'ratio_mode': ratio_mode,
+                'downsample_ratio': ratio}
+        return info, {ch: acq.metadata['range_mV'][ch] for ch in acq.channels}
+
+    # Old mV file: the constant columns come from the first row group
+    parquet = pq.ParquetFile(path, memory_map=True)
+    names = parquet.schema_arrow.names
+    constants = [name for name in ('sampling_rate', 'timestamp', 'ratio_mode', 'downsample_ratio') if name in names]
+    first = parquet.read_row_group(0, columns=constants).to_pandas()
+    n_segments = 1
+    if 'segment' in names:
+        n_segments = len(np.unique(parquet.read(columns=['segment']).column(0).to_numpy()))
+    info = {'timestamp': str(first['timestamp'].iloc[0]), 'format': 'mV',
+            'sampling_rate': float(first['sampling_rate'].iloc[0]),
+            'n_samples': parquet.metadata.num_rows // n_segments, 'n_segments': n_segments,
+            'ratio_mode': str(first['ratio_mode'].iloc[0]) if 'ratio_mode' in first else 'NONE',
+            'downsample_ratio': int(first['downsample_ratio'].iloc[0]) if 'downsample_ratio' in first else 1}
+    return info, {ch: None for ch in 'ABCD' if f'adc2mVCh{ch}Max' in names}
+
+
+def file_stats(path):
+    """SummaryStats of every channel of an acquisition file, read one row group at a time."""
+    stats = SummaryStats()
+    if is_raw_capture(path):
+        acq = read_capture(path)
+        columns = list(acq.channels) + [f'{ch}_min' for ch in acq.min_channels]
+        for i in range(acq.parquet.metadata.num_row_groups):
+            table = acq.parquet.read_row_group(i, columns=columns)
+            for ch in acq.channels:
+                low = table.column(f'{ch}_min').to_numpy() if ch in acq.min_channels else None
+                scale = mv_per_count(acq.metadata['ranges'][ch], acq.metadata['maxADC'])
+                stats.add(ch, table.column(ch).to_numpy(), scale, low)
+        return stats
+
+    parquet = pq.ParquetFile(path, memory_map=True)
+    names = parquet.schema_arrow.names
+    channels = [ch for ch in 'ABCD' if f'adc2mVCh{ch}Max' in names]
+    columns = [f'adc2mVCh{ch}{kind}' for ch in channels for kind in ('Max', 'Min') if f'adc2mVCh{ch}{kind}' in names]
+    for i in range(parquet.metadata.num_row_groups):
+        table = parquet.read_row_group(i, columns=columns)
+        for ch in channels:
+            low = table.column(f'adc2mVCh{ch}Min').to_numpy() if f'adc2mVCh{ch}Min' in names else None
+            stats.add(ch, table.column(f'adc2mVCh{ch}Max').to_numpy(), 1.0, low)
+    return stats
+
+
+class Catalog:
+    """
+    SQLite index of the acquisition files under ``root``.
+
+    Safe to use from the WritePipeline's writer thread and the main thread
+    at the same time.
+    """
+
+    def __init__(self, root='.', path=None):
+        self.root = root
+        self.path = path or os.path.join(root, 'catalog.sqlite')
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _key(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def add(self, path, stats=None):
+        """Index one file, with the SummaryStats of its capture if it is still in memory, else by reading it."""
+        info, ranges = file_info(path)
+        if stats is None:
+            stats = file_stats(path)
+        stat = os.stat(path)
+        key = self._key(path)
+        timestamp = info['timestamp']
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM channels WHERE file = ?", (key,))
+            self.db.execute("INSERT OR REPLACE INTO captures VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (key, timestamp, info['format'], info['sampling_rate'], info['n_samples'],
+                             info['n_segments'], info['ratio_mode'], info['downsample_ratio'], stat.st_size,
+                             stat.st_mtime_ns))
+            self.db.executemany("INSERT INTO channels VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                [(key, ch, timestamp, ranges.get(ch), *(float(s[name]) for name in STATISTICS))
+                                 for ch, s in stats.result().items()])
+        return key
+
+    def is_indexed(self, path):
+        """True if ``path`` is in the catalog and has not changed since."""
+        stat = os.stat(path)
+        with self._lock:
+            row = self.db.execute("SELECT size, mtime_ns FROM captures WHERE file = ?", (self._key(path),)).fetchone()
+        return row is not None and tuple(row) == (stat.st_size, stat.st_mtime_ns)
+
+    def update(self, start=None, end=None):
+        """Index the files under the root that are new or changed, and drop the ones that are gone."""
+        begin = time_lib.perf_counter()
+        start = pd.Timestamp(start).to_pydatetime() if start is not None else None
+        end = pd.Timestamp(end).to_pydatetime() if end is not None else None
+        paths = archive_files(self.root, start, end)
+        added = 0
+        for path in paths:
+            if self.is_indexed(path):
+                continue
+            try:
+                self.add(path)
+                added += 1
+            except Exception as e:
+                print(f"❌ Could not index {path}: {e}")
+        if start is None and end is None:
+            present = {self._key(path) for path in paths}
+            with self._lock, self.db:
+                gone = [(file,) for file, in self.db.execute("SELECT file FROM captures") if file not in present]
+                self.db.executemany("DELETE FROM captures WHERE file = ?", gone)
+                self.db.executemany("DELETE FROM channels WHERE file = ?", gone)
+        print(f"✅ Catalog of {len(paths)} files updated in {time_lib.perf_counter() - begin:.1f} s: {added} indexed")
+        return added
+
+    def find(self, start=None, end=None, channel=None, min_peak=None, max_peak=None, min_rms=None, max_rms=None):
+        """
+        Captures from ``start`` up to (excluding) ``end``, in time order, as a DataFrame.
+
+        With ``channel``, only the captures of that channel whose peak and RMS
+        (mV) lie within the given bounds, and the channel statistics are
+        added as columns. ``path`` is the file path under the root.
+        """
+        query = "SELECT c.*"
+        args = []
+        if channel is not None:
+            query += ", " + ", ".join(f"s.{name}" for name in ('range_mV',) + STATISTICS)
+            query += " FROM channels s JOIN captures c ON c.file = s.file WHERE s.channel = ?"
+            args.append(channel)
+            time_column = 's.timestamp'
+            for column, bound, operator in (('peak_mV', min_peak, '>='), ('peak_mV', max_peak, '<='),
+                                            ('rms_mV', min_rms, '>='), ('rms_mV', max_rms, '<=')):
+                if bound is not None:
+                    query += f" AND s.{column} {operator} ?"
+                    args.append(bound)
+        else:
+            query += " FROM captures c WHERE 1"
+            time_column = 'c.timestamp'
+        if start is not None:
+            query += f" AND {time_column} >= ?"
+            args.append(time_key(start))
+        if end is not None:
+            query += f" AND {time_column} < ?"
+            args.append(time_key(end))
+        with self._lock:
+            df = pd.read_sql_query(query + f" ORDER BY {time_column}", self.db, params=args)
+        df.insert(0, 'path', [os.path.join(self.root, file) for file in df['file']])
+        return df
+
+    def paths(self, start=None, end=None):
+        """Paths of the captures from ``start`` up to (excluding) ``end``, in time order."""
+        return list(self.find(start, end)['path'])
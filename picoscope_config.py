@@ -0,0 +1,254 @@
+# %%
+"""
+Acquisition configuration read from a JSON file instead of constants in the script.
+
+The file lists the channels, the trigger, the capture (sample rate or
+timebase, length, pre-trigger samples, downsampling) and where the files go.
+Everything that is left out takes the value of ``DEFAULT_CONFIG``, which is
+the setup picoscope_script.py always used. Channels that are disabled or not
+listed are switched off on the scope, so they are neither transferred nor
+stored, and fewer enabled channels allow faster timebases.
+
+    config = load_config('picoscope_config.json')
+    session = PicoScopeSession(resolution=config['resolution'])
+    apply_config(session, config)
+
+With ``capture.sample_rate`` the session asks the driver for the fastest
+timebase that does not exceed that rate (``PicoScopeSession.solve_timebase``)
+and caps the number of samples to the memory; ``capture.timebase`` sets the
+timebase number directly.
+
+``schedule.profiles`` names the acquisitions to run and when: each profile
+has ``every`` (seconds) or ``cron``, plus any resolution, channels, trigger,
+capture or output settings that differ from the rest of the file. The
+profile name goes into the names of its files, so it is limited to letters,
+digits, '-' and '_'.
+
+    for name, (timing, profile) in profile_configs(config).items():
+        scheduler.add(name, make_schedule(timing), ...)
+
+``events`` turns on event detection (picoscope_events.py): only the windows
+around the hits of its ``rules`` are stored at full rate, next to a min/max
+background of the whole capture.
+"""
+import copy
+import json
+import re
+
+from picoscope_events import make_rule
+from picoscope_metrics import PROFILES
+from picoscope_schedule import MISSED_POLICIES, make_schedule
+from picoscope_session import CHANNELS, RATIO_MODES
+
+RESOLUTIONS = ('8BIT', '12BIT', '14BIT', '15BIT', '16BIT')
+COUPLINGS = ('AC', 'DC')
+RANGES = ('10MV', '20MV', '50MV', '100MV', '200MV', '500MV', '1V', '2V', '5V', '10V', '20V', '50V')
+DIRECTIONS = ('ABOVE', 'BELOW', 'RISING', 'FALLING', 'RISING_OR_FALLING')
+
+DEFAULT_CONFIG = {
+    'resolution': '12BIT',
+    'channels': {
+        'A': {'enabled': True, 'coupling': 'DC', 'range': '20V', 'offset': 0.0},
+        'B': {'enabled': True, 'coupling': 'DC', 'range': '2V', 'offset': 0.0},
+        'C': {'enabled': True, 'coupling': 'DC', 'range': '2V', 'offset': 0.0},
+        'D': {'enabled': True, 'coupling': 'DC', 'range': '2V', 'offset': 0.0},
+    },
+    # level and hysteresis in ADC counts
+    'trigger': {'sources': ['A', 'B', 'C', 'D'], 'level': 1, 'hysteresis': 10, 'direction': 'RISING_OR_FALLING'},
+    'capture': {
+        # either sample_rate (S/s) or timebase, and either duration (s) or n_samples
+        'sample_rate': 500000,
+        'timebase': None,
+        'duration': 3.0,
+        'n_samples': None,
+        'pre_trigger_samples': 10000,
+        'downsampling': {'mode': 'NONE', 'ratio': 1},
+    },
+    # layout "date": files in YYYY/MM/DD folders; catalog: index them in <local_folder>/catalog.sqlite;
+    # plots_signal: save signal/signal_<timestamp>.png of every capture
+    'output': {'local_folder': '.', 'destinations': ['try'], 'file_format': 'raw', 'layout': 'date', 'catalog': True,
+               'plots_signal': False},
+    # stage timings per cycle (picoscope_metrics.py); profile: null, "cprofile" or "tracemalloc"
+    'metrics': {'enabled': False, 'prometheus_path': 'metrics/picoscope.prom', 'jsonl_path': 'metrics/cycles.jsonl',
+                'profile': None},
+    # when to capture (picoscope_schedule.py); missed: "coalesce" or "skip" the slots missed under overload
+    'schedule': {'missed': 'coalesce', 'tolerance': 1.0, 'profiles': {'default': {'every': 10}}},
+    # store only the windows around events (picoscope_events.py), e.g. rules:
+    # [{"type": "excursion", "channel": "B", "level_mV": 500}, {"type": "edge", "channel": "A", "delta_mV": 2000}]
+    'events': {'enabled': False, 'pre_samples': 10000, 'post_samples': 10000, 'background_ratio': 1000, 'rules': []},
+}
+
+# Keys of a schedule profile that say when it runs; the others override the acquisition settings
+SCHEDULE_KEYS = ('every', 'offset', 'cron')
+PROFILE_KEYS = ('resolution', 'channels', 'trigger', 'capture', 'output', 'events')
+
+CHANNEL_DEFAULT = {'enabled': False, 'coupling': 'DC', 'range': '2V', 'offset': 0.0}
+
+
+def _merge(defaults, values, where):
+    """``defaults`` updated with ``values``, refusing keys the defaults do not have."""
+    merged = copy.deepcopy(defaults)
+    for key, value in values.items():
+        if key not in defaults:
+            raise ValueError(f"{where}{key}: unknown setting, expected one of {list(defaults)}")
+        if isinstance(defaults[key], dict) and key not in ('channels', 'profiles') and value is not None:
+            if not isinstance(value, dict):
+                raise ValueError(f"{where}{key}: expected an object")
+            merged[key] = _merge(defaults[key], value, f'{where}{key}.')
+        else:
+            merged[key] = value
+    return merged
+
+
+def _choice(value, choices, where):
+    if value not in choices:
+        raise ValueError(f"{where}: {value!r} is not one of {list(choices)}")
+    return value
+
+
+def _replace_length(capture, given):
+    # A timebase or a sample count given alone replaces the sample rate or duration it is merged with
+    if 'timebase' in given and 'sample_rate' not in given:
+        capture['sample_rate'] = None
+    if 'n_samples' in given and 'duration' not in given:
+        capture['duration'] = None
+
+
+def validate_config(config):
+    """Complete ``config`` with the defaults and check it. Raises ValueError naming the faulty setting."""
+    given = config.get('capture') or {}
+    config = _merge(DEFAULT_CONFIG, config, '')
+    _replace_length(config['capture'], given)
+    _choice(config['resolution'], RESOLUTIONS, 'resolution')
+
+    # A channels section replaces the default one: the channels it leaves out are off
+    channels = {}
+    for ch, settings in config['channels'].items():
+        _choice(ch, CHANNELS, 'channels')
+        channel = _merge(CHANNEL_DEFAULT, dict({'enabled': True}, **settings), f'channels.{ch}.')
+        _choice(channel['coupling'], COUPLINGS, f'channels.{ch}.coupling')
+        _choice(channel['range'], RANGES, f'channels.{ch}.range')
+        channels[ch] = channel
+    config['channels'] = channels
+    enabled = [ch for ch in CHANNELS if ch in channels and channels[ch]['enabled']]
+    if not enabled:
+        raise ValueError("channels: at least one channel has to be enabled")
+
+    trigger = config['trigger']
+    if trigger is not None:
+        for ch in trigger['sources']:
+            _choice(ch, CHANNELS, 'trigger.sources')
+        _choice(trigger['direction'], DIRECTIONS, 'trigger.direction')
+        # Only enabled channels can trigger; no source left means no trigger
+        trigger['sources'] = [ch for ch in trigger['sources'] if ch in enabled]
+
+    capture = config['capture']
+    if (capture['sample_rate'] is None) == (capture['timebase'] is None):
+        raise ValueError("capture: give either sample_rate or timebase")
+    if (capture['duration'] is None) == (capture['n_samples'] is None):
+        raise ValueError("capture: give either duration or n_samples")
+    if capture['timebase'] is not None and capture['n_samples'] is None:
+        raise ValueError("capture: with a timebase number the length has to be given as n_samples")
+    if capture['sample_rate'] is not None and capture['sample_rate'] <= 0:
+        raise ValueError("capture.sample_rate: has to be positive")
+    # Most samples the capture can have: the scope never samples faster than the rate asked
+    if capture['n_samples'] is not None:
+        length = capture['n_samples']
+    else:
+        length = capture['duration'] * capture['sample_rate']
+    if not 0 <= capture['pre_trigger_samples'] <= length:
+        raise ValueError(f"capture.pre_trigger_samples: {capture['pre_trigger_samples']} is not between 0 and the "
+                         f"{length:.0f} samples of the capture")
+    _choice(capture['downsampling']['mode'].upper(), RATIO_MODES, 'capture.downsampling.mode')
+    _choice(config['output']['file_format'], ('raw', 'mV'), 'output.file_format')
+    _choice(config['output']['layout'], ('date', 'flat'), 'output.layout')
+    _choice(config['metrics']['profile'], PROFILES, 'metrics.profile')
+
+    events = config['events']
+    for key in ('pre_samples', 'post_samples'):
+        if events[key] < 0:
+            raise ValueError(f"events.{key}: cannot be negative")
+    if events['background_ratio'] < 1:
+        raise ValueError("events.background_ratio: has to be at least 1")
+    for i, rule in enumerate(events['rules']):
+        _choice(rule.get('channel'), CHANNELS, f'events.rules[{i}].channel')
+        try:
+            make_rule(rule)
+        except ValueError as e:
+            raise ValueError(f"events.rules[{i}]: {e}") from None
+    if events['enabled'] and not events['rules']:
+        raise ValueError("events: enabled without rules")
+
+    schedule = config['schedule']
+    _choice(schedule['missed'], MISSED_POLICIES, 'schedule.missed')
+    if not schedule['profiles']:
+        raise ValueError("schedule.profiles: at least one profile is needed")
+    for name, profile in schedule['profiles'].items():
+        where = f'schedule.profiles.{name}'
+        if not re.fullmatch(r'[A-Za-z0-9_-]+', name):
+            raise ValueError(f"{where}: the name goes into file names, use only letters, digits, '-' and '_'")
+        for key in profile:
+            _choice(key, SCHEDULE_KEYS + PROFILE_KEYS, where)
+        if ('every' in profile) == ('cron' in profile):
+            raise ValueError(f"{where}: give either every or cron")
+        try:
+            make_schedule(profile)
+        except ValueError as e:
+            raise ValueError(f"{where}: {e}") from None
+    return config
+
+
+def profile_configs(config):
+    """
+    The schedule and the complete acquisition config of every profile of a validated config.
+
+    A profile's settings are merged over the rest of the file like the file
+    is merged over the defaults: a channels section replaces the file's one.
+    """
+    base = {key: value for key, value in config.items() if key != 'schedule'}
+    profiles = {}
+    for name, profile in config['schedule']['profiles'].items():
+        timing = {key: value for key, value in profile.items() if key in SCHEDULE_KEYS}
+        overrides = {key: value for key, value in profile.items() if key in PROFILE_KEYS}
+        merged = _merge(base, overrides, f'schedule.profiles.{name}.')
+        _replace_length(merged['capture'], overrides.get('capture') or {})
+        try:
+            profiles[name] = (timing, validate_config(merged))
+        except ValueError as e:
+            raise ValueError(f"schedule.profiles.{name}.{e}") from None
+    return profiles
+
+
+def load_config(path=None):
+    """Read and validate a JSON config file; without a path, the defaults."""
+    if path is None:
+        return validate_config({})
+    with open(path) as f:
+        return validate_config(json.load(f))
+
+
+def apply_config(session, config):
+    """Record the channels, trigger, capture length and downsampling of ``config`` in the session."""
+    if session.resolution != config['resolution']:
+        # The resolution is chosen when the unit is opened; the next apply() reopens it
+        session.close()
+        session.resolution = config['resolution']
+    session.channels = {}
+    for ch, channel in config['channels'].items():
+        session.set_channel(ch, enabled=channel['enabled'], coupling=channel['coupling'], range=channel['range'],
+                            offset=channel['offset'])
+
+    trigger = config['trigger']
+    if trigger is not None and trigger['sources']:
+        session.set_trigger(trigger['sources'], level=trigger['level'], hysteresis=trigger['hysteresis'],
+                            direction=trigger['direction'])
+    else:
+        session.trigger = None
+
+    capture = config['capture']
+    if capture['timebase'] is not None:
+        session.set_timebase(capture['timebase'], capture['n_samples'], capture['pre_trigger_samples'])
+    else:
+        session.set_sample_rate(capture['sample_rate'], n_samples=capture['n_samples'], duration=capture['duration'],
+                                pre_trigger_samples=capture['pre_trigger_samples'])
+    session.set_downsampling(capture['downsampling']['mode'], capture['downsampling']['ratio'])
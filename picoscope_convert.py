@@ -0,0 +1,79 @@
+# %%
+"""
+Vectorised ADC count -> mV conversion on zero-copy views of the capture buffers.
+
+picosdk's ``adc2mV`` converts one sample at a time in a list comprehension
+and returns a list of Python floats. Here the ctypes buffers are viewed as
+NumPy int16 arrays without copying, and the conversion is one multiply per
+channel into a float32 array that can be reused from one capture to the next.
+
+    views = capture_views(capture)                    # raw counts, no copy
+    converter = MillivoltConverter()
+    mV = converter.convert(capture)                   # {'A': float32 array, ...}
+"""
+import numpy as np
+
+
+# Full scale of the PS5000A_RANGE enum values, in mV (same table as picosdk.functions.adc2mV)
+channelInputRanges = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000]
+
+
+def buffer_view(buffer):
+    """int16 NumPy view of a ctypes capture buffer (or of an array), sharing its memory."""
+    if isinstance(buffer, np.ndarray):
+        return buffer
+    return np.frombuffer(buffer, dtype=np.int16)
+
+
+def capture_views(capture, key='buffers'):
+    """
+    Views of the captured samples of every channel, trimmed to the returned sample count.
+
+    ``key='buffers_min'`` gives the Min buffers of an AGGREGATE downsampled
+    capture (empty if the capture has none).
+    """
+    n = capture['n_samples']
+    return {ch: buffer_view(buffer)[..., :n] for ch, buffer in capture.get(key, {}).items()}
+
+
+def mv_per_count(range, maxADC):
+    """Scale factor from ADC counts to mV for a PS5000A_RANGE value."""
+    maxADC = getattr(maxADC, 'value', maxADC)
+    return channelInputRanges[range] / maxADC
+
+
+def adc_to_mv(bufferADC, range, maxADC, out=None):
+    """
+    Convert ADC counts to mV with one vectorised multiply.
+
+    ``out`` is an optional float32 array of the same shape to write into;
+    a new one is allocated otherwise.
+    """
+    counts = buffer_view(bufferADC)
+    if out is None:
+        out = np.empty(counts.shape, dtype=np.float32)
+    np.multiply(counts, np.float32(mv_per_count(range, maxADC)), out=out)
+    return out
+
+
+class MillivoltConverter:
+    """
+    Converts captures to mV into float32 arrays kept between captures.
+
+    The arrays returned by ``convert()`` are overwritten by the next call,
+    so copy them (or write them out) first if they have to outlive it. Not
+    thread-safe: use one converter per thread.
+    """
+
+    def __init__(self):
+        self.outputs = {}
+
+    def convert(self, capture, key='buffers'):
+        """{channel: float32 mV} of the ``key`` buffers of a capture ('buffers_min' for the Min buffers)."""
+        mV = {}
+        for ch, counts in capture_views(capture, key).items():
+            out = self.outputs.get((key, ch))
+            if out is None or out.shape != counts.shape:
+                out = self.outputs[(key, ch)] = np.empty(counts.shape, dtype=np.float32)
+            mV[ch] = adc_to_mv(counts, capture['ranges'][ch], capture['maxADC'], out=out)
+        return mV
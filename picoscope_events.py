@@ -0,0 +1,248 @@
+# %%
+"""
+Event detection on the captured counts: keep the windows around events at full rate plus a decimated background.
+
+With a trigger that fires on almost anything, every capture stores all of
+its samples whether something happened or not. ``EventDetector`` runs after
+GetValues on the int16 counts of every channel (vectorised, no conversion to
+mV: the levels are converted to counts once per capture) and applies rules:
+
+* ``Excursion``: samples beyond a level in mV ('above', 'below' or 'abs'),
+* ``Edge``: a change of more than ``delta_mV`` over ``lag`` samples,
+* ``SpectralLine``: the amplitude at a frequency, per block of ``nperseg``
+  samples, above ``min_mV`` (one windowed DFT bin per block).
+
+Every hit is widened by ``pre_samples`` / ``post_samples`` and overlapping
+windows are merged. ``reduce()`` returns two capture dictionaries that the
+writers of picoscope_storage.py take as they are: the samples of the windows
+at full rate, one after the other (their sample ranges and the number of
+hits of every rule are in the metadata), and the whole capture as a min/max envelope of
+``background_ratio`` samples (stored like an AGGREGATE downsampled capture).
+
+    detector = EventDetector([Excursion('B', 500), Edge('A', 2000, lag=4)], pre_samples=5000, post_samples=20000)
+    events, background = detector.reduce(capture)      # events is None when nothing fired
+    write_capture(background, 'aquisition_....parquet')
+    if events is not None:
+        write_capture(events, 'events_....parquet')
+
+Rules come from the ``events`` section of picoscope_config.json through
+``make_rule``: {"type": "excursion", "channel": "B", "level_mV": 500}.
+"""
+import numpy as np
+
+from picoscope_convert import capture_views, mv_per_count
+
+DIRECTIONS = ('above', 'below', 'abs')
+
+
+def runs(mask):
+    """(start, stop) sample ranges of the runs of True in a boolean array, as an (n, 2) int64 array."""
+    edges = np.diff(mask.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    return np.column_stack((starts, stops)).astype(np.int64)
+
+
+def merge_windows(ranges, pre_samples, post_samples, n):
+    """Widen the (start, stop) ranges by pre/post samples, clip them to [0, n) and merge the overlapping ones."""
+    if len(ranges) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    ranges = ranges[np.argsort(ranges[:, 0], kind='stable')]
+    starts = np.maximum(ranges[:, 0] - pre_samples, 0)
+    stops = np.minimum(ranges[:, 1] + post_samples, n)
+    # A window starts a new group when it begins after every earlier window has ended
+    reach = np.maximum.accumulate(stops)
+    first = np.flatnonzero(np.concatenate(([True], starts[1:] > reach[:-1])))
+    return np.column_stack((starts[first], np.maximum.reduceat(stops, first)))
+
+
+def _max_adc(capture):
+    # The session's maxADC is a ctypes value it may change, a reduced capture keeps its own copy
+    return int(getattr(capture['maxADC'], 'value', capture['maxADC']))
+
+
+class Excursion:
+    """Samples of ``channel`` above ``level_mV``, below it, or with ``abs`` beyond +-level_mV."""
+
+    def __init__(self, channel, level_mV, direction='abs'):
+        if direction not in DIRECTIONS:
+            raise ValueError(f"direction must be one of {DIRECTIONS}, not {direction!r}")
+        self.channel = channel
+        self.level_mV = float(level_mV)
+        self.direction = direction
+
+    def detect(self, counts, scale, interval_ns):
+        level = self.level_mV / scale
+        if self.direction == 'above':
+            return runs(counts > level)
+        if self.direction == 'below':
+            return runs(counts < level)
+        return runs(np.abs(counts, dtype=np.int32) > abs(level))
+
+    def __repr__(self):
+        return f'Excursion({self.channel!r}, {self.level_mV:g}, {self.direction!r})'
+
+
+class Edge:
+    """Changes of ``channel`` by more than ``delta_mV`` (up or down) over ``lag`` samples."""
+
+    def __init__(self, channel, delta_mV, lag=1):
+        if lag < 1:
+            raise ValueError(f"lag has to be at least 1, not {lag}")
+        self.channel = channel
+        self.delta_mV = float(delta_mV)
+        self.lag = int(lag)
+
+    def detect(self, counts, scale, interval_ns):
+        if len(counts) <= self.lag:
+            return np.empty((0, 2), dtype=np.int64)
+        # int32 so the difference of two int16 counts cannot overflow
+        step = np.subtract(counts[self.lag:], counts[:-self.lag], dtype=np.int32)
+        np.abs(step, out=step)
+        hits = runs(step > self.delta_mV / scale)
+        # the edge spans both samples of the difference
+        hits[:, 1] += self.lag
+        return hits
+
+    def __repr__(self):
+        return f'Edge({self.channel!r}, {self.delta_mV:g}, lag={self.lag})'
+
+
+class SpectralLine:
+    """
+    Blocks of ``nperseg`` samples of ``channel`` where the amplitude at ``frequency`` (Hz) exceeds ``min_mV``.
+
+    One Hann-windowed DFT bin per block, computed as two matrix-vector
+    products, instead of a full FFT of every block.
+    """
+
+    def __init__(self, channel, frequency, min_mV, nperseg=4096):
+        if frequency <= 0 or nperseg < 2:
+            raise ValueError("frequency and nperseg have to be positive")
+        self.channel = channel
+        self.frequency = float(frequency)
+        self.min_mV = float(min_mV)
+        self.nperseg = int(nperseg)
+        self._kernel = None
+
+    def _kernels(self, interval_ns):
+        if self._kernel is None or self._kernel[0] != interval_ns:
+            window = np.hanning(self.nperseg)
+            phase = 2 * np.pi * self.frequency * interval_ns * 1e-9 * np.arange(self.nperseg)
+            # amplitude of a sine of the bin frequency, corrected for the window gain
+            gain = 2 / window.sum()
+            kernel = np.column_stack((window * np.cos(phase), window * np.sin(phase))) * gain
+            self._kernel = (interval_ns, kernel.astype(np.float32))
+        return self._kernel[1]
+
+    def detect(self, counts, scale, interval_ns):
+        n_blocks = len(counts) // self.nperseg
+        if n_blocks == 0:
+            return np.empty((0, 2), dtype=np.int64)
+        blocks = counts[:n_blocks * self.nperseg].reshape(n_blocks, self.nperseg).astype(np.float32)
+        parts = blocks @ self._kernels(interval_ns)
+        amplitude = np.hypot(parts[:, 0], parts[:, 1]) * scale
+        hits = runs(amplitude > self.min_mV)
+        return hits * self.nperseg
+
+    def __repr__(self):
+        return f'SpectralLine({self.channel!r}, {self.frequency:g}, {self.min_mV:g}, nperseg={self.nperseg})'
+
+
+RULES = {'excursion': Excursion, 'edge': Edge, 'line': SpectralLine}
+
+
+def make_rule(spec):
+    """A rule from a config entry: {'type': 'excursion' | 'edge' | 'line', 'channel': 'A', ...parameters}."""
+    spec = dict(spec)
+    kind = spec.pop('type', None)
+    if kind not in RULES:
+        raise ValueError(f"rule type must be one of {list(RULES)}, not {kind!r}")
+    try:
+        return RULES[kind](**spec)
+    except TypeError as e:
+        raise ValueError(f"{kind} rule: {e}") from None
+
+
+class EventDetector:
+    """
+    Finds the events of a capture and keeps the windows around them plus a min/max background.
+
+    ``last_events`` holds the (start, stop) hits of every rule in the last capture,
+    ``last_windows`` the merged windows as an (n, 2) array of sample ranges.
+    """
+
+    def __init__(self, rules, pre_samples=10000, post_samples=10000, background_ratio=1000):
+        if background_ratio < 1:
+            raise ValueError(f"background_ratio has to be at least 1, not {background_ratio}")
+        self.rules = list(rules)
+        self.pre_samples = int(pre_samples)
+        self.post_samples = int(post_samples)
+        self.background_ratio = int(background_ratio)
+        self.last_events = {}
+        self.last_windows = np.empty((0, 2), dtype=np.int64)
+
+    def detect(self, capture):
+        """Merged windows, an (n, 2) array of (start, stop) sample indices, of a block capture."""
+        if 'n_segments' in capture:
+            raise ValueError("event detection works on block captures, not on rapid block ones")
+        views = capture_views(capture)
+        interval = capture['time_interval_ns']
+        events = {}
+        for rule in self.rules:
+            if rule.channel not in views:
+                continue
+            scale = mv_per_count(capture['ranges'][rule.channel], capture['maxADC'])
+            events[repr(rule)] = rule.detect(views[rule.channel], scale, interval)
+        ranges = np.concatenate(list(events.values())) if events else np.empty((0, 2), dtype=np.int64)
+        self.last_events = events
+        self.last_windows = merge_windows(ranges, self.pre_samples, self.post_samples, capture['n_samples'])
+        return self.last_windows
+
+    def background(self, capture):
+        """
+        The capture as the min and max of every ``background_ratio`` samples, as an AGGREGATE capture dictionary.
+
+        The samples after the last full block are dropped.
+        """
+        ratio = self.background_ratio
+        n = capture['n_samples'] // ratio
+        lows = capture_views(capture, 'buffers_min')
+        buffers, buffers_min = {}, {}
+        for ch, counts in capture_views(capture).items():
+            low = lows.get(ch, counts)
+            buffers[ch] = counts[:n * ratio].reshape(n, ratio).max(axis=1)
+            buffers_min[ch] = low[:n * ratio].reshape(n, ratio).min(axis=1)
+        background = dict(capture, buffers=buffers, buffers_min=buffers_min, n_samples=n, maxADC=_max_adc(capture),
+                          time_interval_ns=capture['time_interval_ns'] * ratio,
+                          pre_trigger_samples=capture.get('pre_trigger_samples', 0) // ratio,
+                          ratio_mode='AGGREGATE', downsample_ratio=capture.get('downsample_ratio', 1) * ratio,
+                          raw_time_interval_ns=capture.get('raw_time_interval_ns', capture['time_interval_ns']))
+        return background
+
+    def windows(self, capture, windows):
+        """The samples of ``windows`` (at least one) at full rate, one after the other, as a capture dictionary."""
+        def cut(views):
+            return {ch: np.concatenate([counts[start:stop] for start, stop in windows]) for ch, counts in views.items()}
+
+        n = int((windows[:, 1] - windows[:, 0]).sum())
+        events = dict(capture, buffers=cut(capture_views(capture)), n_samples=n, maxADC=_max_adc(capture),
+                      windows=[[int(start), int(stop)] for start, stop in windows],
+                      events={rule: len(hits) for rule, hits in self.last_events.items()})
+        if 'buffers_min' in capture:
+            events['buffers_min'] = cut(capture_views(capture, 'buffers_min'))
+        return events
+
+    def reduce(self, capture):
+        """(windows capture or None when nothing fired, background capture). Neither shares memory with the capture."""
+        windows = self.detect(capture)
+        events = self.windows(capture, windows) if len(windows) else None
+        return events, self.background(capture)
+
+
+def make_detector(spec):
+    """EventDetector from the ``events`` section of a validated config, or None when it is not enabled."""
+    if not spec['enabled']:
+        return None
+    return EventDetector([make_rule(rule) for rule in spec['rules']], spec['pre_samples'], spec['post_samples'],
+                         spec['background_ratio'])
@@ -0,0 +1,625 @@
+# %%
+"""
+Stand-in for the picosdk ``ps5000a`` driver.
+
+It exposes the enums, structures and ``ps5000a*`` functions that the
+acquisition code calls, so the session logic can be run on a machine without
+a PicoScope or the PicoSDK installed:
+
+    from picoscope_fake import ps5000a as ps
+    from picoscope_session import PicoScopeSession
+
+    session = PicoScopeSession(driver=ps)
+
+Captures are filled with a sine wave per channel plus some noise, and with
+``bursts`` > 0 damped oscillations on channel B at random times. Every call
+is recorded in ``ps.calls`` to check which settings were actually pushed, and
+``ps.unplug()`` simulates a USB drop: the current handle stops responding
+until the unit is opened again.
+
+By default nothing takes time. ``FakePs5000a.realistic()`` behaves like a
+5442A on USB 3: opening the unit takes the firmware load time, every call
+has a USB round trip, a block takes its real duration to record and the
+download is limited by the transfer rate. ``PICOSCOPE_DRIVER=fake python
+picoscope_script.py`` runs the acquisition script on it.
+"""
+import ctypes
+import threading
+import time as time_lib
+
+import numpy as np
+
+from picoscope_session import (PICO_OK, PICO_NOT_FOUND, PICO_NOT_RESPONDING, PICO_INVALID_HANDLE,
+                               PICO_INVALID_TIMEBASE, PICO_TOO_MANY_SAMPLES)
+
+PICO_INVALID_CHANNEL = 0x00000010
+PICO_TOO_MANY_SEGMENTS = 0x0000001E
+PICO_NO_SAMPLES_AVAILABLE = 0x00000025
+PICO_INVALID_PARAMETER = 0x0000000D
+
+
+def _make_enum(members):
+    """Same numbering as picosdk.constants.make_enum."""
+    enum = {}
+    for i, member in enumerate(members):
+        for key in (member if isinstance(member, tuple) else (member,)):
+            enum[key] = i
+    return enum
+
+
+# -------------------- STRUCTURES (as in picosdk.ps5000a) --------------------
+class PS5000A_TRIGGER_CHANNEL_PROPERTIES_V2(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [("thresholdUpper", ctypes.c_int16),
+                ("thresholdUpperHysteresis", ctypes.c_uint16),
+                ("thresholdLower", ctypes.c_int16),
+                ("thresholdLowerHysteresis", ctypes.c_uint16),
+                ("channel", ctypes.c_int32)]
+
+
+class PS5000A_CONDITION(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [("source", ctypes.c_int32),
+                ("condition", ctypes.c_int16)]
+
+
+class PS5000A_DIRECTION(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [("channel", ctypes.c_int32),
+                ("direction", ctypes.c_int32),
+                ("mode", ctypes.c_int32)]
+
+
+class PS5000A_TRIGGER_INFO(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [("status", ctypes.c_uint32),
+                ("segmentIndex", ctypes.c_uint32),
+                ("triggerIndex", ctypes.c_uint32),
+                ("triggerTime", ctypes.c_int64),
+                ("timeUnits", ctypes.c_int16),
+                ("reserved0", ctypes.c_int16),
+                ("timeStampCounter", ctypes.c_uint64)]
+
+
+def _deref(pointer):
+    """The ctypes object behind ctypes.byref(...), or the object itself."""
+    return getattr(pointer, '_obj', pointer)
+
+
+def _handle(handle):
+    return getattr(handle, 'value', handle)
+
+
+class FakePs5000a:
+    """
+    In-memory model of a 4-channel PicoScope 5442A.
+
+    ``memory_samples`` is the capture memory in samples at the chosen
+    resolution, shared between the enabled channels. ``time_scale`` stretches
+    the simulated capture time: 0 makes every capture complete at once, 1
+    takes as long as the real capture would. ``transfer_rate`` (bytes/s)
+    makes ``ps5000aGetValues``/``ps5000aGetValuesBulk`` take as long as
+    moving the returned samples over USB would; None returns at once.
+    """
+
+    PS5000A_DEVICE_RESOLUTION = _make_enum([
+        "PS5000A_DR_8BIT",
+        "PS5000A_DR_12BIT",
+        "PS5000A_DR_14BIT",
+        "PS5000A_DR_15BIT",
+        "PS5000A_DR_16BIT",
+    ])
+    PS5000A_COUPLING = _make_enum(['PS5000A_AC', 'PS5000A_DC'])
+    PS5000A_CHANNEL = {
+        'PS5000A_CHANNEL_A': 0,
+        'PS5000A_CHANNEL_B': 1,
+        'PS5000A_CHANNEL_C': 2,
+        'PS5000A_CHANNEL_D': 3,
+        'PS5000A_EXTERNAL': 4,
+        'PS5000A_MAX_CHANNELS': 4,
+        'PS5000A_TRIGGER_AUX': 5,
+    }
+    PS5000A_RANGE = _make_enum([
+        "PS5000A_10MV",
+        "PS5000A_20MV",
+        "PS5000A_50MV",
+        "PS5000A_100MV",
+        "PS5000A_200MV",
+        "PS5000A_500MV",
+        "PS5000A_1V",
+        "PS5000A_2V",
+        "PS5000A_5V",
+        "PS5000A_10V",
+        "PS5000A_20V",
+        "PS5000A_50V",
+        "PS5000A_MAX_RANGES",
+    ])
+    PS5000A_THRESHOLD_DIRECTION = _make_enum([
+        ("PS5000A_ABOVE", "PS5000A_INSIDE"),
+        ("PS5000A_BELOW", "PS5000A_OUTSIDE"),
+        ("PS5000A_RISING", "PS5000A_ENTER", "PS5000A_NONE"),
+        ("PS5000A_FALLING", "PS5000A_EXIT"),
+        ("PS5000A_RISING_OR_FALLING", "PS5000A_ENTER_OR_EXIT"),
+    ])
+    PS5000A_THRESHOLD_MODE = _make_enum(["PS5000A_LEVEL", "PS5000A_WINDOW"])
+    PS5000A_TRIGGER_STATE = _make_enum([
+        "PS5000A_CONDITION_DONT_CARE",
+        "PS5000A_CONDITION_TRUE",
+        "PS5000A_CONDITION_FALSE",
+        "PS5000A_CONDITION_MAX",
+    ])
+    PS5000A_RATIO_MODE = {
+        'PS5000A_RATIO_MODE_NONE': 0,
+        'PS5000A_RATIO_MODE_AGGREGATE': 1,
+        'PS5000A_RATIO_MODE_DECIMATE': 2,
+        'PS5000A_RATIO_MODE_AVERAGE': 4,
+    }
+
+    PS5000A_TIME_UNITS = _make_enum([
+        'PS5000A_FS',
+        'PS5000A_PS',
+        'PS5000A_NS',
+        'PS5000A_US',
+        'PS5000A_MS',
+        'PS5000A_S',
+        'PS5000A_MAX_TIME_UNITS',
+    ])
+
+    PS5000A_TRIGGER_CHANNEL_PROPERTIES_V2 = PS5000A_TRIGGER_CHANNEL_PROPERTIES_V2
+    PS5000A_CONDITION = PS5000A_CONDITION
+    PS5000A_DIRECTION = PS5000A_DIRECTION
+    PS5000A_TRIGGER_INFO = PS5000A_TRIGGER_INFO
+
+    # void ps5000aStreamingReady(handle, noOfSamples, startIndex, overflow, triggerAt, triggered, autoStop, pParameter)
+    # void ps5000aBlockReady(handle, status, pParameter)
+    BlockReadyType = ctypes.CFUNCTYPE(None, ctypes.c_int16, ctypes.c_int32, ctypes.c_void_p)
+    StreamingReadyType = ctypes.CFUNCTYPE(None, ctypes.c_int16, ctypes.c_int32, ctypes.c_uint32, ctypes.c_int16,
+                                          ctypes.c_uint32, ctypes.c_int16, ctypes.c_int16, ctypes.c_void_p)
+
+    # Signal on each channel: (frequency in Hz, amplitude as a fraction of the range)
+    SIGNALS = {0: (50.0, 0.3), 1: (120.0, 0.5), 2: (350.0, 0.2), 3: (1000.0, 0.4)}
+    # Bursts: (channel, frequency in Hz, amplitude as a fraction of the range, decay time in s)
+    BURST = (1, 20000.0, 0.4, 2e-4)
+
+    def __init__(self, memory_samples=64 * 1024 * 1024, time_scale=0.0, noise=0.01, seed=0, trigger_rate=1000.0,
+                 transfer_rate=None, open_latency=0.0, call_latency=0.0, bursts=0.0):
+        self.memory_samples = memory_samples
+        self.time_scale = time_scale
+        self.transfer_rate = transfer_rate
+        # seconds taken by ps5000aOpenUnit and by every other driver call
+        self.open_latency = open_latency
+        self.call_latency = call_latency
+        # mean number of bursts per second of signal
+        self.bursts = bursts
+        self.seed = seed
+        # Sample numbers count from the creation of the fake, so the signal and the bursts go on between captures
+        self._epoch = time_lib.perf_counter()
+        # mean number of triggers per second, spacing the segments of a rapid block capture
+        self.trigger_rate = trigger_rate
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+        self.calls = []
+        self._lock = threading.Lock()
+        self.present = True
+        self._next_handle = 1
+        self.handle = None
+        self.resolution = None
+        self.channels = {}
+        self.trigger = {}
+        self.buffers = {}
+        self.run = None
+        self.ready_at = None
+        self.segments = 1
+        self.captures = 1
+        self.captured_samples = 0
+        # samples the simulated stream had to throw away because they were not fetched in time
+        self.stream_lost = 0
+
+    @classmethod
+    def realistic(cls, **kwargs):
+        """
+        A fake with the timings of a 5442A on USB 3 and a burst every few seconds.
+
+        Block captures take their real duration, the download runs at
+        about 100 MB/s, opening takes 1.5 s and other calls 0.3 ms. The
+        values are rough figures for the hardware; any of them can be
+        overridden with the keyword arguments of the constructor.
+        """
+        settings = dict(time_scale=1.0, transfer_rate=100e6, open_latency=1.5, call_latency=3e-4, bursts=0.2)
+        settings.update(kwargs)
+        return cls(**settings)
+
+    # -------------------- SIMULATION CONTROL --------------------
+    def unplug(self):
+        """Invalidate the current handle, as after a USB drop. The unit can be reopened."""
+        self.handle = None
+        self._cancel_run(PICO_NOT_RESPONDING)
+
+    def _cancel_run(self, status=None):
+        """Forget the armed capture. A pending block-ready callback is called with ``status`` if given."""
+        run, self.run = self.run, None
+        if run is None or run.get('timer') is None:
+            return
+        run['timer'].cancel()
+        if status is not None:
+            self._block_done(run, status)
+
+    def _block_done(self, run, status=PICO_OK):
+        with self._lock:
+            if run['done']:
+                return
+            run['done'] = True
+        run['lpReady'](run['handle'], status, run['pParameter'])
+
+    def count(self, function):
+        """Number of recorded calls to ``function``."""
+        return sum(1 for name, args in self.calls if name == function)
+
+    def _record(self, function, *args):
+        self.calls.append((function, args))
+        if self.call_latency:
+            time_lib.sleep(self.call_latency)
+
+    def _check(self, handle):
+        if self.handle is None:
+            return PICO_NOT_RESPONDING
+        if _handle(handle) != self.handle:
+            return PICO_INVALID_HANDLE
+        return PICO_OK
+
+    def _interval_ns(self, timebase):
+        """Sample interval of a timebase, from the ps5000a programmer's guide."""
+        bits = int(self.resolution.split('_')[-1][:-3])
+        if bits == 8:
+            return 2 ** timebase if timebase < 3 else (timebase - 2) * 8.0
+        if bits == 12:
+            # 2^(timebase-1) / 500 MHz, then (timebase-3) / 62.5 MHz
+            return 2 ** timebase if timebase < 4 else (timebase - 3) * 16.0
+        if bits in (14, 15):
+            return 8.0 if timebase == 3 else (timebase - 2) * 8.0
+        return 16.0 if timebase == 4 else (timebase - 3) * 16.0
+
+    def _min_timebase(self):
+        """Fastest timebase for the resolution and the number of enabled channels."""
+        bits = int(self.resolution.split('_')[-1][:-3])
+        n = max(1, sum(1 for enabled, *_ in self.channels.values() if enabled))
+        if bits == 8:
+            return {1: 0, 2: 1}.get(n, 2)
+        if bits == 12:
+            return {1: 1, 2: 2}.get(n, 3)
+        if bits in (14, 15):
+            return 3
+        return 4
+
+    def _max_samples(self):
+        """Samples per channel that fit in one memory segment."""
+        n = max(1, sum(1 for enabled, *_ in self.channels.values() if enabled))
+        return self.memory_samples // self.segments // n
+
+    # -------------------- DRIVER FUNCTIONS --------------------
+    def ps5000aOpenUnit(self, handle, serial, resolution):
+        self._record('ps5000aOpenUnit', resolution)
+        if not self.present:
+            return PICO_NOT_FOUND
+        if self.open_latency:
+            # Firmware upload and self-calibration
+            time_lib.sleep(self.open_latency)
+        self.resolution = {v: k for k, v in self.PS5000A_DEVICE_RESOLUTION.items()}[resolution]
+        self.handle = self._next_handle
+        self._next_handle += 1
+        # A freshly opened unit has all channels on with the 5 V range and no trigger
+        self.channels = {ch: (True, 1, self.PS5000A_RANGE['PS5000A_5V'], 0.0) for ch in range(4)}
+        self.trigger = {}
+        self.buffers = {}
+        self.run = None
+        self.segments = 1
+        self.captures = 1
+        _deref(handle).value = self.handle
+        return PICO_OK
+
+    def ps5000aChangePowerSource(self, handle, powerState):
+        self._record('ps5000aChangePowerSource', powerState)
+        return self._check(handle)
+
+    def ps5000aCloseUnit(self, handle):
+        self._record('ps5000aCloseUnit')
+        status = self._check(handle)
+        if status == PICO_OK:
+            self.handle = None
+        return status
+
+    def ps5000aStop(self, handle):
+        self._record('ps5000aStop')
+        self._cancel_run()
+        return self._check(handle)
+
+    def ps5000aMaximumValue(self, handle, value):
+        self._record('ps5000aMaximumValue')
+        _deref(value).value = 32512 if self.resolution == 'PS5000A_DR_8BIT' else 32767
+        return self._check(handle)
+
+    def ps5000aSetChannel(self, handle, channel, enabled, coupling_type, chRange, analogOffset):
+        self._record('ps5000aSetChannel', channel, enabled, coupling_type, chRange, analogOffset)
+        if channel not in range(4):
+            return PICO_INVALID_CHANNEL
+        self.channels[channel] = (bool(enabled), coupling_type, chRange, analogOffset)
+        return self._check(handle)
+
+    def ps5000aSetTriggerChannelPropertiesV2(self, handle, channelProperties, nChannelProperties, auxOutputEnable):
+        self._record('ps5000aSetTriggerChannelPropertiesV2', nChannelProperties)
+        self.trigger['properties'] = [(p.channel, p.thresholdUpper) for p in _deref(channelProperties)]
+        return self._check(handle)
+
+    def ps5000aSetTriggerChannelConditionsV2(self, handle, conditions, nConditions, info):
+        self._record('ps5000aSetTriggerChannelConditionsV2', nConditions, info)
+        if info & 1:
+            self.trigger['conditions'] = []
+        if nConditions:
+            self.trigger.setdefault('conditions', []).append(_deref(conditions).source)
+        return self._check(handle)
+
+    def ps5000aSetTriggerChannelDirectionsV2(self, handle, directions, nDirections):
+        self._record('ps5000aSetTriggerChannelDirectionsV2', nDirections)
+        self.trigger['directions'] = [(d.channel, d.direction) for d in _deref(directions)]
+        return self._check(handle)
+
+    def ps5000aGetTimebase2(self, handle, timebase, noSamples, timeIntervalNanoseconds, maxSamples, segmentIndex):
+        self._record('ps5000aGetTimebase2', timebase, noSamples)
+        status = self._check(handle)
+        if status != PICO_OK:
+            return status
+        if timebase < self._min_timebase():
+            return PICO_INVALID_TIMEBASE
+        if noSamples > self._max_samples():
+            return PICO_TOO_MANY_SAMPLES
+        _deref(timeIntervalNanoseconds).value = self._interval_ns(timebase)
+        _deref(maxSamples).value = self._max_samples()
+        return PICO_OK
+
+    def ps5000aRunBlock(self, handle, noOfPreTriggerSamples, noOfPostTriggerSamples, timebase,
+                        timeIndisposedMs, segmentIndex, lpReady, pParameter):
+        self._record('ps5000aRunBlock', noOfPreTriggerSamples, noOfPostTriggerSamples, timebase)
+        status = self._check(handle)
+        if status != PICO_OK:
+            return status
+        self._cancel_run()
+        n_samples = noOfPreTriggerSamples + noOfPostTriggerSamples
+        if timebase < self._min_timebase():
+            return PICO_INVALID_TIMEBASE
+        if n_samples > self._max_samples():
+            return PICO_TOO_MANY_SAMPLES
+        interval_ns = self._interval_ns(timebase)
+        # Sample count at which each capture triggers, with random gaps between the triggers
+        gaps = self.rng.exponential(1.0 / (self.trigger_rate * interval_ns * 1e-9), self.captures)
+        origin = int((time_lib.perf_counter() - self._epoch) / (interval_ns * 1e-9))
+        triggers = origin + np.cumsum(n_samples + gaps.astype(np.int64)) - n_samples
+        self.run = {
+            'n_samples': n_samples,
+            'interval_ns': interval_ns,
+            'triggers': triggers,
+            'start': time_lib.perf_counter(),
+            'duration': (triggers[-1] - origin + n_samples) * interval_ns * 1e-9 * self.time_scale,
+            'timer': None,
+        }
+        # perf_counter time at which the capture completes
+        self.ready_at = self.run['start'] + self.run['duration']
+        if lpReady is not None:
+            # The driver calls lpReady from its own thread once the capture is complete
+            self.run.update(lpReady=lpReady, pParameter=pParameter, handle=_handle(handle), done=False)
+            self.run['timer'] = threading.Timer(self.run['duration'], self._block_done, args=(self.run,))
+            self.run['timer'].daemon = True
+            self.run['timer'].start()
+        return PICO_OK
+
+    def ps5000aIsReady(self, handle, ready):
+        self._record('ps5000aIsReady')
+        status = self._check(handle)
+        if status != PICO_OK:
+            return status
+        done = self.run is not None and time_lib.perf_counter() - self.run['start'] >= self.run['duration']
+        _deref(ready).value = int(done)
+        return PICO_OK
+
+    def ps5000aSetDataBuffers(self, handle, source, bufferMax, bufferMin, bufferLth, segmentIndex, mode):
+        self._record('ps5000aSetDataBuffers', source, bufferLth, segmentIndex, mode)
+        if source not in range(4):
+            return PICO_INVALID_CHANNEL
+        self.buffers[(source, segmentIndex)] = (_deref(bufferMax), _deref(bufferMin), bufferLth, mode)
+        return self._check(handle)
+
+    def ps5000aGetValues(self, handle, startIndex, noOfSamples, downSampleRatio, downSampleRatioMode,
+                         segmentIndex, overflow):
+        self._record('ps5000aGetValues', startIndex, downSampleRatio, downSampleRatioMode)
+        status = self._check(handle)
+        if status != PICO_OK:
+            return status
+        if self.run is None:
+            return PICO_NO_SAMPLES_AVAILABLE
+        n = min(_deref(noOfSamples).value, self.run['n_samples'] - startIndex)
+        n_out = self._fill_segment(segmentIndex, startIndex, n, downSampleRatio, downSampleRatioMode)
+        if n_out is None:
+            return PICO_INVALID_PARAMETER
+        _deref(noOfSamples).value = n_out
+        _deref(overflow).value = 0
+        return PICO_OK
+
+    def _fill_segment(self, segmentIndex, startIndex, n, ratio=0, mode=0):
+        """
+        Write ``n`` raw samples, downsampled by ``ratio`` with ``mode``, into the buffers of a segment.
+
+        Returns the number of values per buffer, or None if the buffers were
+        registered for another ratio mode.
+        """
+        first = self.run['triggers'][segmentIndex]
+        ratio = max(1, ratio) if mode else 1
+        n_out = n // ratio
+        transferred = 0
+        for (source, segment), (bufferMax, bufferMin, length, buffer_mode) in self.buffers.items():
+            if segment != segmentIndex or not self.channels[source][0]:
+                continue
+            if buffer_mode != mode:
+                return None
+            data = self.waveform(source, first + startIndex, min(n_out, length) * ratio, self.run['interval_ns'])
+            blocks = data.reshape(-1, ratio)
+            if mode == self.PS5000A_RATIO_MODE['PS5000A_RATIO_MODE_AGGREGATE']:
+                np.ctypeslib.as_array(bufferMax)[:len(blocks)] = blocks.max(axis=1)
+                np.ctypeslib.as_array(bufferMin)[:len(blocks)] = blocks.min(axis=1)
+                transferred += 2 * len(blocks)
+            elif mode == self.PS5000A_RATIO_MODE['PS5000A_RATIO_MODE_AVERAGE']:
+                np.ctypeslib.as_array(bufferMax)[:len(blocks)] = np.round(blocks.mean(axis=1))
+                transferred += len(blocks)
+            else:
+                # NONE, or DECIMATE: the first sample of every block
+                np.ctypeslib.as_array(bufferMax)[:len(blocks)] = blocks[:, 0]
+                transferred += len(blocks)
+        self.captured_samples += n
+        if self.transfer_rate:
+            time_lib.sleep(2 * transferred / self.transfer_rate)
+        return n_out
+
+    def ps5000aMemorySegments(self, handle, nSegments, nMaxSamples):
+        self._record('ps5000aMemorySegments', nSegments)
+        status = self._check(handle)
+        if status != PICO_OK:
+            return status
+        self.segments = nSegments
+        self.buffers = {}
+        _deref(nMaxSamples).value = self.memory_samples // nSegments
+        return PICO_OK
+
+    def ps5000aSetNoOfCaptures(self, handle, nCaptures):
+        self._record('ps5000aSetNoOfCaptures', nCaptures)
+        if nCaptures > self.segments:
+            return PICO_TOO_MANY_SEGMENTS
+        self.captures = nCaptures
+        return self._check(handle)
+
+    def ps5000aGetValuesBulk(self, handle, noOfSamples, fromSegmentIndex, toSegmentIndex, downSampleRatio,
+                             downSampleRatioMode, overflow):
+        self._record('ps5000aGetValuesBulk', fromSegmentIndex, toSegmentIndex, downSampleRatio, downSampleRatioMode)
+        status = self._check(handle)
+        if status != PICO_OK:
+            return status
+        if self.run is None or toSegmentIndex >= self.captures:
+            return PICO_NO_SAMPLES_AVAILABLE
+        n = min(_deref(noOfSamples).value, self.run['n_samples'])
+        for segment in range(fromSegmentIndex, toSegmentIndex + 1):
+            n_out = self._fill_segment(segment, 0, n, downSampleRatio, downSampleRatioMode)
+            if n_out is None:
+                return PICO_INVALID_PARAMETER
+        _deref(noOfSamples).value = n_out
+        overflows = _deref(overflow)
+        for i in range(toSegmentIndex - fromSegmentIndex + 1):
+            overflows[i] = 0
+        return PICO_OK
+
+    def ps5000aGetTriggerInfoBulk(self, handle, triggerInfo, fromSegmentIndex, toSegmentIndex):
+        self._record('ps5000aGetTriggerInfoBulk', fromSegmentIndex, toSegmentIndex)
+        status = self._check(handle)
+        if status != PICO_OK:
+            return status
+        infos = _deref(triggerInfo)
+        for i, segment in enumerate(range(fromSegmentIndex, toSegmentIndex + 1)):
+            infos[i].status = PICO_OK
+            infos[i].segmentIndex = segment
+            infos[i].timeStampCounter = int(self.run['triggers'][segment])
+        return PICO_OK
+
+    def ps5000aRunStreaming(self, handle, sampleInterval, sampleIntervalTimeUnits, maxPreTriggerSamples,
+                            maxPostTriggerSamples, autoStop, downSampleRatio, downSampleRatioMode, overviewBufferSize):
+        self._record('ps5000aRunStreaming', _deref(sampleInterval).value, sampleIntervalTimeUnits, overviewBufferSize)
+        status = self._check(handle)
+        if status != PICO_OK:
+            return status
+        interval_ns = _deref(sampleInterval).value * 1000.0 ** (sampleIntervalTimeUnits - 2)
+        # Round to the nearest timebase the hardware can do
+        timebase = self._min_timebase()
+        while self._interval_ns(timebase + 1) <= interval_ns:
+            timebase += 1
+        interval_ns = self._interval_ns(timebase)
+        _deref(sampleInterval).value = int(round(interval_ns / 1000.0 ** (sampleIntervalTimeUnits - 2)))
+        self.run = {
+            'streaming': True,
+            'interval_ns': interval_ns,
+            'start': time_lib.perf_counter(),
+            'buffer_size': overviewBufferSize,
+            'max_samples': maxPreTriggerSamples + maxPostTriggerSamples if autoStop else 0,
+            'delivered': 0,
+            'position': 0,
+        }
+        return PICO_OK
+
+    def ps5000aGetStreamingLatestValues(self, handle, lpPs5000aReady, pParameter):
+        """Hand over everything produced since the last call, at most one overview buffer."""
+        status = self._check(handle)
+        if status != PICO_OK:
+            return status
+        if self.run is None or not self.run.get('streaming'):
+            return PICO_NO_SAMPLES_AVAILABLE
+        run = self.run
+        produced = int((time_lib.perf_counter() - run['start']) / (run['interval_ns'] * 1e-9))
+        if run['max_samples']:
+            produced = min(produced, run['max_samples'])
+        new = produced - run['delivered']
+        if new > run['buffer_size']:
+            # The host was too slow, the oldest samples were overwritten in the driver
+            self.stream_lost += new - run['buffer_size']
+            run['delivered'] += new - run['buffer_size']
+            new = run['buffer_size']
+        while new > 0:
+            start = run['position']
+            n = min(new, run['buffer_size'] - start)
+            for (source, segment), (bufferMax, bufferMin, length, mode) in self.buffers.items():
+                if segment == 0 and self.channels[source][0]:
+                    data = self.waveform(source, run['delivered'], n, run['interval_ns'])
+                    np.ctypeslib.as_array(bufferMax)[start:start + n] = data
+            run['delivered'] += n
+            self.captured_samples += n
+            run['position'] = (start + n) % run['buffer_size']
+            new -= n
+            auto_stop = int(bool(run['max_samples']) and run['delivered'] >= run['max_samples'])
+            lpPs5000aReady(_handle(handle), n, start, 0, 0, 0, auto_stop, pParameter)
+        return PICO_OK
+
+    # -------------------- SYNTHETIC SIGNAL --------------------
+    def waveform(self, source, start, n, interval_ns):
+        """ADC counts of ``n`` samples of a channel, quantised to the resolution."""
+        enabled, coupling, chRange, offset = self.channels[source]
+        frequency, amplitude = self.SIGNALS[source]
+        max_adc = 32512 if self.resolution == 'PS5000A_DR_8BIT' else 32767
+        t = (start + np.arange(n)) * interval_ns * 1e-9
+        signal = amplitude * np.sin(2 * np.pi * frequency * t) + self.noise * self.rng.standard_normal(n)
+        if self.bursts and source == self.BURST[0]:
+            signal += self._bursts(start, n, interval_ns)
+        step = 2 ** (16 - int(self.resolution.split('_')[-1][:-3]))
+        counts = np.round(signal * max_adc / step) * step
+        return np.clip(counts, -max_adc, max_adc).astype(np.int16)
+
+
+    def _bursts(self, start, n, interval_ns):
+        """
+        Damped oscillations of samples ``start`` to ``start + n``, as a fraction of the range.
+
+        Time is cut in slots of 1 / ``bursts`` seconds with one burst at a
+        random place in each, drawn from the seed and the slot number, so
+        the same samples read in chunks or at once get the same bursts.
+        """
+        _, frequency, amplitude, decay = self.BURST
+        interval_s = interval_ns * 1e-9
+        slot_s = 1.0 / self.bursts
+        signal = np.zeros(n)
+        first_slot = int((start * interval_s - 5 * decay) // slot_s)
+        last_slot = int(((start + n) * interval_s) // slot_s)
+        for slot in range(max(0, first_slot), last_slot + 1):
+            onset = (slot + np.random.default_rng((self.seed, slot)).random()) * slot_s
+            begin = max(start, int(np.ceil(onset / interval_s)))
+            end = min(start + n, int((onset + 5 * decay) / interval_s) + 1)
+            if begin >= end:
+                continue
+            t = np.arange(begin, end) * interval_s - onset
+            signal[begin - start:end - start] += amplitude * np.exp(-t / decay) * np.sin(2 * np.pi * frequency * t)
+        return signal
+
+
+ps5000a = FakePs5000a()
@@ -1,60 +1,98 @@
 # %%
 
-import glob
 import os
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
+from picoscope_storage import read_dataframe
+from picoscope_spectra import SpectrumEngine, list_archive, read_spectra
+from picoscope_catalog import Catalog
+from picoscope_cache import FeatureCache
+from picoscope_plot import minmax_envelope, peak_envelope
 
 #df = pd.read_parquet('aquisition_2025-04-11_13-35-48.parquet')
-files = glob.glob('try/*.parquet')
+# In time order, from the flat folder and its YYYY/MM/DD day folders
+files = list_archive('try')
 print(files)
 
 path_fft = 'ffts'
 os.makedirs(f'{path_fft}', exist_ok = True)
-for file in files[-1:]:
-    df = pd.read_parquet(file)
-    fftA = np.fft.fft(df.adc2mVChAMax[:])
-    fftB = np.fft.fft(df.adc2mVChBMax[:])
-    fftC = np.fft.fft(df.adc2mVChCMax[:])
-    fftD = np.fft.fft(df.adc2mVChDMax[:])
-
-    labels = ['Channel A', 'Channel B', 'Channel C', 'Channel D']
-    plt.figure(figsize = (7,5), dpi = 300)
-    freqs = np.linspace(0, np.unique(df.sampling_rate), len(abs(fftA)))
-    for i, fft in enumerate([fftA, fftB, fftC, fftD]):
-        plt.plot(freqs, abs(fft)/len(abs(fft))*2, label = f'{labels[i]}')
-        plt.ylim(0, 10)
-        plt.xlim(0,1000)
-        plt.title(f'{np.unique(df.timestamp)[0]} time, {np.unique(round(df.sampling_rate/1e6, 2))[0]} MS/s', size = 20)
-        plt.xlabel('Frequency [Hz]', size = 16)
-        plt.ylabel('Amplitude [mV]', size = 16)
-        plt.legend()
-        plt.grid()
-    plt.savefig(f'{path_fft}/fft_{np.unique(df.timestamp)[0]}.png')
+
+# Worker processes re-import this file on Windows, so only the main process runs the analysis
+if __name__ == '__main__':
+    # Spectra of every file of the archive not processed yet (rfft, Hann window), in a process pool.
+    # Set nperseg for Welch averaging, start/end in run() for a time range only.
+    engine = SpectrumEngine(output = f'{path_fft}/spectra', window = 'hann', nperseg = None, max_freq = 1000)
+    engine.run('try')
+
+    spectra = read_spectra(f'{path_fft}/spectra')
+    labels = {'A': 'Channel A', 'B': 'Channel B', 'C': 'Channel C', 'D': 'Channel D'}
+    for file, spectra_file in list(spectra.sort_values('timestamp').groupby('file', sort = False))[-1:]:
+        timestamp = spectra_file.timestamp.iloc[0]
+        sampling_rate = spectra_file.sampling_rate.iloc[0]
+        plt.figure(figsize = (7,5), dpi = 300)
+        for _, row in spectra_file.iterrows():
+            # Highest bin of every pixel column, so no peak is lost
+            index, peaks = peak_envelope(row.amplitude, 2100)
+            plt.plot(index * row.df_hz, peaks, label = f'{labels[row.channel]}')
+            plt.ylim(0, 10)
+            plt.xlim(0,1000)
+            plt.title(f'{timestamp} time, {round(sampling_rate/1e6, 2)} MS/s', size = 20)
+            plt.xlabel('Frequency [Hz]', size = 16)
+            plt.ylabel('Amplitude [mV]', size = 16)
+            plt.legend()
+            plt.grid()
+        plt.savefig(f'{path_fft}/fft_{timestamp}.png')
 
 
 
 # %%
-for file in files[-1:]:
-    df = pd.read_parquet(file)
-    signalA = df.adc2mVChAMax
-    signalB = df.adc2mVChBMax
-    signalC = df.adc2mVChCMax
-    signalD = df.adc2mVChDMax
-
-    labels = ['Channel A', 'Channel B', 'Channel C', 'Channel D']
-    plt.figure(figsize = (7,5), dpi = 300)
-    for i, signal in enumerate([signalA, signalB, signalC, signalD]):
-        plt.plot(df.time/1e9, signal, label = f'{labels[i]}', lw = 0.3)
-        #plt.ylim(0, 10)
-        #plt.xlim(0,1000)
-        plt.title(f'{np.unique(df.timestamp)[0]} time, {np.unique(round(df.sampling_rate/1e6, 2))[0]} MS/s', size = 20)
-        plt.xlabel('Frequency [Hz]', size = 16)
-        plt.ylabel('Amplitude [mV]', size = 16)
+if __name__ == '__main__':
+    for file in files[-1:]:
+        df = read_dataframe(file)
+        # Only the channels that were enabled are in the file
+        channels = [ch for ch in ['A', 'B', 'C', 'D'] if f'adc2mVCh{ch}Max' in df]
+
+        labels = [f'Channel {ch}' for ch in channels]
+        plt.figure(figsize = (7,5), dpi = 300)
+        for i, signal in enumerate([df[f'adc2mVCh{ch}Max'] for ch in channels]):
+            # Min/max of every pixel column instead of all the samples
+            index, envelope = minmax_envelope(signal.to_numpy(), 2100)
+            plt.plot(df.time.to_numpy()[index]/1e9, envelope, label = f'{labels[i]}', lw = 0.3)
+            #plt.ylim(0, 10)
+            #plt.xlim(0,1000)
+            plt.title(f'{np.unique(df.timestamp)[0]} time, {np.unique(round(df.sampling_rate/1e6, 2))[0]} MS/s', size = 20)
+            plt.xlabel('Frequency [Hz]', size = 16)
+            plt.ylabel('Amplitude [mV]', size = 16)
+            plt.legend()
+            plt.grid()
+        #plt.savefig(f'{path_fft}/fft_{np.unique(df.timestamp)[0]}.png')
+
+
+# %%
+# Trends of the whole archive from the feature cache; only new files are read
+if __name__ == '__main__':
+    # Same parameters as the engine above: the spectra and features come from its files, not a second FFT pass
+    with FeatureCache(f'{path_fft}/cache.sqlite', max_freq = 1000, spectra = f'{path_fft}/spectra') as cache:
+        cache.update('try')
+        plt.figure(figsize = (7,5), dpi = 300)
+        for ch in ['A', 'B', 'C', 'D']:
+            trend = cache.trend(ch, 'dominant_mV')
+            plt.plot(trend.time, trend.dominant_mV, '.-', label = f'Channel {ch}')
+        plt.xlabel('Time', size = 16)
+        plt.ylabel('Dominant amplitude [mV]', size = 16)
         plt.legend()
         plt.grid()
-    #plt.savefig(f'{path_fft}/fft_{np.unique(df.timestamp)[0]}.png')
+        plt.savefig(f'{path_fft}/trend_dominant_mV.png')
+
+
+# %%
+# Captures of the last day where channel B went above 500 mV, answered from the catalog without opening the files
+if __name__ == '__main__':
+    with Catalog('try') as catalog:
+        catalog.update()
+        peaks = catalog.find(pd.Timestamp.now() - pd.Timedelta(days=1), channel = 'B', min_peak = 500)
+        print(peaks[['path', 'timestamp', 'peak_mV', 'rms_mV']])
 
 
 # %%
@@ -0,0 +1,230 @@
+# %%
+"""
+Background write-and-replicate pipeline for finished captures.
+
+The acquisition loop hands every capture to ``WritePipeline.submit()`` and
+goes on with the next one. A writer thread saves the capture in the local
+folder, then one replicator thread per destination (e.g. the EOS folder)
+copies the file there. Both steps write to a temporary name and rename it, so
+a half-written file never shows up under its final name. Failed copies are
+retried with an exponential back-off.
+
+Memory is bounded: at most ``max_pending`` captures wait for the writer, and
+``submit()`` blocks when that many are queued, which slows the acquisition
+down instead of letting the queue grow without limit.
+
+    pipeline = WritePipeline(local_folder='.', destinations=['try'])
+    pipeline.submit(capture, 'aquisition_2025-04-11_17-43-19.parquet')
+    ...
+    pipeline.close()    # waits until everything is written and copied
+"""
+import os
+import queue
+import shutil
+import threading
+import time as time_lib
+
+from picoscope_catalog import SummaryStats
+from picoscope_convert import capture_views
+from picoscope_metrics import NULL_METRICS
+from picoscope_storage import is_events_file, write_capture
+
+_STOP = object()
+
+
+def snapshot_capture(capture):
+    """Copy of a capture that does not share the session's reusable buffers."""
+    snapshot = dict(capture)
+    snapshot['buffers'] = {ch: counts.copy() for ch, counts in capture_views(capture).items()}
+    if 'buffers_min' in capture:
+        snapshot['buffers_min'] = {ch: counts.copy() for ch, counts in capture_views(capture, 'buffers_min').items()}
+    snapshot['maxADC'] = int(getattr(capture['maxADC'], 'value', capture['maxADC']))
+    return snapshot
+
+
+def atomic_copy(source, destination):
+    """Copy through a temporary file in the destination folder, then rename it into place."""
+    tmp = f'{destination}.tmp'
+    shutil.copyfile(source, tmp)
+    os.replace(tmp, destination)
+
+
+class WritePipeline:
+    """
+    Writes captures in a background thread and replicates them to ``destinations``.
+
+    ``writer(capture, path)`` saves a capture, ``write_capture`` (raw int16
+    Parquet) by default. A replication that still fails after ``retries``
+    attempts is given up and listed in ``failed``. ``metrics`` times the
+    'snapshot', 'submit_wait', 'write', 'catalog' and 'copy' stages.
+
+    File names may contain sub-folders (e.g. the day folders of
+    ``partitioned_name``); they are created locally and in every
+    destination. Every written file except event windows is added to
+    ``catalog`` (picoscope_catalog.py), with the statistics taken from the capture.
+
+    A file that already exists is never replaced: that capture fails with
+    FileExistsError. A capture that cannot be written is listed in
+    ``errors`` and its temporary file removed; the error is raised by the
+    next ``submit()`` or by ``close()``, so the acquisition does not go on
+    without noticing.
+    """
+
+    def __init__(self, local_folder='.', destinations=(), writer=write_capture, max_pending=4, retries=5,
+                 backoff=1.0, max_backoff=60.0, metrics=None, catalog=None):
+        self.local_folder = local_folder
+        self.metrics = metrics or NULL_METRICS
+        self.catalog = catalog
+        self.destinations = list(destinations)
+        self.writer = writer
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.written = []
+        self.replicated = {destination: [] for destination in self.destinations}
+        self.failed = []
+        self.errors = []
+        # First write error not raised yet, see _raise_error()
+        self._error = None
+
+        os.makedirs(local_folder, exist_ok=True)
+        for destination in self.destinations:
+            os.makedirs(destination, exist_ok=True)
+
+        self._write_queue = queue.Queue(maxsize=max_pending)
+        # Replication jobs are only paths, these queues do not hold capture data
+        self._replicate_queues = {destination: queue.Queue() for destination in self.destinations}
+        self._threads = [threading.Thread(target=self._write_loop, name='picoscope-writer', daemon=True)]
+        for destination in self.destinations:
+            self._threads.append(threading.Thread(target=self._replicate_loop, args=(destination,),
+                                                  name=f'picoscope-replicate-{destination}', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, capture, filename, writer=None, copy=True):
+        """
+        Queue a capture to be written as ``local_folder/filename``. Blocks while ``max_pending`` are queued.
+
+        ``writer`` overrides the pipeline's writer for this capture. The
+        capture is copied first because the session reuses its buffers; pass
+        ``copy=False`` for captures that already own their data. Raises the
+        error of a capture that could not be written since the last call,
+        after this capture is queued: an earlier failure does not lose it.
+        """
+        if copy:
+            with self.metrics.stage('snapshot'):
+                capture = snapshot_capture(capture)
+        # Time spent blocked here is back-pressure from a writer that cannot keep up
+        with self.metrics.stage('submit_wait'):
+            self._write_queue.put((capture, filename, writer or self.writer))
+        self._raise_error()
+        return os.path.join(self.local_folder, filename)
+
+    def replicate(self, path, stats=None):
+        """
+        Queue a file of ``local_folder`` that is already written (e.g. by a CaptureWriter) to be copied.
+
+        It is added to the catalog first, with ``stats`` (a SummaryStats) if given.
+        """
+        self._index(path, stats)
+        for destination_queue in self._replicate_queues.values():
+            destination_queue.put(path)
+
+    def _index(self, path, stats=None):
+        # Event windows repeat samples of the background file of their acquisition, which is the one indexed
+        if self.catalog is None or is_events_file(path):
+            return
+        try:
+            with self.metrics.stage('catalog'):
+                self.catalog.add(path, stats)
+        except Exception as e:
+            print(f"❌ Could not add {path} to the catalog: {e}")
+            self.errors.append((path, e))
+
+    @property
+    def pending(self):
+        """Captures waiting to be written and files waiting to be copied."""
+        return self._write_queue.qsize() + sum(q.qsize() for q in self._replicate_queues.values())
+
+    def _raise_error(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _write_loop(self):
+        while True:
+            job = self._write_queue.get()
+            if job is _STOP:
+                break
+            capture, filename, writer = job
+            path = os.path.join(self.local_folder, filename)
+            tmp = f'{path}.tmp'
+            stats = None
+            try:
+                if self.catalog is not None and not is_events_file(path):
+                    with self.metrics.stage('catalog'):
+                        stats = SummaryStats()
+                        stats.add_capture(capture)
+                # Two captures with the same name: keep the first one
+                if os.path.exists(path):
+                    raise FileExistsError(f"{path} already exists, not overwriting it")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with self.metrics.stage('write'):
+                    writer(capture, tmp)
+                    os.replace(tmp, path)
+            except Exception as e:
+                print(f"❌ Could not write {path}: {e}")
+                self.errors.append((path, e))
+                if self._error is None:
+                    self._error = e
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                continue
+            finally:
+                del capture, job
+            self.written.append(path)
+            self._index(path, stats)
+            for destination_queue in self._replicate_queues.values():
+                destination_queue.put(path)
+        for destination_queue in self._replicate_queues.values():
+            destination_queue.put(_STOP)
+
+    def _replicate_loop(self, destination):
+        jobs = self._replicate_queues[destination]
+        while True:
+            path = jobs.get()
+            if path is _STOP:
+                break
+            # Same place under the destination as under the local folder
+            target = os.path.join(destination, os.path.relpath(path, self.local_folder))
+            delay = self.backoff
+            for attempt in range(self.retries + 1):
+                try:
+                    with self.metrics.stage('copy'):
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        atomic_copy(path, target)
+                    self.replicated[destination].append(target)
+                    print(f"Copied to {target}")
+                    break
+                except OSError as e:
+                    if attempt == self.retries:
+                        print(f"❌ Giving up copying {path} to {destination}: {e}")
+                        self.failed.append((path, destination, e))
+                    else:
+                        print(f"⚠️ Copy of {path} to {destination} failed ({e}), retrying in {delay:.0f} s")
+                        time_lib.sleep(delay)
+                        delay = min(delay * 2, self.max_backoff)
+
+    def close(self):
+        """Write and replicate everything submitted, stop the threads, then raise a write error not raised yet."""
+        self._write_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,308 @@
+# %%
+"""
+Per-stage timing of the acquisition loop, exported for Prometheus or as JSON lines.
+
+Every stage of a cycle is wrapped in ``metrics.stage(name)``. The session
+times open, configure, arm, wait and get_values. The write pipeline times
+write and replicate, and the script times the cycle, plotting and the idle
+time between cycles. The durations go into one histogram per stage.
+``record_capture()`` counts the samples and the time the scope was actually
+sampling. From that come the dead-time ratio (the share of a cycle in which
+nothing is recorded) and the samples/s.
+
+    metrics = Metrics(enabled=True, prometheus_path='metrics/picoscope.prom', jsonl_path='metrics/cycles.jsonl')
+    session = PicoScopeSession(metrics=metrics)
+    with metrics.cycle():
+        capture = session.capture_block()
+        metrics.record_capture(capture)
+
+The Prometheus file is rewritten after every cycle (for the node_exporter
+textfile collector). The JSON lines file gets one line per cycle with the
+time of every stage. ``profile='cprofile'`` writes a cProfile dump per
+cycle, and ``profile='tracemalloc'`` writes the top allocations of each
+cycle together with its peak memory. When disabled, ``stage()`` and
+``cycle()`` return one shared do-nothing context manager, and the
+``record_*`` methods return at once.
+"""
+import bisect
+import json
+import os
+import threading
+import time as time_lib
+from datetime import datetime
+
+# Upper bounds in seconds, from a driver call to a slow copy to EOS
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROFILES = (None, 'cprofile', 'tracemalloc')
+
+
+class _NullContext:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL = _NullContext()
+
+
+class Histogram:
+    """Counts of observations per bucket, as a Prometheus histogram (the last bucket is +Inf)."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile (the max for the +Inf bucket)."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time_lib.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, time_lib.perf_counter() - self.start)
+        return False
+
+
+class _Cycle:
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __enter__(self):
+        self.metrics._start_cycle()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics._end_cycle(failed=exc_type is not None)
+        return False
+
+
+class Metrics:
+    """
+    Stage histograms, sample counters and per-cycle exports.
+
+    ``prometheus_path`` and ``jsonl_path`` are optional outputs, written at
+    the end of every cycle. ``profile`` is None, 'cprofile' or 'tracemalloc';
+    the per-cycle profiles go to ``profile_folder``.
+    """
+
+    def __init__(self, enabled=False, prometheus_path=None, jsonl_path=None, profile=None, profile_folder='profiles'):
+        if profile not in PROFILES:
+            raise ValueError(f"profile must be one of {PROFILES}, not {profile!r}")
+        self.enabled = enabled
+        self.prometheus_path = prometheus_path
+        self.jsonl_path = jsonl_path
+        self.profile = profile if enabled else None
+        self.profile_folder = profile_folder
+        self._lock = threading.Lock()
+
+        self.histograms = {}
+        self.cycles = 0
+        self.failed_cycles = 0
+        self.samples_total = 0
+        self.bytes_total = 0
+        self.live_seconds_total = 0.0
+        self.cycle_seconds_total = 0.0
+        self.dead_time_ratio = 0.0
+        self.samples_per_second = 0.0
+
+        self._cycle_start = None
+        self._cycle_stages = {}
+        self._cycle_samples = 0
+        self._cycle_live = 0.0
+        self._profiler = None
+        for path in (prometheus_path, jsonl_path):
+            if enabled and path and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.profile is not None:
+            os.makedirs(profile_folder, exist_ok=True)
+        if self.profile == 'tracemalloc':
+            import tracemalloc
+            tracemalloc.start()
+
+    # -------------------- RECORDING --------------------
+    def stage(self, name):
+        """Context manager timing one stage."""
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+            self._cycle_stages[name] = self._cycle_stages.get(name, 0.0) + seconds
+
+    def record_capture(self, capture):
+        """Count the samples of a capture and the time during which the scope was recording them."""
+        if not self.enabled:
+            return
+        n_values = capture['n_samples'] * capture.get('n_segments', 1)
+        samples = n_values * len(capture['buffers']) * capture.get('downsample_ratio', 1)
+        live = n_values * capture['time_interval_ns'] * 1e-9
+        with self._lock:
+            self.samples_total += samples
+            self.bytes_total += capture.get('transfer_bytes', 2 * n_values * len(capture['buffers']))
+            self.live_seconds_total += live
+            self._cycle_samples += samples
+            self._cycle_live += live
+
+    def cycle(self):
+        """Context manager around one acquisition cycle; exports the metrics when it ends."""
+        if not self.enabled:
+            return _NULL
+        return _Cycle(self)
+
+    def _start_cycle(self):
+        with self._lock:
+            self._cycle_stages = {}
+            self._cycle_samples = 0
+            self._cycle_live = 0.0
+        if self.profile == 'cprofile':
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.profile == 'tracemalloc':
+            import tracemalloc
+            tracemalloc.reset_peak()
+            self._snapshot = tracemalloc.take_snapshot()
+        self._cycle_start = time_lib.perf_counter()
+
+    def _end_cycle(self, failed=False):
+        seconds = time_lib.perf_counter() - self._cycle_start
+        profile = self._save_profile()
+        self.observe('cycle', seconds)
+        with self._lock:
+            self.cycles += 1
+            self.failed_cycles += int(failed)
+            self.cycle_seconds_total += seconds
+            # Share of the cycle during which the scope was not recording
+            self.dead_time_ratio = max(0.0, 1 - self._cycle_live / seconds) if seconds > 0 else 0.0
+            self.samples_per_second = self._cycle_samples / seconds if seconds > 0 else 0.0
+            record = {
+                'cycle': self.cycles,
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'seconds': seconds,
+                'failed': failed,
+                'stages': dict(self._cycle_stages),
+                'samples': self._cycle_samples,
+                'live_seconds': self._cycle_live,
+                'dead_time_ratio': self.dead_time_ratio,
+                'samples_per_second': self.samples_per_second,
+            }
+        record.update(profile)
+        if self.jsonl_path:
+            with open(self.jsonl_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        if self.prometheus_path:
+            self.write_prometheus(self.prometheus_path)
+
+    def _save_profile(self):
+        if self.profile == 'cprofile':
+            self._profiler.disable()
+            path = os.path.join(self.profile_folder, f'cycle_{self.cycles + 1:06d}.prof')
+            self._profiler.dump_stats(path)
+            return {'profile': path}
+        if self.profile == 'tracemalloc':
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            path = os.path.join(self.profile_folder, f'cycle_{self.cycles + 1:06d}_alloc.txt')
+            top = tracemalloc.take_snapshot().compare_to(self._snapshot, 'lineno')[:25]
+            with open(path, 'w') as f:
+                f.write('\n'.join(str(stat) for stat in top) + '\n')
+            return {'profile': path, 'peak_memory_bytes': peak, 'traced_memory_bytes': current}
+        return {}
+
+    # -------------------- EXPORT --------------------
+    def prometheus_text(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = ['# HELP picoscope_stage_seconds Duration of each acquisition stage.',
+                 '# TYPE picoscope_stage_seconds histogram']
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'picoscope_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'picoscope_stage_seconds_sum{{stage="{name}"}} {histogram.sum}')
+                lines.append(f'picoscope_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+            values = [
+                ('picoscope_cycles_total', 'counter', 'Acquisition cycles.', self.cycles),
+                ('picoscope_failed_cycles_total', 'counter', 'Cycles that raised an exception.', self.failed_cycles),
+                ('picoscope_samples_total', 'counter', 'Raw samples captured, all channels.', self.samples_total),
+                ('picoscope_transfer_bytes_total', 'counter', 'Bytes downloaded from the scope.', self.bytes_total),
+                ('picoscope_live_seconds_total', 'counter', 'Time the scope was recording.', self.live_seconds_total),
+                ('picoscope_cycle_seconds_total', 'counter', 'Wall time of all cycles.', self.cycle_seconds_total),
+                ('picoscope_dead_time_ratio', 'gauge', 'Share of the last cycle without recording.',
+                 self.dead_time_ratio),
+                ('picoscope_samples_per_second', 'gauge', 'Samples/s over the last cycle.', self.samples_per_second),
+            ]
+        for name, kind, help_text, value in values:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Rewrite ``path`` atomically, so a scrape never sees half a file."""
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+    def summary(self):
+        """Per-stage count, mean, p50, p95 and max in ms, plus the totals."""
+        with self._lock:
+            stages = {name: {'count': h.count, 'mean_ms': h.sum / h.count * 1e3, 'p50_ms': h.quantile(0.5) * 1e3,
+                             'p95_ms': h.quantile(0.95) * 1e3, 'max_ms': h.max * 1e3}
+                      for name, h in self.histograms.items() if h.count}
+            overall_dead_time = (1 - self.live_seconds_total / self.cycle_seconds_total
+                                 if self.cycle_seconds_total else 0.0)
+            return {'stages': stages, 'cycles': self.cycles, 'samples_total': self.samples_total,
+                    'dead_time_ratio': max(0.0, overall_dead_time),
+                    'samples_per_second': self.samples_total / self.cycle_seconds_total
+                    if self.cycle_seconds_total else 0.0}
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"{'stage':>12} {'count':>6} {'mean':>9} {'p50':>9} {'p95':>9} {'max':>9}")
+        for name, s in sorted(summary['stages'].items(), key=lambda item: -item[1]['mean_ms'] * item[1]['count']):
+            print(f"{name:>12} {s['count']:>6} {s['mean_ms']:>7.1f}ms {s['p50_ms']:>7.1f}ms {s['p95_ms']:>7.1f}ms "
+                  f"{s['max_ms']:>7.1f}ms")
+        print(f"{summary['cycles']} cycles, dead time {summary['dead_time_ratio'] * 100:.1f} %, "
+              f"{summary['samples_per_second'] / 1e6:.2f} MS/s")
+
+
+# Shared disabled instance, used when no metrics are given
+NULL_METRICS = Metrics(enabled=False)
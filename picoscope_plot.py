@@ -0,0 +1,176 @@
+# %%
+"""
+Fast signal and spectrum figures: min/max decimation and a reused Agg figure.
+
+A 7 inch figure at dpi=300 is 2100 pixels wide, so drawing 1.5 M points per
+channel only repaints the same pixel columns again and again. Each trace is
+reduced to the minimum and maximum of every pixel column first, which keeps
+its envelope (and every spike) with a few thousand points. For a capture,
+the reduction is done on the raw int16 counts, and only the few thousand
+kept points are converted to mV.
+
+``SignalPlotter`` draws with the Agg backend on a figure created once and
+updated for every capture, in its own thread, so the acquisition loop only
+pays for the decimation.
+
+    plotter = SignalPlotter(folder='signal')
+    plotter.submit(capture)          # returns right away
+    ...
+    plotter.close()                  # waits for the last figure
+    print(plotter.render_times)
+"""
+import os
+import queue
+import threading
+import time as time_lib
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from picoscope_convert import capture_views, mv_per_count
+
+_STOP = object()
+
+
+def minmax_envelope(values, n_bins, low_values=None):
+    """
+    Min and max of ``values`` in ``n_bins`` equal slices.
+
+    Returns (sample index of each slice start, repeated twice, and the
+    interleaved min/max values): 2 * n_bins points that draw the same
+    envelope as the full trace; shorter traces give a pair per sample.
+    ``low_values`` takes the minima from another array, such as
+    the Min buffer of an AGGREGATE downsampled capture.
+    """
+    values = np.asarray(values).ravel()
+    low_values = values if low_values is None else np.asarray(low_values).ravel()
+    if len(values) <= n_bins:
+        index = np.arange(len(values))
+        return np.repeat(index, 2), np.column_stack((low_values, values)).ravel()
+    starts = np.arange(n_bins) * len(values) // n_bins
+    low = np.minimum.reduceat(low_values, starts)
+    high = np.maximum.reduceat(values, starts)
+    return np.repeat(starts, 2), np.column_stack((low, high)).ravel()
+
+
+def peak_envelope(values, n_bins):
+    """Max of ``values`` in ``n_bins`` equal slices, for spectra where only the peaks matter. Returns (index, max)."""
+    values = np.asarray(values).ravel()
+    if len(values) <= n_bins:
+        return np.arange(len(values)), values
+    starts = np.arange(n_bins) * len(values) // n_bins
+    return starts, np.maximum.reduceat(values, starts)
+
+
+def decimate_capture(capture, n_bins):
+    """
+    Min/max envelopes of every channel of a capture, in mV, with their time in seconds.
+
+    The envelope is taken on the int16 counts (the conversion to mV is a
+    positive scale, so it keeps min and max), and on the Min buffers too for
+    AGGREGATE downsampled captures. The result does not share memory with
+    the capture buffers.
+    """
+    interval_s = capture['time_interval_ns'] * 1e-9
+    lows = capture_views(capture, 'buffers_min')
+    traces = {}
+    for ch, counts in capture_views(capture).items():
+        index, envelope = minmax_envelope(counts, n_bins, lows.get(ch))
+        scale = mv_per_count(capture['ranges'][ch], capture['maxADC'])
+        traces[ch] = (index * interval_s, envelope.astype(np.float32) * np.float32(scale))
+    return traces
+
+
+class SignalPlotter:
+    """
+    Saves a figure of the signals of every submitted capture to ``folder/signal_<timestamp>.png``.
+
+    The figure, axes and lines are created once and only their data changes.
+    Each trace has at most ``2 * points`` points, ``points`` being the figure
+    width in pixels by default. If a figure is still waiting to be drawn when
+    the next capture comes, the older one is dropped (counted in ``skipped``).
+    The time each figure took to draw and save is kept in ``render_times``.
+    """
+
+    labels = {'A': 'Channel A', 'B': 'Channel B', 'C': 'Channel C', 'D': 'Channel D'}
+    alphas = {'D': 0.5}
+
+    def __init__(self, folder='signal', figsize=(7, 5), dpi=300, points=None, verbose=True):
+        self.folder = folder
+        self.dpi = dpi
+        self.n_bins = points or int(figsize[0] * dpi)
+        self.verbose = verbose
+        self.render_times = []
+        self.skipped = 0
+        os.makedirs(folder, exist_ok=True)
+
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        self.ax.set_xlabel('Time (s)', size=16)
+        self.ax.set_ylabel('Voltage (mV)', size=16)
+        self.ax.grid(True)
+        self.lines = {}
+
+        self._queue = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._render_loop, name='picoscope-plotter', daemon=True)
+        self._thread.start()
+
+    def submit(self, capture):
+        """Decimate ``capture`` in the calling thread and queue it to be drawn."""
+        job = (decimate_capture(capture, self.n_bins), capture['timestamp'].strftime("%Y-%m-%d_%H-%M-%S"),
+               1 / (capture['time_interval_ns'] * 1e-9))
+        while True:
+            try:
+                self._queue.put_nowait(job)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.skipped += 1
+                except queue.Empty:
+                    pass
+
+    def render(self, traces, timestamp_str, sample_rate):
+        """Draw the decimated traces and save the figure. Returns the path."""
+        start = time_lib.perf_counter()
+        for ch, (t, mV) in traces.items():
+            if ch not in self.lines:
+                self.lines[ch], = self.ax.plot(t, mV, label=self.labels.get(ch, ch), alpha=self.alphas.get(ch, 1))
+                self.ax.legend()
+            else:
+                self.lines[ch].set_data(t, mV)
+        for ch, line in self.lines.items():
+            line.set_visible(ch in traces)
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view()
+        self.ax.set_title(f'{timestamp_str} time {round(sample_rate/1e6, 2)} MS/s', size=20)
+        path = f'{self.folder}/signal_{timestamp_str}.png'
+        self.figure.savefig(path)
+        seconds = time_lib.perf_counter() - start
+        self.render_times.append(seconds)
+        if self.verbose:
+            print(f"🖼️ {path} drawn in {seconds * 1e3:.0f} ms ({sum(len(t) for t, _ in traces.values())} points)")
+        return path
+
+    def _render_loop(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                break
+            try:
+                self.render(*job)
+            except Exception as e:
+                print(f"❌ Could not draw the signal figure: {e}")
+
+    def close(self):
+        """Draw the figure still queued, then stop the thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
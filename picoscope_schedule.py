@@ -0,0 +1,249 @@
+# %%
+"""
+Acquisitions at fixed wall-clock times instead of a sleep after every cycle.
+
+A sleep after each cycle makes the real period the sleep plus the capture
+and I/O time, so the period drifts, and one slow copy delays every later
+capture. Here each job has a schedule of slots on the wall clock:
+``Every(60)`` fires at every full minute, and ``Cron('0 * * * *')`` at the
+start of every hour. A slot does not depend on when the previous run ended.
+The lateness of each run (the drift) is printed and kept per job.
+
+When a run is still going on at its next slots (overload), the late job
+either runs once for all the slots it missed (``missed='coalesce'``) or
+drops them and waits for its next slot (``missed='skip'``). A run that
+starts within ``tolerance`` seconds of its slot counts as on time.
+Several jobs can share one PicoScopeSession. They run one after the other,
+and when two of them are due the earlier slot goes first.
+
+    scheduler = Scheduler(missed='coalesce')
+    scheduler.add('trend', Every(60), lambda: collect_data(session))
+    scheduler.add('long', Cron('0 * * * *'), lambda: collect_rapid_block(session, 100))
+    scheduler.run()
+"""
+import math
+import threading
+import time as time_lib
+from datetime import datetime, timedelta
+
+from picoscope_metrics import NULL_METRICS
+
+MISSED_POLICIES = ('coalesce', 'skip')
+
+
+class Every:
+    """Slots every ``period`` seconds, at multiples of the period since the epoch plus ``offset``."""
+
+    def __init__(self, period, offset=0.0):
+        if period <= 0:
+            raise ValueError(f"period has to be positive, not {period}")
+        self.period = float(period)
+        self.offset = float(offset)
+
+    def next_after(self, t):
+        """First slot strictly after ``t`` (seconds since the epoch)."""
+        return self.offset + (math.floor((t - self.offset) / self.period) + 1) * self.period
+
+    def __repr__(self):
+        return f'Every({self.period:g}, offset={self.offset:g})'
+
+
+class Cron:
+    """
+    Slots of a 5-field cron expression in local time: minute, hour, day of month, month, day of week.
+
+    Fields accept ``*``, numbers, ranges ``a-b``, steps ``*/n`` or ``a-b/n`` and
+    comma-separated lists. Day of week 0 (or 7) is Sunday. As in cron, when
+    both the day of month and the day of week are restricted, a day matching
+    either one fires.
+    """
+
+    FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression {expression!r} has to have 5 fields")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, name, low, high) for field, (name, low, high) in zip(fields, self.FIELDS))
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _parse(self, field, name, low, high):
+        values = set()
+        for part in field.split(','):
+            span, _, step = part.partition('/')
+            try:
+                step = int(step) if step else 1
+                if span == '*':
+                    start, stop = low, high
+                elif '-' in span:
+                    start, stop = (int(x) for x in span.split('-'))
+                else:
+                    start = stop = int(span)
+            except ValueError:
+                raise ValueError(f"cron {name} field {field!r} is not valid") from None
+            if not low <= start <= stop <= high or step < 1:
+                raise ValueError(f"cron {name} field {field!r} is outside {low}-{high}")
+            values.update(range(start, stop + 1, step))
+        return values
+
+    def _day_matches(self, dt):
+        in_days = dt.day in self.days
+        in_weekdays = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, t):
+        """First slot strictly after ``t`` (seconds since the epoch)."""
+        dt = datetime.fromtimestamp(t).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=5 * 366)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        raise ValueError(f"cron expression {self.expression!r} never fires")
+
+    def __repr__(self):
+        return f'Cron({self.expression!r})'
+
+
+def make_schedule(spec):
+    """``Every`` or ``Cron`` from a config entry: {'every': seconds, 'offset': seconds} or {'cron': '...'}."""
+    if 'cron' in spec:
+        return Cron(spec['cron'])
+    return Every(spec['every'], spec.get('offset', 0.0))
+
+
+class Job:
+    """A named action with its schedule, its next slot and its run counts."""
+
+    def __init__(self, name, schedule, action):
+        self.name = name
+        self.schedule = schedule
+        self.action = action
+        self.next_slot = None
+        self.runs = 0
+        self.failures = 0
+        # slots dropped ('skip') or merged into a late run ('coalesce')
+        self.skipped = 0
+        self.coalesced = 0
+        self.drifts = []
+
+    def stats(self):
+        drifts = self.drifts or [0.0]
+        return {'runs': self.runs, 'failures': self.failures, 'skipped': self.skipped, 'coalesced': self.coalesced,
+                'mean_drift_s': sum(drifts) / len(drifts), 'max_drift_s': max(drifts)}
+
+
+class Scheduler:
+    """
+    Runs the added jobs at their slots, one at a time, until ``stop()``.
+
+    Every wait for a slot plus the run that follows is one metrics cycle, so
+    the dead time of ``metrics`` includes the idle time between slots. The
+    lateness of each run is also recorded as the stage 'drift_<job name>'.
+    """
+
+    def __init__(self, missed='coalesce', tolerance=1.0, metrics=None, verbose=True, max_sleep=1.0):
+        if missed not in MISSED_POLICIES:
+            raise ValueError(f"missed must be one of {MISSED_POLICIES}, not {missed!r}")
+        self.missed = missed
+        self.tolerance = tolerance
+        self.metrics = metrics or NULL_METRICS
+        self.verbose = verbose
+        # Sleep in short steps so wall-clock changes and stop() are noticed
+        self.max_sleep = max_sleep
+        self.jobs = []
+        self._stop = threading.Event()
+
+    def add(self, name, schedule, action):
+        """Run ``action()`` at every slot of ``schedule``. Jobs added first win ties."""
+        job = Job(name, schedule, action)
+        self.jobs.append(job)
+        return job
+
+    def stop(self):
+        """Return from ``run()`` after the current run (can be called from another thread)."""
+        self._stop.set()
+
+    def _missed_slots(self, job, now):
+        """Slots of ``job`` after its current one that have already passed."""
+        count = 0
+        slot = job.schedule.next_after(job.next_slot)
+        while slot <= now:
+            count += 1
+            slot = job.schedule.next_after(slot)
+        return count, slot
+
+    def _wait_until(self, t):
+        while not self._stop.is_set():
+            remaining = t - time_lib.time()
+            if remaining <= 0:
+                return True
+            self._stop.wait(min(remaining, self.max_sleep))
+        return False
+
+    def run_once(self):
+        """Wait for the earliest slot and run its job (or drop it). Returns the job, or None when stopped."""
+        with self.metrics.cycle():
+            with self.metrics.stage('idle'):
+                job = min(self.jobs, key=lambda j: j.next_slot)
+                if not self._wait_until(job.next_slot):
+                    return None
+            now = time_lib.time()
+            missed, next_slot = self._missed_slots(job, now)
+            late = now - job.next_slot > self.tolerance
+            if late and self.missed == 'skip':
+                job.skipped += 1 + missed
+                if self.verbose:
+                    print(f"⚠️ {job.name}: {now - job.next_slot:.1f} s late, skipping {1 + missed} slot(s)")
+                job.next_slot = next_slot
+                return job
+
+            drift = now - job.next_slot
+            job.drifts.append(drift)
+            job.coalesced += missed
+            self.metrics.observe(f'drift_{job.name}', drift)
+            if self.verbose:
+                slot_str = datetime.fromtimestamp(job.next_slot).strftime("%Y-%m-%d %H:%M:%S")
+                merged = f", {missed} missed slot(s) merged" if missed else ''
+                print(f"⏱️ {job.name}: slot {slot_str}, started {drift * 1e3:.0f} ms late{merged}")
+            job.next_slot = next_slot
+            try:
+                job.action()
+                job.runs += 1
+            except Exception as e:
+                job.failures += 1
+                print(f"❌ {job.name} failed: {e}")
+            return job
+
+    def run(self, duration=None):
+        """Run the jobs until ``stop()`` or for ``duration`` seconds."""
+        if not self.jobs:
+            raise ValueError("no jobs to run")
+        self._stop.clear()
+        start = time_lib.time()
+        for job in self.jobs:
+            job.next_slot = job.schedule.next_after(start)
+        if duration is not None:
+            timer = threading.Timer(duration, self.stop)
+            timer.daemon = True
+            timer.start()
+        while not self._stop.is_set():
+            self.run_once()
+        return self.stats()
+
+    def stats(self):
+        """Runs, failures, skipped and coalesced slots and drift of every job."""
+        return {job.name: job.stats() for job in self.jobs}
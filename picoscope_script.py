@@ -1,403 +1,231 @@
 # %%
-import ctypes
-import numpy as np
-from picosdk.ps5000a import ps5000a as ps
-import matplotlib.pyplot as plt
-from picosdk.functions import adc2mV, assert_pico_ok, mV2adc
-import time as time_lib
-from datetime import datetime
 import os
-import pandas as pd
-import shutil
+from contextlib import ExitStack, closing
+from functools import partial
+import itertools
+from picoscope_session import PicoScopeSession
+from picoscope_plot import SignalPlotter
+from picoscope_storage import CaptureWriter, partitioned_name, write_capture, write_capture_mV
+from picoscope_io import WritePipeline
+from picoscope_catalog import Catalog, SummaryStats
+from picoscope_events import make_detector
+from picoscope_config import load_config, apply_config, profile_configs
+from picoscope_metrics import Metrics, NULL_METRICS
+from picoscope_schedule import Scheduler, make_schedule
+
+CONFIG_FILE = 'picoscope_config.json'
+
+if os.environ.get('PICOSCOPE_DRIVER', 'picosdk') == 'fake':
+    # Simulated 5442A with realistic timings (picoscope_fake.py), for machines without the PicoSDK or a scope
+    from picoscope_fake import FakePs5000a
+    ps = FakePs5000a.realistic()
+else:
+    from picosdk.ps5000a import ps5000a as ps
+
+def configure_session(session, config=None):
+    """
+    Channel, trigger and capture setup from picoscope_config.json, pushed to the scope by the session when it changes.
+
+    The timebase is solved for the requested sample rate and the enabled
+    channels, and the sample count is capped to the scope memory (see
+    picoscope_config.py). Without the file, the defaults are the former
+    constants: A at 20V, B-D at 2V, trigger level 1 on any channel, 0.5 MS/s
+    for 3 s with 10000 pre-trigger samples.
+    """
+    if config is None:
+        config = load_config(CONFIG_FILE if os.path.exists(CONFIG_FILE) else None)
+    apply_config(session, config)
+    return config
+
+
+def capture_filename(prefix, timestamp, layout = 'date', profile = None):
+    """
+    <prefix>_<timestamp>-<milliseconds>[_<profile>].parquet, inside its YYYY/MM/DD day folder with layout 'date'.
+
+    The milliseconds and the schedule profile name keep apart the files of
+    profiles that fire in the same second into the same folder.
+    """
+    filename = f'{prefix}_{timestamp.strftime("%Y-%m-%d_%H-%M-%S")}-{timestamp.microsecond // 1000:03d}'
+    if profile is not None:
+        filename += f'_{profile}'
+    filename += '.parquet'
+    return partitioned_name(filename, timestamp) if layout == 'date' else filename
+
+
+def refuse_overwrite(path):
+    """Raise FileExistsError if ``path`` exists: a capture never replaces another one."""
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists, not overwriting it")
 
 
 # Assuming your data collection and plotting part is inside a function or a block
-def collect_data(path_to_save_locally = '.', plots_signal = False):
-    # -------------------- SAFETY CHECK BEFORE STARTING --------------------
-    print("🔒 Running safety check before opening PicoScope...")
-
-    # Set a flag to indicate whether to proceed
-    SAFE_TO_START = True
-
-    # 1. Try to close any previously opened device
-    try:
-        status = {}
-        if 'chandle' in globals():
-            print("🔄 Closing previously opened PicoScope handle...")
-            status["closeUnit"] = ps.ps5000aCloseUnit(chandle)
-            assert_pico_ok(status["closeUnit"])
-            del chandle
-    except Exception as e:
-        print(f"⚠️ Warning: Could not close previous unit. Proceeding anyway.\nDetails: {e}")
-
-    # 2. Additional user-defined safety checks (optional)
-    # Example: Check file handles, log files, cleanup temp folders, etc.
-    # ...
-
-    # 3. Confirm with the user or log
-    if SAFE_TO_START:
-        print("✅ Safety check passed. Proceeding with PicoScope setup.")
-    else:
-        print("❌ Safety check failed. Exiting script.")
-        exit()
-
-    # -------------------- BEGIN PICO INITIALIZATION --------------------
-    # Create chandle and status ready for use
-    chandle = ctypes.c_int16()
-    status = {}
-
-    # Open 5000 series PicoScope
-    # Resolution set to 12 Bit
-    resolution =ps.PS5000A_DEVICE_RESOLUTION["PS5000A_DR_12BIT"]
-    # Returns handle to chandle for use in future API functions
-    status["openunit"] = ps.ps5000aOpenUnit(ctypes.byref(chandle), None, resolution)
-
-    try:
-        assert_pico_ok(status["openunit"])
-    except: # PicoNotOkError:
-
-        powerStatus = status["openunit"]
-
-        if powerStatus == 286:
-            status["changePowerSource"] = ps.ps5000aChangePowerSource(chandle, powerStatus)
-        elif powerStatus == 282:
-            status["changePowerSource"] = ps.ps5000aChangePowerSource(chandle, powerStatus)
-        else:
-            raise
-
-        assert_pico_ok(status["changePowerSource"])
-    # Set up channel A
-    # handle = chandle
-    channel = ps.PS5000A_CHANNEL["PS5000A_CHANNEL_A"]
-    # enabled = 1
-    coupling_type = ps.PS5000A_COUPLING["PS5000A_DC"]
-    chARange = ps.PS5000A_RANGE["PS5000A_20V"]
-    # analogue offset = 0 V
-    status["setChA"] = ps.ps5000aSetChannel(chandle, channel, 1, coupling_type, chARange, 0)
-    assert_pico_ok(status["setChA"])
-    #print('assert_pico_ok(status["setChA"])', assert_pico_ok(status["setChA"]))
-
-    # Set up channel B
-    # handle = chandle
-    channel = ps.PS5000A_CHANNEL["PS5000A_CHANNEL_B"]
-    # enabled = 1
-    # coupling_type = ps.PS5000A_COUPLING["PS5000A_DC"]
-    chBRange = ps.PS5000A_RANGE["PS5000A_2V"]
-    # analogue offset = 0 V
-    status["setChB"] = ps.ps5000aSetChannel(chandle, channel, 1, coupling_type, chBRange, 0)
-    assert_pico_ok(status["setChB"])
-    #print('assert_pico_ok(status["setChB"])', assert_pico_ok(status["setChB"]))
-
-    # Set up channel C
-    # handle = chandle
-    channel = ps.PS5000A_CHANNEL["PS5000A_CHANNEL_C"]
-    # enabled = 1
-    # coupling_type = ps.PS5000A_COUPLING["PS5000A_DC"]
-    chBRange = ps.PS5000A_RANGE["PS5000A_2V"]
-    # analogue offset = 0 V
-    status["setChC"] = ps.ps5000aSetChannel(chandle, channel, 1, coupling_type, chBRange, 0)
-    assert_pico_ok(status["setChC"])
-    #print('assert_pico_ok(status["setChC"])', assert_pico_ok(status["setChC"]))
-
-    # Set up channel D
-    # handle = chandle
-    channel = ps.PS5000A_CHANNEL["PS5000A_CHANNEL_D"]
-    # enabled = 1
-    # coupling_type = ps.PS5000A_COUPLING["PS5000A_DC"]
-    chDRange = ps.PS5000A_RANGE["PS5000A_2V"]
-    # analogue offset = 0 V
-    status["setChD"] = ps.ps5000aSetChannel(chandle, channel, 1, coupling_type, chDRange, 0)
-    assert_pico_ok(status["setChD"])
-    #print('assert_pico_ok(status["setChD"])', assert_pico_ok(status["setChD"]))
-
-
-    # find maximum ADC count value
-    # handle = chandle
-    # pointer to value = ctypes.byref(maxADC)
-    maxADC = ctypes.c_int16()
-    status["maximumValue"] = ps.ps5000aMaximumValue(chandle, ctypes.byref(maxADC))
-    assert_pico_ok(status["maximumValue"])
-    #print('assert_pico_ok(status["maximumValue"]), assert_pico_ok(status["maximumValue"])')
-
-    # Set up an advanced trigger
-    adcTriggerLevelA = 1 #mV2adc(500, chARange, maxADC)
-    adcTriggerLevelB = 1 #mV2adc(500, chARange, maxADC)
-    adcTriggerLevelC = 1 #mV2adc(500, chARange, maxADC)
-    adcTriggerLevelD = 1 #mV2adc(500, chARange, maxADC)
-
-
-    triggerProperties = (ps.PS5000A_TRIGGER_CHANNEL_PROPERTIES_V2 * 4)()
-    triggerProperties[0] = ps.PS5000A_TRIGGER_CHANNEL_PROPERTIES_V2(adcTriggerLevelA,
-                                                                10,
-                                                                0,
-                                                                10,
-                                                                ps.PS5000A_CHANNEL["PS5000A_CHANNEL_A"])
-                                                                
-    triggerProperties[1] = ps.PS5000A_TRIGGER_CHANNEL_PROPERTIES_V2(adcTriggerLevelB,
-                                                                10,
-                                                                0,
-                                                                10,
-                                                                ps.PS5000A_CHANNEL["PS5000A_CHANNEL_B"])
-                                                                
-    triggerProperties[2] = ps.PS5000A_TRIGGER_CHANNEL_PROPERTIES_V2(adcTriggerLevelC,
-                                                                10,
-                                                                0,
-                                                                10,
-                                                                ps.PS5000A_CHANNEL["PS5000A_CHANNEL_C"])
-                                                                
-    triggerProperties[3] = ps.PS5000A_TRIGGER_CHANNEL_PROPERTIES_V2(adcTriggerLevelD,
-                                                                10,
-                                                                0,
-                                                                10,
-                                                                ps.PS5000A_CHANNEL["PS5000A_CHANNEL_D"])
-                                                            
-                                                                
-    status["setTriggerChannelPropertiesV2"] = ps.ps5000aSetTriggerChannelPropertiesV2(chandle, ctypes.byref(triggerProperties), 4, 0)
-    assert_pico_ok(status["setTriggerChannelPropertiesV2"])
-    #print('assert_pico_ok(status["setTriggerChannelPropertiesV2"])', assert_pico_ok(status["setTriggerChannelPropertiesV2"]))
-
-    triggerConditionsA = ps.PS5000A_CONDITION(ps.PS5000A_CHANNEL["PS5000A_CHANNEL_A"],
-                                                            ps.PS5000A_TRIGGER_STATE["PS5000A_CONDITION_TRUE"])
-    triggerConditionsB = ps.PS5000A_CONDITION(ps.PS5000A_CHANNEL["PS5000A_CHANNEL_B"],
-                                                            ps.PS5000A_TRIGGER_STATE["PS5000A_CONDITION_TRUE"])
-    triggerConditionsC = ps.PS5000A_CONDITION(ps.PS5000A_CHANNEL["PS5000A_CHANNEL_C"],
-                                                            ps.PS5000A_TRIGGER_STATE["PS5000A_CONDITION_TRUE"])
-    triggerConditionsD = ps.PS5000A_CONDITION(ps.PS5000A_CHANNEL["PS5000A_CHANNEL_D"],
-                                                            ps.PS5000A_TRIGGER_STATE["PS5000A_CONDITION_TRUE"])
-    clear = 1
-    add = 2
-                                                            
-    status["setTriggerChannelConditionsV2_A"] = ps.ps5000aSetTriggerChannelConditionsV2(chandle, ctypes.byref(triggerConditionsA), 1, (clear + add))
-    assert_pico_ok(status["setTriggerChannelConditionsV2_A"])
-    #print('assert_pico_ok(status["setTriggerChannelConditionsV2_A"])', assert_pico_ok(status["setTriggerChannelConditionsV2_A"]))
-    status["setTriggerChannelConditionsV2_B"] = ps.ps5000aSetTriggerChannelConditionsV2(chandle, ctypes.byref(triggerConditionsB), 1, (add))
-    assert_pico_ok(status["setTriggerChannelConditionsV2_B"])
-    #print('assert_pico_ok(status["setTriggerChannelConditionsV2_B"])', assert_pico_ok(status["setTriggerChannelConditionsV2_B"]))
-    status["setTriggerChannelConditionsV2_C"] = ps.ps5000aSetTriggerChannelConditionsV2(chandle, ctypes.byref(triggerConditionsC), 1, (add))
-    assert_pico_ok(status["setTriggerChannelConditionsV2_C"])
-    #print('assert_pico_ok(status["setTriggerChannelConditionsV2_C"])', assert_pico_ok(status["setTriggerChannelConditionsV2_C"]))
-    status["setTriggerChannelConditionsV2_D"] = ps.ps5000aSetTriggerChannelConditionsV2(chandle, ctypes.byref(triggerConditionsD), 1, (add))
-    assert_pico_ok(status["setTriggerChannelConditionsV2_D"])
-    #print('assert_pico_ok(status["setTriggerChannelConditionsV2_D"])', assert_pico_ok(status["setTriggerChannelConditionsV2_D"]))
-
-    triggerDirections = (ps.PS5000A_DIRECTION * 4)()
-    triggerDirections[0] = ps.PS5000A_DIRECTION(ps.PS5000A_CHANNEL["PS5000A_CHANNEL_A"], 
-                                                                ps.PS5000A_THRESHOLD_DIRECTION["PS5000A_RISING_OR_FALLING"], 
-                                                                ps.PS5000A_THRESHOLD_MODE["PS5000A_LEVEL"])
-    triggerDirections[1] = ps.PS5000A_DIRECTION(ps.PS5000A_CHANNEL["PS5000A_CHANNEL_B"], 
-                                                                ps.PS5000A_THRESHOLD_DIRECTION["PS5000A_RISING_OR_FALLING"], 
-                                                                ps.PS5000A_THRESHOLD_MODE["PS5000A_LEVEL"])
-    triggerDirections[2] = ps.PS5000A_DIRECTION(ps.PS5000A_CHANNEL["PS5000A_CHANNEL_C"], 
-                                                                ps.PS5000A_THRESHOLD_DIRECTION["PS5000A_RISING_OR_FALLING"], 
-                                                                ps.PS5000A_THRESHOLD_MODE["PS5000A_LEVEL"])
-    triggerDirections[3] = ps.PS5000A_DIRECTION(ps.PS5000A_CHANNEL["PS5000A_CHANNEL_D"], 
-                                                                ps.PS5000A_THRESHOLD_DIRECTION["PS5000A_RISING_OR_FALLING"], 
-                                                                ps.PS5000A_THRESHOLD_MODE["PS5000A_LEVEL"])
-    status["setTriggerChannelDirections"] = ps.ps5000aSetTriggerChannelDirectionsV2(chandle, ctypes.byref(triggerDirections), 4)
-    assert_pico_ok(status["setTriggerChannelDirections"])
-
-
-    # Get timebase information
-    # Warning: When using this example it may not be possible to access all Timebases as all channels are enabled by default when opening the scope.  
-    # To access these Timebases, set any unused analogue channels to off.
-    # handle = chandle
-    ############
-    
-    # Desired sample rate (1 MS/s)
-    desired_sample_rate = 500000  # 1 MS/s
-    duration = 3
-    maxSamples = duration * desired_sample_rate
-    preTriggerSamples = 10000  # Example value
-    #maxSamples = preTriggerSamples + postTriggerSamples
-    
-    # Set the max number of samples to capture
-    #maxSamples = 2000000
-
-    # Step 1: Find the timebase corresponding to 1 MS/s
-    timebase = 8 * 16   # Example; verify or adjust to get the (128) 0.5 MS/s rate
-    timeIntervalns = ctypes.c_float()  # Time interval between samples (ns)
-    returnedMaxSamples = ctypes.c_int32()
-
-    # Get the timebase info for the selected timebase
-    status["getTimebase2"] = ps.ps5000aGetTimebase2(chandle, timebase, maxSamples, ctypes.byref(timeIntervalns), ctypes.byref(returnedMaxSamples), 0)
-    assert_pico_ok(status["getTimebase2"])
-
-    # Calculate the actual sample rate
-    sample_rate = 1 / (timeIntervalns.value * 1e-9)  # Convert time interval to seconds and calculate rate
-    #print(f"Timebase {timebase} gives a sample rate of {sample_rate} samples per second.")
-
-    # Step 2: Adjust preTriggerSamples and postTriggerSamples as needed
-    postTriggerSamples = maxSamples - preTriggerSamples
-
-
-    # Step 4: Collect the data (assuming block mode)
-    # You would follow this by collecting the data, handling the trigger, and analyzing the results.
-    # Example: Fetch data and process (you would need to implement your data collection part here)
-
-    ############
-    
-    status["runBlock"] = ps.ps5000aRunBlock(chandle, preTriggerSamples, postTriggerSamples, timebase, None, 0, None, None)
-    assert_pico_ok(status["runBlock"])
-    #print('assert_pico_ok(status["runBlock"])', assert_pico_ok(status["runBlock"]))
-    
-    # Check for data collection to finish using ps5000aIsReady
-    ready = ctypes.c_int16(0)
-    check = ctypes.c_int16(0)
-    while ready.value == check.value:
-        status["isReady"] = ps.ps5000aIsReady(chandle, ctypes.byref(ready))
-        #print(f"Ready status: {ready.value}")
-
-
-
-    # Create buffers ready for assigning pointers for data collection
-    bufferAMax = (ctypes.c_int16 * maxSamples)()
-    bufferAMin = (ctypes.c_int16 * maxSamples)() # used for downsampling which isn't in the scope of this example
-    bufferBMax = (ctypes.c_int16 * maxSamples)()
-    bufferBMin = (ctypes.c_int16 * maxSamples)() # used for downsampling which isn't in the scope of this example
-
-
-    bufferCMax = (ctypes.c_int16 * maxSamples)()
-    bufferCMin = (ctypes.c_int16 * maxSamples)() # used for downsampling which isn't in the scope of this example
-    bufferDMax = (ctypes.c_int16 * maxSamples)()
-    bufferDMin = (ctypes.c_int16 * maxSamples)() # used for downsampling which isn't in the scope of this example
-
-    # Set data buffer location for data collection from channel A
-    # handle = chandle
-    
-
-    timestamp_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-
-    # Channel A
-    source = ps.PS5000A_CHANNEL["PS5000A_CHANNEL_A"]
-    # pointer to buffer max = ctypes.byref(bufferAMax)
-    # pointer to buffer min = ctypes.byref(bufferAMin)
-    # buffer length = maxSamples
-    # segment index = 0
-    # ratio mode = PS5000A_RATIO_MODE_NONE = 0
-    status["setDataBuffersA"] = ps.ps5000aSetDataBuffers(chandle, source, ctypes.byref(bufferAMax), ctypes.byref(bufferAMin), maxSamples, 0, 0)
-    assert_pico_ok(status["setDataBuffersA"])
-
-    # Set data buffer location for data collection from channel B
-    # handle = chandle
-
-
-    # Channel B
-    source = ps.PS5000A_CHANNEL["PS5000A_CHANNEL_B"]
-    # pointer to buffer max = ctypes.byref(bufferBMax)
-    # pointer to buffer min = ctypes.byref(bufferBMin)
-    # buffer length = maxSamples
-    # segment index = 0
-    # ratio mode = PS5000A_RATIO_MODE_NONE = 0
-    status["setDataBuffersB"] = ps.ps5000aSetDataBuffers(chandle, source, ctypes.byref(bufferBMax), ctypes.byref(bufferBMin), maxSamples, 0, 0)
-    assert_pico_ok(status["setDataBuffersB"])
-
-
-    #Channel C
-    source = ps.PS5000A_CHANNEL["PS5000A_CHANNEL_C"]
-    # pointer to buffer max = ctypes.byref(bufferBMax)
-    # pointer to buffer min = ctypes.byref(bufferBMin)
-    # buffer length = maxSamples
-    # segment index = 0
-    # ratio mode = PS5000A_RATIO_MODE_NONE = 0
-    status["setDataBuffersC"] = ps.ps5000aSetDataBuffers(chandle, source, ctypes.byref(bufferCMax), ctypes.byref(bufferCMin), maxSamples, 0, 0)
-    assert_pico_ok(status["setDataBuffersC"])
-
-
-    #Channel D
-    source = ps.PS5000A_CHANNEL["PS5000A_CHANNEL_D"]
-    # pointer to buffer max = ctypes.byref(bufferBMax)
-    # pointer to buffer min = ctypes.byref(bufferBMin)
-    # buffer length = maxSamples
-    # segment index = 0
-    # ratio mode = PS5000A_RATIO_MODE_NONE = 0
-    status["setDataBuffersD"] = ps.ps5000aSetDataBuffers(chandle, source, ctypes.byref(bufferDMax), ctypes.byref(bufferDMin), maxSamples, 0, 0)
-    assert_pico_ok(status["setDataBuffersD"])
-
-    # create overflow loaction
-    overflow = ctypes.c_int16()
-    # create converted type maxSamples
-    cmaxSamples = ctypes.c_int32(maxSamples)
-
-    # Retried data from scope to buffers assigned above
-    # handle = chandle
-    # start index = 0
-    # pointer to number of samples = ctypes.byref(cmaxSamples)
-    # downsample ratio = 0
-    # downsample ratio mode = PS5000A_RATIO_MODE_NONE
-    # pointer to overflow = ctypes.byref(overflow))
-    status["getValues"] = ps.ps5000aGetValues(chandle, 0, ctypes.byref(cmaxSamples), 0, 0, 0, ctypes.byref(overflow))
-    assert_pico_ok(status["getValues"])
-
-
-    # convert ADC counts data to mV
-    adc2mVChAMax =  adc2mV(bufferAMax, chARange, maxADC)
-    adc2mVChBMax =  adc2mV(bufferBMax, chBRange, maxADC)
-    adc2mVChCMax =  adc2mV(bufferCMax, chARange, maxADC)
-    adc2mVChDMax =  adc2mV(bufferDMax, chBRange, maxADC)
-
-    # Create time data
-    time = np.linspace(0, (cmaxSamples.value - 1) * timeIntervalns.value, cmaxSamples.value)
-
-    # Stop the scope
-    # handle = chandle
-    status["stop"] = ps.ps5000aStop(chandle)
-    assert_pico_ok(status["stop"])
-
-    # Close unit Disconnect the scope
-    # handle = chandle
-    status["close"]=ps.ps5000aCloseUnit(chandle)
-    assert_pico_ok(status["close"])
+def save_capture(capture, filename, path_to_save_locally = '.', file_format = 'raw', pipeline = None, metrics = None,
+                 copy = True):
+    """
+    Write a capture now, or hand it to the background pipeline (which writes into its own local_folder).
+
+    copy=False skips the pipeline's copy of captures that own their data.
+    """
+    writer = write_capture if file_format == 'raw' else write_capture_mV
+    if metrics is not None:
+        writer = partial(writer, metrics=metrics)
+    if pipeline is not None:
+        return pipeline.submit(capture, filename, writer, copy=copy)
+    path = f'{path_to_save_locally}/{filename}'
+    refuse_overwrite(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return writer(capture, path)
+
+
+def collect_data(session, path_to_save_locally = '.', plots_signal = False, file_format = 'raw', pipeline = None,
+                 metrics = None, layout = 'date', detector = None, profile = None, plotter = None):
+    """
+    Capture one block and save it as YYYY/MM/DD/aquisition_<timestamp>.parquet (layout 'flat': no day folders).
+
+    The timestamp has milliseconds, and the name of the schedule ``profile``
+    follows it when given (see capture_filename); an existing file is never
+    overwritten.
+
+    file_format 'raw' stores the int16 ADC counts with the ranges, sample
+    interval and timestamp in the Parquet metadata (see picoscope_storage.py);
+    'mV' stores the old float mV/time/units columns. With a WritePipeline
+    (picoscope_io.py) the file is written and copied in the background and
+    the function returns right after the capture. With plots_signal,
+    plotter (a SignalPlotter, see picoscope_plot.py) saves
+    signal/signal_<timestamp>.png in the background.
+    metrics (picoscope_metrics.py) counts the samples and times the
+    writing and plotting stages; the session times its own stages.
+    With an EventDetector (picoscope_events.py) the acquisition file only
+    holds a min/max background of the capture, and the windows around the
+    events go to events_<timestamp>.parquet next to it.
+    """
+    if plots_signal and plotter is None:
+        raise ValueError("plots_signal needs a SignalPlotter as plotter")
+    metrics = metrics or NULL_METRICS
+    # The session keeps the scope open between captures and only pushes the settings that changed
+    capture = session.capture_block()
+    metrics.record_capture(capture)
+    saved, copy = capture, True
+    if detector is not None:
+        with metrics.stage('detect'):
+            events, saved = detector.reduce(capture)
+        # Both are new arrays, the pipeline does not have to copy them
+        copy = False
+        if events is not None:
+            with metrics.stage('save'):
+                save_capture(events, capture_filename('events', capture['timestamp'], layout, profile),
+                             path_to_save_locally, file_format, pipeline, metrics, copy)
+            print(f"{len(detector.last_windows)} event window(s), {events['n_samples']} samples per channel kept")
+    with metrics.stage('save'):
+        path_last = save_capture(saved, capture_filename('aquisition', capture['timestamp'], layout, profile),
+                                 path_to_save_locally, file_format, pipeline, metrics, copy)
 
     # display status returns
     #print(status)
     if plots_signal:
-        path_signal = 'signal'
-        os.makedirs(path_signal, exist_ok = True)
-        plt.figure(figsize = (7,5), dpi = 300)
-        # plot data from channel A and B
-        plt.plot(time/1e9, adc2mVChAMax[:], label = 'Channel A')
-        plt.plot(time/1e9, adc2mVChBMax[:], label = 'Channel B')
-        plt.plot(time/1e9, adc2mVChCMax[:], label = 'Channel C')
-        plt.plot(time/1e9, adc2mVChDMax[:], label = 'Channel D', alpha = 0.5)
-        plt.xlabel('Time (s)', size = 16)
-        plt.legend()
-        plt.grid(True)
-        plt.title(f'{timestamp_str} time {round(sample_rate/1e6, 2)} MS/s', size = 20)
-        plt.ylabel('Voltage (mV)', size = 16)
-        plt.savefig(f'{path_signal}/signal_{timestamp_str}.png')
-        plt.show()
-   
-    # Save to parquet
-    mydict = {'adc2mVChAMax': adc2mVChAMax, 'adc2mVChBMax': adc2mVChBMax, 'adc2mVChCMax':adc2mVChCMax, 'adc2mVChDMax': adc2mVChDMax, 'time': time}
-    df = pd.DataFrame(mydict)
-    df['sampling_rate'] = sample_rate
-    df['time_unit'] = 'ns'
-    df['voltage_unit'] = 'mV'
-    df['timestamp'] = f'{timestamp_str}'
-    
-    #print(timestamp_str)
-    
-    os.makedirs(f'{path_to_save_locally}', exist_ok=True)
-    path_last = f'{path_to_save_locally}/aquisition_{timestamp_str}.parquet'
-    df.to_parquet(path_last, engine = 'pyarrow')
+        # Min/max envelope of every channel (a few thousand points), drawn on a reused figure in another thread
+        with metrics.stage('plot'):
+            plotter.submit(capture)
+
     return path_last
     #print("Collecting data...") 
-# Main loop for acquisition every 10 minutes
 
-picoscope_flag = True
-my_eos_folder = 'try'
-os.makedirs(my_eos_folder, exist_ok=True)
-while True:
-    #a = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    #print(a)
-    if picoscope_flag:
-        latest_file = collect_data(path_to_save_locally='.')  # Collect data
-        # Copy to destination folder
-        dest_path = os.path.join(my_eos_folder, latest_file)
-        shutil.copy(latest_file, dest_path)
-        print(f"Copied to {dest_path}")
-    # Wait for 10 minutes (600 seconds)
-    #print("Waiting for next acquisition cycle...")
-    time_lib.sleep(5)  # 10 minutes in seconds
+
+def collect_rapid_block(session, n_segments, path_to_save_locally = '.', file_format = 'raw', pipeline = None,
+                        layout = 'date', profile = None):
+    """
+    Capture n_segments triggers back to back (rapid block mode) and save them in one Parquet file.
+
+    The segments follow each other in the file. With file_format 'raw' the
+    trigger time of every segment (ns relative to the first trigger) is in
+    the metadata; with 'mV' the columns of collect_data() get a segment
+    number and a trigger_time_ns column.
+    """
+    capture = session.capture_rapid_block(n_segments)
+    path_last = save_capture(capture, capture_filename('rapid', capture['timestamp'], layout, profile),
+                             path_to_save_locally, file_format, pipeline)
+    print(f"Saved {n_segments} segments to {path_last}")
+    return path_last
+
+
+def collect_long(session, chunk_samples = 1024 * 1024, path_to_save_locally = '.', pipeline = None, metrics = None,
+                 layout = 'date', profile = None):
+    """
+    Capture one block of any length and write it as (YYYY/MM/DD/)aquisition_<timestamp>.parquet while it is downloaded.
+
+    The block is read from the scope chunk_samples at a time and every chunk
+    is appended to the raw file (CaptureWriter in picoscope_storage.py), so
+    the capture does not have to fit in the host memory. With a pipeline the
+    finished file is copied to its destinations in the background.
+    """
+    metrics = metrics or NULL_METRICS
+    # Closing the generator stops the scope, also when writing fails
+    with closing(session.capture_block_chunks(chunk_samples)) as chunks:
+        first = next(chunks)
+        folder = pipeline.local_folder if pipeline is not None else path_to_save_locally
+        path = f"{folder}/{capture_filename('aquisition', first['timestamp'], layout, profile)}"
+        refuse_overwrite(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Statistics for the catalog, gathered while the chunks go by
+        stats = SummaryStats()
+        with CaptureWriter(path, metrics=metrics) as writer:
+            for chunk in itertools.chain([first], chunks):
+                metrics.record_capture(chunk)
+                stats.add_capture(chunk)
+                writer.write(chunk)
+    if pipeline is not None:
+        pipeline.replicate(writer.path, stats)
+    print(f"Saved {writer.rows} samples per channel to {writer.path}")
+    return writer.path
+
+
+def run_profile(session, config, pipeline = None, metrics = None, detector = None, name = None, plotter = None):
+    """Push the settings of schedule profile ``name`` (the session skips the unchanged ones) and collect one block."""
+    configure_session(session, config)
+    return collect_data(session, path_to_save_locally=config['output']['local_folder'],
+                        plots_signal=config['output']['plots_signal'], file_format=config['output']['file_format'],
+                        pipeline=pipeline, metrics=metrics, layout=config['output']['layout'], detector=detector,
+                        profile=name, plotter=plotter)
+
+
+# Main loop: acquisitions at the wall-clock slots of the schedule profiles (every 10 s by default)
+if __name__ == '__main__':
+    picoscope_flag = True
+    config = load_config(CONFIG_FILE if os.path.exists(CONFIG_FILE) else None)
+    profiles = profile_configs(config)
+
+    # Stage timings, dead time and samples/s, written after every cycle when enabled in the config
+    metrics = Metrics(**config['metrics'])
+    # Open the scope once and keep it open across acquisition cycles and profiles
+    session = PicoScopeSession(driver=ps, resolution=config['resolution'], metrics=metrics)
+    # A slot does not move when a capture or a copy is slow; missed slots are coalesced or skipped
+    scheduler = Scheduler(missed=config['schedule']['missed'], tolerance=config['schedule']['tolerance'],
+                          metrics=metrics)
+    with session, ExitStack() as stack:
+        # One signal figure for the profiles that plot, redrawn in its own thread; leaving the stack draws the last one
+        plotter = None
+        if any(profile['output']['plots_signal'] for _, profile in profiles.values()):
+            plotter = stack.enter_context(SignalPlotter(folder='signal'))
+        # Files are written locally and copied to my_eos_folder in the background, the scope does not wait for them
+        pipelines = {}
+        for name, (timing, profile) in profiles.items():
+            my_eos_folder = profile['output']['destinations']
+            key = (profile['output']['local_folder'], tuple(my_eos_folder))
+            if key not in pipelines:
+                # Every file written locally is added to the catalog of the local folder
+                catalog = stack.enter_context(Catalog(key[0])) if profile['output']['catalog'] else None
+                pipelines[key] = stack.enter_context(WritePipeline(local_folder=key[0], destinations=my_eos_folder,
+                                                                   metrics=metrics, catalog=catalog))
+            # None unless the profile's events section is enabled
+            detector = make_detector(profile['events'])
+            scheduler.add(name, make_schedule(timing),
+                          partial(run_profile, session, profile, pipelines[key], metrics, detector, name, plotter))
+        if picoscope_flag:
+            try:
+                scheduler.run()
+            finally:
+                for name, stats in scheduler.stats().items():
+                    print(f"{name}: {stats['runs']} runs, {stats['skipped']} skipped, {stats['coalesced']} coalesced, "
+                          f"max drift {stats['max_drift_s'] * 1e3:.0f} ms")
 
 # %%
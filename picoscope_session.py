@@ -0,0 +1,769 @@
+# %%
+"""
+Long-lived session with a PicoScope 5000a (5442A).
+
+The unit is opened once and the channel, trigger and timebase configuration
+is cached on the host. Before every capture only the settings that changed
+since the previous capture are pushed to the driver, and when the USB
+connection drops the unit is reopened and the whole cached configuration is
+pushed again.
+
+    from picoscope_session import PicoScopeSession
+
+    with PicoScopeSession() as session:
+        session.set_channel('A', range='20V')
+        session.set_channel('B', range='2V')
+        session.set_trigger(['A', 'B'], level=1)
+        session.set_timebase(128, n_samples=1500000, pre_trigger_samples=10000)
+        capture = session.capture_block()
+
+To run without hardware pass the stand-in driver from ``picoscope_fake.py``:
+``PicoScopeSession(driver=picoscope_fake.ps5000a)``.
+"""
+import asyncio
+import ctypes
+import threading
+import time as time_lib
+from datetime import datetime
+
+import numpy as np
+
+from picoscope_metrics import NULL_METRICS
+
+
+# PICO_STATUS values used by the session (see picosdk.constants.PICO_STATUS)
+PICO_OK = 0x00000000
+PICO_NOT_FOUND = 0x00000003
+PICO_NOT_RESPONDING = 0x00000007
+PICO_INVALID_HANDLE = 0x0000000C
+PICO_INVALID_TIMEBASE = 0x0000000E
+PICO_TOO_MANY_SAMPLES = 0x0000001D
+PICO_BUSY = 0x00000027
+PICO_INTERFACE_NOT_CONNECTED = 0x0000004A
+PICO_POWER_SUPPLY_NOT_CONNECTED = 0x0000011A
+PICO_USB3_0_DEVICE_NON_USB3_0_PORT = 0x0000011E
+
+# Status codes after which the unit has to be reopened
+CONNECTION_LOST = (PICO_NOT_FOUND, PICO_NOT_RESPONDING, PICO_INVALID_HANDLE, PICO_INTERFACE_NOT_CONNECTED)
+
+CHANNELS = ('A', 'B', 'C', 'D')
+
+# Setup pushed for channels that were not configured: the unit opens with all of them on
+DISABLED_CHANNEL = (False, 'DC', '2V', 0.0)
+
+# PS5000A_RATIO_MODE names accepted by set_downsampling()
+RATIO_MODES = ('NONE', 'AGGREGATE', 'DECIMATE', 'AVERAGE')
+
+
+class PicoScopeError(Exception):
+    """A driver call returned something other than PICO_OK."""
+
+    def __init__(self, function, status):
+        super().__init__(f"{function} returned status {status} (0x{status:08X})")
+        self.function = function
+        self.status = status
+
+
+class PicoScopeSession:
+    """
+    Keeps one PicoScope handle open across many captures.
+
+    The ``set_*`` methods only record the wanted configuration; it is pushed
+    to the device by ``apply()``, which ``capture_block()`` calls before
+    arming. ``apply()`` compares every setting with what was last pushed and
+    skips the driver call when nothing changed.
+    """
+
+    def __init__(self, driver=None, resolution='12BIT', max_reconnects=3, reconnect_delay=1.0,
+                 wait_mode='callback', wait_timeout=60.0, poll_min_delay=0.001, poll_max_delay=0.05, metrics=None):
+        if driver is None:
+            from picosdk.ps5000a import ps5000a as driver
+        self.ps = driver
+        self.resolution = resolution
+        self.max_reconnects = max_reconnects
+        self.reconnect_delay = reconnect_delay
+        # stage timings (open, configure, arm, wait, get_values), see picoscope_metrics
+        self.metrics = metrics or NULL_METRICS
+
+        # How to wait for a block capture: 'callback' (lpReady of ps5000aRunBlock),
+        # 'poll' (ps5000aIsReady with back-off) or 'spin' (ps5000aIsReady in a tight loop)
+        self.wait_mode = wait_mode
+        # seconds to wait for the trigger on top of the capture time before a TimeoutError, None waits forever
+        self.wait_timeout = wait_timeout
+        self.poll_min_delay = poll_min_delay
+        self.poll_max_delay = poll_max_delay
+        self._ready = threading.Event()
+        self._ready_status = None
+        self._notify_ready = None
+        # Keep a reference to the ctypes callback, the driver holds only its address
+        self._block_ready_callback = driver.BlockReadyType(self._block_ready)
+
+        self.chandle = ctypes.c_int16()
+        self.is_open = False
+        self.status = {}
+        self.maxADC = ctypes.c_int16()
+
+        # wanted configuration
+        self.channels = {}
+        self.trigger = None
+        self.timebase = None
+        # (sample rate, n_samples, duration, pre-trigger samples) when the timebase is solved by apply()
+        self.sample_rate = None
+        # (timebase, n_samples, pre-trigger samples) solved for the last pushed sample rate
+        self._solved_timebase = None
+        # (timebase, n_samples, pre-trigger samples) of the next capture: the wanted timebase with the
+        # sample count capped to what fits in the memory for the current channels and segments
+        self.capture_timebase = None
+        # number of memory segments, one capture per segment (rapid block mode when > 1)
+        self.segments = 1
+        # (ratio mode, downsample ratio) applied by the scope before the transfer
+        self.downsampling = ('NONE', 1)
+
+        # what was last pushed to the device, keyed by setting
+        self._applied = {}
+        # reusable capture buffers, channel -> (bufferMax, bufferMin)
+        self._buffers = {}
+        # driver overview buffers of the running stream, channel -> buffer
+        self._stream_buffers = {}
+        # rapid block buffers, channel -> (n_segments, n_samples) array, and the Min ones of AGGREGATE
+        self._segment_data = {}
+        self._segment_data_min = {}
+        # result of the last ps5000aGetTimebase2 call
+        self.time_interval_ns = None
+        self.returned_max_samples = None
+
+    # -------------------- OPEN / CLOSE --------------------
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _call(self, function, *args):
+        """Call a driver function, record its status and raise on failure."""
+        status = getattr(self.ps, function)(*args)
+        self.status[function] = status
+        if status != PICO_OK:
+            raise PicoScopeError(function, status)
+        return status
+
+    def open(self):
+        """Open the unit and read the values that only depend on the resolution."""
+        if self.is_open:
+            return
+        with self.metrics.stage('open'):
+            self._open()
+
+    def _open(self):
+        resolution = self.ps.PS5000A_DEVICE_RESOLUTION[f'PS5000A_DR_{self.resolution}']
+        status = self.ps.ps5000aOpenUnit(ctypes.byref(self.chandle), None, resolution)
+        self.status['ps5000aOpenUnit'] = status
+        if status in (PICO_POWER_SUPPLY_NOT_CONNECTED, PICO_USB3_0_DEVICE_NON_USB3_0_PORT):
+            self._call('ps5000aChangePowerSource', self.chandle, status)
+        elif status != PICO_OK:
+            raise PicoScopeError('ps5000aOpenUnit', status)
+        self.is_open = True
+
+        # Nothing has been pushed to this handle yet
+        self._applied = {}
+        self._call('ps5000aMaximumValue', self.chandle, ctypes.byref(self.maxADC))
+        print(f"✅ PicoScope opened (handle {self.chandle.value}).")
+
+    def close(self):
+        """Stop and close the unit. Errors are ignored, the handle may already be gone."""
+        if not self.is_open:
+            return
+        for function in ('ps5000aStop', 'ps5000aCloseUnit'):
+            try:
+                self._call(function, self.chandle)
+            except PicoScopeError as e:
+                print(f"⚠️ Warning: {e}")
+        self.is_open = False
+        self._applied = {}
+
+    # -------------------- WANTED CONFIGURATION --------------------
+    def set_channel(self, channel, enabled=True, coupling='DC', range='2V', offset=0.0):
+        """Record the wanted setup of channel 'A'...'D' (range as in PS5000A_RANGE, e.g. '20V')."""
+        self.channels[channel] = (bool(enabled), coupling, range, float(offset))
+
+    def set_trigger(self, sources, level=1, hysteresis=10, direction='RISING_OR_FALLING'):
+        """Trigger when any of the source channels crosses ``level`` (ADC counts)."""
+        self.trigger = (tuple(sources), int(level), int(hysteresis), direction)
+
+    def set_timebase(self, timebase, n_samples, pre_trigger_samples=0):
+        if not 0 <= pre_trigger_samples <= n_samples:
+            raise ValueError(f"pre_trigger_samples ({pre_trigger_samples}) has to be between 0 and n_samples "
+                             f"({n_samples})")
+        self.timebase = (int(timebase), int(n_samples), int(pre_trigger_samples))
+        self.sample_rate = None
+
+    def set_sample_rate(self, sample_rate, n_samples=None, duration=None, pre_trigger_samples=0):
+        """
+        Ask for a sample rate (S/s) instead of a timebase number.
+
+        ``apply()`` picks the timebase with ``solve_timebase()`` for the
+        enabled channels, resolution and memory segments. The capture length
+        is ``n_samples``, or ``duration`` seconds at the rate obtained; it is
+        capped to what fits in the memory.
+        """
+        if (n_samples is None) == (duration is None):
+            raise ValueError("Give the capture length as either n_samples or duration")
+        if pre_trigger_samples < 0 or (n_samples is not None and pre_trigger_samples > n_samples):
+            raise ValueError(f"pre_trigger_samples ({pre_trigger_samples}) has to be between 0 and n_samples "
+                             f"({n_samples})")
+        self.sample_rate = (float(sample_rate), None if n_samples is None else int(n_samples),
+                            None if duration is None else float(duration), int(pre_trigger_samples))
+
+    def set_downsampling(self, mode='NONE', ratio=1):
+        """
+        Downsample block and rapid block captures on the scope before they are transferred.
+
+        'AGGREGATE' returns the max and the min of every ``ratio`` samples
+        (the Max and Min buffers), 'DECIMATE' every ``ratio``-th sample,
+        'AVERAGE' the mean of every ``ratio`` samples, 'NONE' all samples.
+        """
+        mode = mode.upper()
+        if mode not in RATIO_MODES:
+            raise ValueError(f"Unknown ratio mode {mode!r}, use one of {RATIO_MODES}")
+        if int(ratio) < 1:
+            raise ValueError(f"The downsample ratio must be at least 1, not {ratio}")
+        self.downsampling = (mode, 1 if mode == 'NONE' else int(ratio))
+
+    @property
+    def enabled_channels(self):
+        return [ch for ch in CHANNELS if ch in self.channels and self.channels[ch][0]]
+
+    def channel_range(self, channel):
+        """PS5000A_RANGE enum value of a channel, as needed by adc2mV."""
+        return self.ps.PS5000A_RANGE[f'PS5000A_{self.channels[channel][2]}']
+
+    # -------------------- PUSH CHANGES --------------------
+    def _changed(self, key, value):
+        return self._applied.get(key) != value
+
+    def apply(self):
+        """Push every setting that differs from the last pushed one. Returns the pushed keys."""
+        if not self.is_open:
+            self.open()
+        with self.metrics.stage('configure'):
+            return self._apply()
+
+    def _apply(self):
+        pushed = []
+
+        for ch in CHANNELS:
+            # Channels that were not configured are switched off, so they take no memory or bandwidth
+            wanted = self.channels.get(ch, DISABLED_CHANNEL)
+            if not self._changed(('channel', ch), wanted):
+                continue
+            enabled, coupling, v_range, offset = wanted
+            self._call('ps5000aSetChannel', self.chandle,
+                       self.ps.PS5000A_CHANNEL[f'PS5000A_CHANNEL_{ch}'],
+                       int(enabled),
+                       self.ps.PS5000A_COUPLING[f'PS5000A_{coupling}'],
+                       self.ps.PS5000A_RANGE[f'PS5000A_{v_range}'],
+                       offset)
+            self._applied[('channel', ch)] = wanted
+            pushed.append(('channel', ch))
+
+        # The trigger only involves enabled channels, so it depends on both
+        trigger = None
+        if self.trigger is not None:
+            sources, level, hysteresis, direction = self.trigger
+            trigger = (tuple(ch for ch in sources if ch in self.enabled_channels), level, hysteresis, direction)
+        if trigger is not None and not trigger[0]:
+            # None of the sources is enabled: no trigger
+            trigger = None
+        if self._changed('trigger', trigger) and (trigger is not None or 'trigger' in self._applied):
+            if trigger is None:
+                self._clear_trigger()
+            else:
+                self._push_trigger(*trigger)
+            self._applied['trigger'] = trigger
+            pushed.append('trigger')
+
+        # Segmenting the memory invalidates the registered data buffers
+        if self._changed('segments', self.segments):
+            nMaxSamples = ctypes.c_int32()
+            self._call('ps5000aMemorySegments', self.chandle, self.segments, ctypes.byref(nMaxSamples))
+            self._call('ps5000aSetNoOfCaptures', self.chandle, self.segments)
+            for ch in CHANNELS:
+                self._applied.pop(('buffers', ch), None)
+            self._applied['segments'] = self.segments
+            pushed.append('segments')
+
+        # The timebase of a requested sample rate depends on the enabled channels and the segments
+        if self.sample_rate is not None:
+            rate_key = (self.sample_rate, tuple(self.enabled_channels), self.segments)
+            if self._changed('sample_rate', rate_key):
+                sample_rate, n_samples, duration, preTriggerSamples = self.sample_rate
+                timebase, interval, _ = self.solve_timebase(sample_rate)
+                if n_samples is None:
+                    n_samples = int(round(duration / (interval * 1e-9)))
+                if preTriggerSamples > n_samples:
+                    raise ValueError(f"{preTriggerSamples} pre-trigger samples for a capture of {n_samples} samples")
+                print(f"✅ Timebase {timebase}: {1e3 / interval:.4g} MS/s for {sample_rate / 1e6:.4g} MS/s asked")
+                self._solved_timebase = (timebase, n_samples, preTriggerSamples)
+                self._applied['sample_rate'] = rate_key
+                pushed.append('sample_rate')
+            # Also when unchanged: set_timebase() may have replaced the solved timebase in between
+            self.timebase = self._solved_timebase
+
+        # The valid timebases depend on the enabled channels and the segment size as well
+        if self.timebase is not None:
+            timebase_key = (*self.timebase, tuple(self.enabled_channels), self.segments)
+            if self._changed('timebase', timebase_key):
+                timebase, n_samples, preTriggerSamples = self.timebase
+                interval, max_samples, status = self._get_timebase(timebase, 1)
+                if status != PICO_OK:
+                    raise PicoScopeError('ps5000aGetTimebase2', status)
+                if n_samples > max_samples:
+                    # Only this capture setup is capped: the wanted length is kept for when more memory is free
+                    print(f"⚠️ {n_samples} samples do not fit in the memory, capturing {max_samples}")
+                    n_samples = max_samples
+                    preTriggerSamples = min(preTriggerSamples, n_samples)
+                self.capture_timebase = (timebase, n_samples, preTriggerSamples)
+                timeIntervalns = ctypes.c_float()
+                returnedMaxSamples = ctypes.c_int32()
+                self._call('ps5000aGetTimebase2', self.chandle, timebase, n_samples,
+                           ctypes.byref(timeIntervalns), ctypes.byref(returnedMaxSamples), 0)
+                self.time_interval_ns = timeIntervalns.value
+                self.returned_max_samples = returnedMaxSamples.value
+                self._applied['timebase'] = timebase_key
+                pushed.append('timebase')
+        return pushed
+
+    def _get_timebase(self, timebase, n_samples):
+        """ps5000aGetTimebase2 without raising: (interval in ns, max samples, status)."""
+        timeIntervalns = ctypes.c_float()
+        returnedMaxSamples = ctypes.c_int32()
+        status = self.ps.ps5000aGetTimebase2(self.chandle, timebase, n_samples, ctypes.byref(timeIntervalns),
+                                             ctypes.byref(returnedMaxSamples), 0)
+        return timeIntervalns.value, returnedMaxSamples.value, status
+
+    def solve_timebase(self, sample_rate):
+        """
+        Fastest timebase that does not sample faster than ``sample_rate`` (S/s), asked to the driver.
+
+        The channels and segments have to be pushed first, since they limit
+        the fastest timebase and the memory. When ``sample_rate`` is above
+        what the scope can do, the fastest valid timebase is returned.
+        Returns (timebase, interval in ns, max samples per channel).
+        """
+        target_ns = 1e9 / sample_rate
+        # The interval grows with the timebase number, and timebases that are too fast are refused
+        low, high = 0, 2 ** 32 - 1
+        while low < high:
+            middle = (low + high) // 2
+            interval, _, status = self._get_timebase(middle, 1)
+            if status == PICO_OK and interval >= target_ns * (1 - 1e-6):
+                high = middle
+            elif status in (PICO_OK, PICO_INVALID_TIMEBASE):
+                low = middle + 1
+            else:
+                raise PicoScopeError('ps5000aGetTimebase2', status)
+        interval, max_samples, status = self._get_timebase(low, 1)
+        if status != PICO_OK:
+            raise PicoScopeError('ps5000aGetTimebase2', status)
+        return low, interval, max_samples
+
+    def _push_trigger(self, sources, level, hysteresis, direction):
+        ps = self.ps
+        n = len(sources)
+        triggerProperties = (ps.PS5000A_TRIGGER_CHANNEL_PROPERTIES_V2 * n)()
+        triggerDirections = (ps.PS5000A_DIRECTION * n)()
+        for i, ch in enumerate(sources):
+            source = ps.PS5000A_CHANNEL[f'PS5000A_CHANNEL_{ch}']
+            triggerProperties[i] = ps.PS5000A_TRIGGER_CHANNEL_PROPERTIES_V2(level, hysteresis, 0, hysteresis, source)
+            triggerDirections[i] = ps.PS5000A_DIRECTION(source,
+                                                        ps.PS5000A_THRESHOLD_DIRECTION[f'PS5000A_{direction}'],
+                                                        ps.PS5000A_THRESHOLD_MODE["PS5000A_LEVEL"])
+        self._call('ps5000aSetTriggerChannelPropertiesV2', self.chandle, ctypes.byref(triggerProperties), n, 0)
+
+        # One condition per channel, OR-ed together: clear with the first one, then add
+        clear = 1
+        add = 2
+        for i, ch in enumerate(sources):
+            triggerConditions = ps.PS5000A_CONDITION(ps.PS5000A_CHANNEL[f'PS5000A_CHANNEL_{ch}'],
+                                                     ps.PS5000A_TRIGGER_STATE["PS5000A_CONDITION_TRUE"])
+            self._call('ps5000aSetTriggerChannelConditionsV2', self.chandle, ctypes.byref(triggerConditions), 1,
+                       (clear + add) if i == 0 else add)
+        self._call('ps5000aSetTriggerChannelDirectionsV2', self.chandle, ctypes.byref(triggerDirections), n)
+
+    def _clear_trigger(self):
+        """Remove every trigger condition, so the scope captures as soon as it is armed."""
+        # info = clear only: no condition left
+        self._call('ps5000aSetTriggerChannelConditionsV2', self.chandle, None, 0, 1)
+
+    def _ratio_mode(self):
+        """(PS5000A_RATIO_MODE value, downsample ratio argument, values per buffer divisor) of the downsampling."""
+        mode, ratio = self.downsampling
+        # Without downsampling the driver is called with a ratio of 0, as before
+        return self.ps.PS5000A_RATIO_MODE[f'PS5000A_RATIO_MODE_{mode}'], (0 if mode == 'NONE' else ratio), ratio
+
+    def _data_buffers(self, n_samples):
+        """Reuse the capture buffers and only register them again when their size or ratio mode changed."""
+        ratioMode, _, ratio = self._ratio_mode()
+        n_values = n_samples // ratio
+        for ch in self.enabled_channels:
+            if ch not in self._buffers or len(self._buffers[ch][0]) != n_values:
+                self._buffers[ch] = ((ctypes.c_int16 * n_values)(), (ctypes.c_int16 * n_values)())
+            key = ('buffers', ch)
+            if self._changed(key, ('block', n_values, ratioMode)):
+                bufferMax, bufferMin = self._buffers[ch]
+                # segment index = 0, the ratio mode has to match the one of ps5000aGetValues
+                self._call('ps5000aSetDataBuffers', self.chandle, self.ps.PS5000A_CHANNEL[f'PS5000A_CHANNEL_{ch}'],
+                           ctypes.byref(bufferMax), ctypes.byref(bufferMin), n_values, 0, ratioMode)
+                self._applied[key] = ('block', n_values, ratioMode)
+        return {ch: self._buffers[ch] for ch in self.enabled_channels}
+
+    def _downsampled_capture(self, capture, buffers_min, transfer_s):
+        """Add the downsampling and transfer fields to a capture dictionary."""
+        mode, ratio = self.downsampling
+        n_values = capture['n_samples'] * capture.get('n_segments', 1)
+        capture['raw_time_interval_ns'] = self.time_interval_ns
+        capture['time_interval_ns'] = self.time_interval_ns * ratio
+        capture['pre_trigger_samples'] //= ratio
+        capture['ratio_mode'] = mode
+        capture['downsample_ratio'] = ratio
+        if mode == 'AGGREGATE':
+            capture['buffers_min'] = buffers_min
+        # int16 values that crossed USB, Min buffers included
+        capture['transfer_bytes'] = 2 * n_values * len(capture['buffers']) * (2 if mode == 'AGGREGATE' else 1)
+        capture['transfer_s'] = transfer_s
+        return capture
+
+    # -------------------- CAPTURE --------------------
+    def _with_reconnect(self, capture, *args):
+        """
+        Run ``capture``, reopening the unit and retrying when the connection is lost.
+
+        The unit is reopened by the ``apply()`` of the next attempt, so a unit
+        that is not back yet (PICO_NOT_FOUND) costs one more attempt,
+        ``reconnect_delay`` later, up to ``max_reconnects`` of them.
+        """
+        for attempt in range(self.max_reconnects + 1):
+            try:
+                return capture(*args)
+            except PicoScopeError as e:
+                if e.status not in CONNECTION_LOST or attempt == self.max_reconnects:
+                    raise
+                print(f"🔌 Lost connection to the PicoScope ({e}). Reconnecting in {self.reconnect_delay:g} s...")
+                self.close()
+                time_lib.sleep(self.reconnect_delay)
+
+    def _block_ready(self, handle, status, pParameter):
+        """ps5000aBlockReady callback, called from a driver thread when the capture is done."""
+        self._ready_status = status
+        self._ready.set()
+        notify = self._notify_ready
+        if notify is not None:
+            notify()
+
+    def _run_block(self):
+        """Arm a block capture with the current timebase. The driver calls ``_block_ready`` when it is done."""
+        timebase, n_samples, preTriggerSamples = self.capture_timebase
+        postTriggerSamples = n_samples - preTriggerSamples
+        if postTriggerSamples < 0:
+            raise ValueError(f"{preTriggerSamples} pre-trigger samples for a capture of {n_samples} samples")
+        self._ready.clear()
+        self._ready_status = None
+        lpReady = self._block_ready_callback if self.wait_mode == 'callback' else None
+        with self.metrics.stage('arm'):
+            self._call('ps5000aRunBlock', self.chandle, preTriggerSamples, postTriggerSamples, timebase,
+                       None, 0, lpReady, None)
+
+    def _wait_limit(self):
+        """Seconds to wait for the armed capture: the capture time plus ``wait_timeout``, or None."""
+        if self.wait_timeout is None:
+            return None
+        n_samples = self.capture_timebase[1]
+        return self.wait_timeout + n_samples * self.segments * self.time_interval_ns * 1e-9
+
+    def _timeout(self):
+        # Disarm, otherwise the scope keeps waiting for a trigger
+        self.ps.ps5000aStop(self.chandle)
+        raise TimeoutError(f"No trigger within {self.wait_timeout} s")
+
+    def _wait_ready(self):
+        """Block until the armed capture is done, without spinning unless ``wait_mode`` is 'spin'."""
+        with self.metrics.stage('wait'):
+            self._wait()
+
+    def _wait(self):
+        if self.wait_mode == 'callback':
+            if not self._ready.wait(self._wait_limit()):
+                self._timeout()
+            if self._ready_status != PICO_OK:
+                raise PicoScopeError('ps5000aBlockReady', self._ready_status)
+            return
+
+        # Check for data collection to finish using ps5000aIsReady
+        ready = ctypes.c_int16(0)
+        check = ctypes.c_int16(0)
+        delay = self.poll_min_delay
+        limit = self._wait_limit()
+        start = time_lib.perf_counter()
+        while ready.value == check.value:
+            self._call('ps5000aIsReady', self.chandle, ctypes.byref(ready))
+            if ready.value != check.value:
+                continue
+            if limit is not None and time_lib.perf_counter() - start > limit:
+                self._timeout()
+            if self.wait_mode == 'spin':
+                continue
+            # bounded back-off: poll often right after arming, then at most every poll_max_delay
+            time_lib.sleep(delay)
+            delay = min(delay * 2, self.poll_max_delay)
+
+    def capture_block(self):
+        """
+        Arm, wait for the trigger and download one block.
+
+        The returned buffers are reused by the next capture, so convert or
+        copy them before capturing again. When the connection is lost the
+        unit is reopened and the capture retried up to ``max_reconnects``
+        times.
+        """
+        return self._with_reconnect(self._capture_block)
+
+    def _arm_and_wait(self):
+        self.segments = 1
+        self.apply()
+        self._run_block()
+        self._wait_ready()
+
+    def _capture_block(self):
+        self._arm_and_wait()
+        return self._download_block()
+
+    async def capture_block_async(self):
+        """
+        Same as ``capture_block()``, awaitable so the event loop keeps running while the scope captures.
+
+        The wait is an asyncio future completed by the block-ready callback.
+        ``apply()``, which may have to open the unit, the download and the
+        closing of a lost handle run in the default executor.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_reconnects + 1):
+            try:
+                self.segments = 1
+                await loop.run_in_executor(None, self.apply)
+                if self.wait_mode != 'callback':
+                    await loop.run_in_executor(None, self._run_block)
+                    await loop.run_in_executor(None, self._wait_ready)
+                else:
+                    future = loop.create_future()
+                    self._notify_ready = lambda: loop.call_soon_threadsafe(
+                        lambda: future.done() or future.set_result(None))
+                    try:
+                        self._run_block()
+                        with self.metrics.stage('wait'):
+                            await asyncio.wait_for(future, self._wait_limit())
+                    except asyncio.TimeoutError:
+                        self._timeout()
+                    finally:
+                        self._notify_ready = None
+                    if self._ready_status != PICO_OK:
+                        raise PicoScopeError('ps5000aBlockReady', self._ready_status)
+                return await loop.run_in_executor(None, self._download_block)
+            except PicoScopeError as e:
+                if e.status not in CONNECTION_LOST or attempt == self.max_reconnects:
+                    raise
+                print(f"🔌 Lost connection to the PicoScope ({e}). Reconnecting in {self.reconnect_delay:g} s...")
+                await loop.run_in_executor(None, self.close)
+                await asyncio.sleep(self.reconnect_delay)
+
+    def _download_block(self):
+        timestamp = datetime.now()
+        timebase, n_samples, preTriggerSamples = self.capture_timebase
+        buffers = self._data_buffers(n_samples)
+        ratioMode, downSampleRatio, _ = self._ratio_mode()
+        overflow = ctypes.c_int16()
+        # raw samples to read; on return, the number of values per buffer
+        cmaxSamples = ctypes.c_int32(n_samples)
+        start = time_lib.perf_counter()
+        # start index = 0, segment index = 0
+        self._call('ps5000aGetValues', self.chandle, 0, ctypes.byref(cmaxSamples), downSampleRatio, ratioMode, 0,
+                   ctypes.byref(overflow))
+        transfer_s = time_lib.perf_counter() - start
+        self.metrics.observe('get_values', transfer_s)
+        self._call('ps5000aStop', self.chandle)
+
+        capture = {
+            'buffers': {ch: bufferMax for ch, (bufferMax, bufferMin) in buffers.items()},
+            'n_samples': cmaxSamples.value,
+            'time_interval_ns': self.time_interval_ns,
+            'pre_trigger_samples': preTriggerSamples,
+            'ranges': {ch: self.channel_range(ch) for ch in buffers},
+            'maxADC': self.maxADC,
+            'overflow': overflow.value,
+            'timestamp': timestamp,
+        }
+        return self._downsampled_capture(capture, {ch: bufferMin for ch, (bufferMax, bufferMin) in buffers.items()},
+                                         transfer_s)
+
+    def capture_block_chunks(self, chunk_samples):
+        """
+        Arm and wait like ``capture_block()``, then download the block ``chunk_samples`` raw samples at a time.
+
+        Yields one capture dictionary per chunk, with the values of the chunk
+        in the buffers, ``start_index`` (its first value in the block) and
+        ``total_samples`` (values in the whole block). Only one chunk is held
+        in host memory, whatever the length of the capture, but the buffers
+        are reused by the next chunk: write or copy each chunk before asking
+        for the next one. The scope is stopped when the generator ends or is
+        closed. A lost connection is only retried before the download starts.
+        """
+        self._with_reconnect(self._arm_and_wait)
+        timestamp = datetime.now()
+        timebase, n_samples, preTriggerSamples = self.capture_timebase
+        ratio = self.downsampling[1]
+        # Whole downsampling blocks per chunk, so no block straddles two chunks
+        chunk_samples = max(ratio, chunk_samples // ratio * ratio)
+        buffers = self._data_buffers(min(chunk_samples, n_samples))
+        ratioMode, downSampleRatio, _ = self._ratio_mode()
+        try:
+            for startIndex in range(0, n_samples, chunk_samples):
+                overflow = ctypes.c_int16()
+                cmaxSamples = ctypes.c_int32(min(chunk_samples, n_samples - startIndex))
+                start = time_lib.perf_counter()
+                self._call('ps5000aGetValues', self.chandle, startIndex, ctypes.byref(cmaxSamples), downSampleRatio,
+                           ratioMode, 0, ctypes.byref(overflow))
+                transfer_s = time_lib.perf_counter() - start
+                self.metrics.observe('get_values', transfer_s)
+                capture = {
+                    'buffers': {ch: bufferMax for ch, (bufferMax, bufferMin) in buffers.items()},
+                    'n_samples': cmaxSamples.value,
+                    'start_index': startIndex // ratio,
+                    'total_samples': n_samples // ratio,
+                    'time_interval_ns': self.time_interval_ns,
+                    'pre_trigger_samples': preTriggerSamples,
+                    'ranges': {ch: self.channel_range(ch) for ch in buffers},
+                    'maxADC': self.maxADC,
+                    'overflow': overflow.value,
+                    'timestamp': timestamp,
+                }
+                yield self._downsampled_capture(
+                    capture, {ch: bufferMin for ch, (bufferMax, bufferMin) in buffers.items()}, transfer_s)
+        finally:
+            self._call('ps5000aStop', self.chandle)
+
+    def capture_rapid_block(self, n_segments):
+        """
+        Capture ``n_segments`` triggers back to back and download them in one bulk transfer.
+
+        The memory is split into one segment per trigger and the scope re-arms
+        itself after each one, so no trigger is lost while the host downloads.
+        Returns the same dictionary as ``capture_block()`` with buffers of
+        shape (n_segments, n_samples) and the trigger time of every segment
+        relative to the first one.
+        """
+        return self._with_reconnect(self._capture_rapid_block, n_segments)
+
+    def _capture_rapid_block(self, n_segments):
+        self.segments = int(n_segments)
+        self.apply()
+        self._run_block()
+        self._wait_ready()
+        timestamp = datetime.now()
+        timebase, n_samples, preTriggerSamples = self.capture_timebase
+
+        buffers = self._segment_buffers(n_segments, n_samples)
+        ratioMode, downSampleRatio, _ = self._ratio_mode()
+        overflow = (ctypes.c_int16 * n_segments)()
+        cmaxSamples = ctypes.c_uint32(n_samples)
+        start = time_lib.perf_counter()
+        # from segment 0 to n_segments - 1
+        self._call('ps5000aGetValuesBulk', self.chandle, ctypes.byref(cmaxSamples), 0, n_segments - 1,
+                   downSampleRatio, ratioMode, ctypes.byref(overflow))
+        transfer_s = time_lib.perf_counter() - start
+        self.metrics.observe('get_values', transfer_s)
+
+        # The time stamp counter counts samples between the triggers of consecutive segments
+        triggerInfo = (self.ps.PS5000A_TRIGGER_INFO * n_segments)()
+        self._call('ps5000aGetTriggerInfoBulk', self.chandle, ctypes.byref(triggerInfo), 0, n_segments - 1)
+        counter = np.array([info.timeStampCounter for info in triggerInfo], dtype=np.float64)
+        self._call('ps5000aStop', self.chandle)
+
+        capture = {
+            'buffers': buffers,
+            'n_samples': cmaxSamples.value,
+            'n_segments': n_segments,
+            'trigger_time_ns': (counter - counter[0]) * self.time_interval_ns,
+            'time_interval_ns': self.time_interval_ns,
+            'pre_trigger_samples': preTriggerSamples,
+            'ranges': {ch: self.channel_range(ch) for ch in buffers},
+            'maxADC': self.maxADC,
+            'overflow': np.ctypeslib.as_array(overflow).copy(),
+            'timestamp': timestamp,
+        }
+        return self._downsampled_capture(capture, {ch: self._segment_data_min.get(ch) for ch in buffers},
+                                         transfer_s)
+
+    def _segment_buffers(self, n_segments, n_samples):
+        """One (n_segments, n_values) array per channel, each row registered as the buffer of its segment."""
+        ratioMode, _, ratio = self._ratio_mode()
+        n_values = n_samples // ratio
+        aggregate = self.downsampling[0] == 'AGGREGATE'
+        for ch in self.enabled_channels:
+            key = ('buffers', ch)
+            if self._changed(key, ('rapid', n_segments, n_values, ratioMode)):
+                data = np.zeros((n_segments, n_values), dtype=np.int16)
+                data_min = np.zeros((n_segments, n_values), dtype=np.int16) if aggregate else None
+                source = self.ps.PS5000A_CHANNEL[f'PS5000A_CHANNEL_{ch}']
+                for segment in range(n_segments):
+                    # ctypes array sharing the memory of the row, so the driver writes straight into ``data``
+                    bufferMax = (ctypes.c_int16 * n_values).from_buffer(data[segment])
+                    bufferMin = (ctypes.c_int16 * n_values).from_buffer(data_min[segment]) if aggregate else None
+                    self._call('ps5000aSetDataBuffers', self.chandle, source, ctypes.byref(bufferMax),
+                               ctypes.byref(bufferMin) if aggregate else None, n_values, segment, ratioMode)
+                self._segment_data[ch] = data
+                self._segment_data_min[ch] = data_min
+                self._applied[key] = ('rapid', n_segments, n_values, ratioMode)
+        return {ch: self._segment_data[ch] for ch in self.enabled_channels}
+
+    # -------------------- STREAMING --------------------
+    def start_streaming(self, sample_interval_ns, buffer_size, max_samples=0, auto_stop=False):
+        """
+        Start a ps5000aRunStreaming acquisition.
+
+        The driver writes into one overview buffer of ``buffer_size`` samples
+        per enabled channel, returned here together with the sample interval
+        the driver actually picked. Without ``auto_stop`` the stream runs
+        until ``stop_streaming()``.
+        """
+        self.segments = 1
+        self.apply()
+        self._stream_buffers = {ch: (ctypes.c_int16 * buffer_size)() for ch in self.enabled_channels}
+        for ch, buffer in self._stream_buffers.items():
+            # The same registration slot is used by the block captures, which have to register again
+            self._call('ps5000aSetDataBuffers', self.chandle, self.ps.PS5000A_CHANNEL[f'PS5000A_CHANNEL_{ch}'],
+                       ctypes.byref(buffer), None, buffer_size, 0, 0)
+            self._applied[('buffers', ch)] = ('stream', buffer_size)
+
+        sampleInterval = ctypes.c_int32(int(sample_interval_ns))
+        # no pre-trigger samples, downsample ratio = 1, ratio mode = PS5000A_RATIO_MODE_NONE
+        self._call('ps5000aRunStreaming', self.chandle, ctypes.byref(sampleInterval),
+                   self.ps.PS5000A_TIME_UNITS['PS5000A_NS'], 0, int(max_samples), int(auto_stop), 1, 0, buffer_size)
+        return self._stream_buffers, sampleInterval.value
+
+    def get_streaming_latest_values(self, callback):
+        """
+        Ask the driver to hand over the samples collected since the last call.
+
+        ``callback`` must be a ``ps.StreamingReadyType`` and is called from
+        inside this function. Returns False when no new data was ready yet.
+        """
+        status = self.ps.ps5000aGetStreamingLatestValues(self.chandle, callback, None)
+        self.status['ps5000aGetStreamingLatestValues'] = status
+        if status == PICO_BUSY:
+            return False
+        if status != PICO_OK:
+            raise PicoScopeError('ps5000aGetStreamingLatestValues', status)
+        return True
+
+    def stop_streaming(self):
+        self._call('ps5000aStop', self.chandle)
@@ -0,0 +1,402 @@
+# %%
+"""
+Batch spectrum engine over the Parquet archive.
+
+Every acquisition file in a folder (or only the ones in a time range) is
+turned into one-sided amplitude spectra, one per channel, in a pool of worker
+processes. Real-input FFTs (``rfft``/``rfftfreq``) are used since the signals
+are real, with an optional window and optional Welch averaging over
+overlapping frames. Segments of rapid block files are averaged the same way.
+
+Each acquisition gives one small Parquet file in the output folder, so
+together they form one spectrum table (a row per file and channel, the
+amplitudes as a float32 list up to ``max_freq``, and the RMS, peak and mean
+of the signal, taken from the same read). The source file signature
+(size + mtime, or a content hash) and the analysis parameters are stored in
+its metadata, and a file whose spectrum is up to date is skipped on the next
+run.
+
+    engine = SpectrumEngine(window='hann', nperseg=65536, max_freq=5000)
+    engine.run('try', start='2025-04-11', end='2025-04-12')
+    spectra = read_spectra('ffts/spectra')
+"""
+import hashlib
+import json
+import os
+import re
+import time as time_lib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from picoscope_storage import archive_files, is_raw_capture, read_capture
+
+# 2: rms, peak and mean columns
+SPECTRUM_FORMAT_VERSION = 2
+SPECTRUM_METADATA_KEY = b'picoscope_spectrum'
+
+WINDOWS = {
+    'rect': np.ones,
+    'hann': np.hanning,
+    'hamming': np.hamming,
+    'blackman': np.blackman,
+}
+
+# Windows and frequency axes by length, kept for the life of the worker process
+_windows = {}
+_frequencies = {}
+
+_timestamp_pattern = re.compile(r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})')
+
+
+def file_timestamp(path):
+    """Acquisition time from a file name such as aquisition_2025-04-11_17-43-19.parquet, or None."""
+    match = _timestamp_pattern.search(os.path.basename(path))
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), "%Y-%m-%d_%H-%M-%S")
+
+
+def list_archive(folder, start=None, end=None, pattern='*.parquet'):
+    """
+    Acquisition files of ``folder`` in time order, optionally only from ``start`` up to (excluding) ``end``.
+
+    ``start`` and ``end`` are datetimes or strings such as '2025-04-11 17:00'.
+    Files without a timestamp in their name are only listed when no range is given.
+    The day folders of a partitioned archive are included and event windows
+    files are not (see ``archive_files``).
+    """
+    start = pd.Timestamp(start).to_pydatetime() if start is not None else None
+    end = pd.Timestamp(end).to_pydatetime() if end is not None else None
+    files = []
+    for path in archive_files(folder, start, end, pattern):
+        timestamp = file_timestamp(path)
+        if start is not None or end is not None:
+            if timestamp is None:
+                continue
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp >= end:
+                continue
+        files.append((timestamp or datetime.min, path))
+    return [path for _, path in sorted(files)]
+
+
+def file_signature(path, mode='mtime'):
+    """
+    Identifies the content of an acquisition file.
+
+    'mtime' uses the size and modification time (no read), 'hash' the SHA-1
+    of the content, which survives copies that do not keep the mtime.
+    """
+    if mode == 'hash':
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return f'sha1:{digest.hexdigest()}'
+    stat = os.stat(path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def fast_length(n):
+    """Smallest length >= n whose only prime factors are 2, 3 and 5, where pocketfft is fastest."""
+    best = 2 * n
+    power2 = 1
+    while power2 < best:
+        power3 = power2
+        while power3 < best:
+            length = power3
+            while length < n:
+                length *= 5
+            best = min(best, length)
+            power3 *= 3
+        power2 *= 2
+    return best
+
+
+def window(name, n):
+    key = (name, n)
+    if key not in _windows:
+        _windows[key] = WINDOWS[name](n).astype(np.float32)
+    return _windows[key]
+
+
+def rfft_frequencies(n_fft, interval_ns):
+    key = (n_fft, interval_ns)
+    if key not in _frequencies:
+        _frequencies[key] = np.fft.rfftfreq(n_fft, interval_ns * 1e-9)
+    return _frequencies[key]
+
+
+def amplitude_spectrum(signal, interval_ns, window_name='hann', nperseg=None, overlap=0.5, pad=True):
+    """
+    One-sided amplitude spectrum of ``signal`` (mV), in mV.
+
+    ``signal`` is 1-D, or 2-D with one rapid block segment per row. Without
+    ``nperseg`` each row is one frame; with it, rows are cut in frames of
+    ``nperseg`` samples overlapping by ``overlap`` (Welch). The power of all
+    frames is averaged. The amplitudes are normalised by the window sum, so a
+    sine of amplitude a gives a peak of a, as ``abs(fft) / N * 2`` in
+    picoscope_fft.py did without a window; DC and the Nyquist bin of an even
+    FFT length are not doubled. With ``pad`` the FFT length is rounded up to a
+    fast length. The frames are windowed and transformed a batch at a time.
+
+    Returns (frequencies in Hz, amplitudes, number of frames).
+    """
+    signal = np.atleast_2d(signal)
+    frame_length = nperseg or signal.shape[-1]
+    if frame_length > signal.shape[-1]:
+        raise ValueError(f"nperseg={frame_length} is longer than the {signal.shape[-1]} samples of the signal")
+    step = max(1, int(frame_length * (1 - overlap)))
+    # (rows, frames, frame_length) view of the overlapping frames, no sample is copied
+    frames = np.lib.stride_tricks.sliding_window_view(signal, frame_length, axis=-1)[:, ::step]
+    n_frames = frames.shape[0] * frames.shape[1]
+    w = window(window_name, frame_length)
+    n_fft = fast_length(frame_length) if pad else frame_length
+
+    power = np.zeros(n_fft // 2 + 1)
+    # A few frames at a time, so only their windowed copies are in memory
+    batch = max(1, (1 << 22) // frame_length)
+    for row in frames:
+        for i in range(0, len(row), batch):
+            spectrum = np.fft.rfft(row[i:i + batch] * w, n=n_fft, axis=-1)
+            power += (spectrum.real ** 2 + spectrum.imag ** 2).sum(axis=0)
+    amplitude = np.sqrt(power / n_frames) * 2 / w.sum(dtype=np.float64)
+    # DC and, for an even length, the Nyquist bin have no negative-frequency twin to fold in
+    amplitude[0] /= 2
+    if n_fft % 2 == 0:
+        amplitude[-1] /= 2
+    return rfft_frequencies(n_fft, interval_ns), amplitude.astype(np.float32), n_frames
+
+
+def signal_features(signal):
+    """RMS, peak (largest absolute value) and mean of a mV signal, accumulated in float64."""
+    return {
+        'rms': float(np.sqrt(np.mean(np.square(signal, dtype=np.float64)))),
+        'peak': float(np.max(np.abs(signal))),
+        'mean': float(np.mean(signal, dtype=np.float64)),
+    }
+
+
+def dominant_frequencies(frequencies, amplitude, n_peaks=3):
+    """The ``n_peaks`` highest local maxima of a spectrum (DC excluded), as (Hz, amplitude) lists, strongest first."""
+    inner = amplitude[1:-1]
+    peaks = np.flatnonzero((inner > amplitude[:-2]) & (inner >= amplitude[2:])) + 1
+    peaks = peaks[np.argsort(amplitude[peaks])[::-1][:n_peaks]]
+    return [float(f) for f in frequencies[peaks]], [float(a) for a in amplitude[peaks]]
+
+
+def load_signals(path, channels=None):
+    """
+    mV signals of an acquisition file of either format.
+
+    Returns ({channel: float32 array, one row per segment}, sample interval in ns, timestamp string).
+    The interval is the one of the stored samples, after downsampling. An
+    AGGREGATE file holds the max and min of every block of samples; its
+    signal is their midpoint, which only describes frequencies well below
+    half its (decimated) sampling rate. Event windows files are disjoint
+    slices of a capture and have no spectrum: ValueError.
+    """
+    if is_raw_capture(path):
+        acq = read_capture(path)
+        if 'windows' in acq.metadata:
+            raise ValueError(f"{path} holds event windows, not a continuous signal")
+        n_segments = acq.metadata.get('n_segments', 1)
+        signals = {}
+        for ch in acq.channels:
+            if channels is not None and ch not in channels:
+                continue
+            signal = acq.mV(ch)
+            if ch in acq.min_channels:
+                signal += acq.mV(f'{ch}_min')
+                signal *= np.float32(0.5)
+            signals[ch] = signal.reshape(n_segments, -1)
+        return signals, acq.metadata['sample_interval_ns'], acq.timestamp
+    # Old mV file: read only the wanted channels, and the constant columns from the first row group
+    parquet = pq.ParquetFile(path, memory_map=True)
+    names = parquet.schema_arrow.names
+    wanted = {}
+    for column in names:
+        match = re.fullmatch(r'adc2mVCh(\w)Max', column)
+        if match and (channels is None or match.group(1) in channels):
+            wanted[column] = match.group(1)
+    lows = {f'adc2mVCh{ch}Min': ch for ch in wanted.values() if f'adc2mVCh{ch}Min' in names}
+    first = parquet.read_row_group(0, columns=['sampling_rate', 'timestamp']).to_pandas()
+    n_segments = 1
+    if 'segment' in names:
+        n_segments = len(np.unique(parquet.read(columns=['segment']).column(0).to_numpy()))
+    df = parquet.read(columns=list(wanted) + list(lows)).to_pandas()
+    signals = {ch: df[column].to_numpy(np.float32) for column, ch in wanted.items()}
+    for column, ch in lows.items():
+        signals[ch] = (signals[ch] + df[column].to_numpy(np.float32)) * np.float32(0.5)
+    signals = {ch: signal.reshape(n_segments, -1) for ch, signal in signals.items()}
+    return signals, 1e9 / first['sampling_rate'].iloc[0], str(first['timestamp'].iloc[0])
+
+
+def file_products(path, params):
+    """
+    Spectrum and features of every channel of an acquisition file, from one read of its signals.
+
+    ``params`` are the ones of SpectrumEngine. Returns {'sampling_rate',
+    'timestamp', 'channels': {ch: {'df_hz', 'n_frames', 'amplitude' (up to
+    max_freq), 'rms', 'peak', 'mean'}}}.
+    """
+    signals, interval, timestamp = load_signals(path, params['channels'])
+    channels = {}
+    for ch, signal in signals.items():
+        frequencies, amplitude, n_frames = amplitude_spectrum(
+            signal, interval, params['window'], params['nperseg'], params['overlap'], params['pad'])
+        if params['max_freq'] is not None:
+            amplitude = amplitude[:np.searchsorted(frequencies, params['max_freq'], side='right')]
+        channels[ch] = dict(signal_features(signal), df_hz=float(frequencies[1]), n_frames=n_frames,
+                            amplitude=amplitude)
+    return {'sampling_rate': 1 / (interval * 1e-9), 'timestamp': timestamp, 'channels': channels}
+
+
+def read_file_products(output, path, params):
+    """``file_products`` of ``path`` read back from its spectrum file ``output``, or None if that is not up to date."""
+    existing = read_spectrum_metadata(output)
+    if existing is None or existing['format_version'] != SPECTRUM_FORMAT_VERSION or existing['params'] != params:
+        return None
+    mode = 'hash' if existing['signature'].startswith('sha1:') else 'mtime'
+    if existing['signature'] != file_signature(path, mode):
+        return None
+    rows = pq.read_table(output).to_pylist()
+    channels = {row['channel']: {'df_hz': row['df_hz'], 'n_frames': row['n_frames'],
+                                 'amplitude': np.asarray(row['amplitude'], dtype=np.float32), 'rms': row['rms'],
+                                 'peak': row['peak'], 'mean': row['mean']} for row in rows}
+    return {'sampling_rate': rows[0]['sampling_rate'] if rows else None,
+            'timestamp': rows[0]['timestamp'] if rows else None, 'channels': channels}
+
+
+def read_spectrum_metadata(path):
+    """The ``picoscope_spectrum`` metadata of a spectrum file, or None if there is no readable one."""
+    try:
+        raw = pq.read_schema(path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if SPECTRUM_METADATA_KEY not in raw:
+        return None
+    return json.loads(raw[SPECTRUM_METADATA_KEY])
+
+
+def _process_file(path, output, params, skip, force):
+    """Worker: spectrum of one acquisition file. Returns a small summary, not the spectra."""
+    start = time_lib.perf_counter()
+    signature = file_signature(path, skip)
+    existing = read_spectrum_metadata(output)
+    if not force and existing is not None and existing['format_version'] == SPECTRUM_FORMAT_VERSION \
+            and existing['signature'] == signature and existing['params'] == params:
+        return {'file': path, 'status': 'skipped'}
+
+    products = file_products(path, params)
+    channels = products['channels']
+    n = len(channels)
+    table = pa.table({
+        'file': pa.array([os.path.basename(path)] * n, type=pa.string()),
+        'timestamp': pa.array([products['timestamp']] * n, type=pa.string()),
+        'channel': pa.array(list(channels), type=pa.string()),
+        'sampling_rate': pa.array([products['sampling_rate']] * n, type=pa.float64()),
+        'df_hz': pa.array([p['df_hz'] for p in channels.values()], type=pa.float64()),
+        'n_frames': pa.array([p['n_frames'] for p in channels.values()], type=pa.int32()),
+        'amplitude': pa.array([p['amplitude'] for p in channels.values()], type=pa.list_(pa.float32())),
+        'rms': pa.array([p['rms'] for p in channels.values()], type=pa.float64()),
+        'peak': pa.array([p['peak'] for p in channels.values()], type=pa.float64()),
+        'mean': pa.array([p['mean'] for p in channels.values()], type=pa.float64()),
+    })
+    metadata = {'format_version': SPECTRUM_FORMAT_VERSION, 'source': path, 'signature': signature,
+                'params': params}
+    table = table.replace_schema_metadata({SPECTRUM_METADATA_KEY: json.dumps(metadata)})
+    tmp = f'{output}.tmp'
+    pq.write_table(table, tmp, compression='zstd')
+    os.replace(tmp, output)
+    return {'file': path, 'status': 'processed', 'seconds': time_lib.perf_counter() - start}
+
+
+class SpectrumEngine:
+    """
+    Computes the spectra of an archive of acquisition files into ``output`` (one Parquet file per acquisition).
+
+    ``window`` is one of WINDOWS. ``nperseg`` enables Welch averaging over
+    frames of that many samples overlapping by ``overlap``; None uses each
+    record (segment) as one frame. Only bins up to ``max_freq`` Hz are kept.
+    ``skip`` is 'mtime' or 'hash' (see ``file_signature``). ``workers`` is the
+    number of processes, 0 to run in this process.
+    """
+
+    def __init__(self, output='ffts/spectra', window='hann', nperseg=None, overlap=0.5, max_freq=None,
+                 channels=None, pad=True, skip='mtime', workers=None):
+        if window not in WINDOWS:
+            raise ValueError(f"Unknown window {window!r}, use one of {list(WINDOWS)}")
+        if skip not in ('mtime', 'hash'):
+            raise ValueError(f"skip must be 'mtime' or 'hash', not {skip!r}")
+        self.output = output
+        self.params = {'window': window, 'nperseg': nperseg, 'overlap': overlap, 'max_freq': max_freq,
+                       'channels': list(channels) if channels is not None else None, 'pad': pad}
+        self.skip = skip
+        self.workers = os.cpu_count() if workers is None else workers
+
+    def output_path(self, path):
+        return os.path.join(self.output, os.path.basename(path))
+
+    def run(self, folder, start=None, end=None, force=False):
+        """
+        Compute the spectra of the files of ``folder`` between ``start`` and ``end`` that are not up to date.
+
+        Returns the list of per-file summaries ('processed', 'skipped' or 'failed').
+        """
+        os.makedirs(self.output, exist_ok=True)
+        files = list_archive(folder, start, end)
+        jobs = [(path, self.output_path(path), self.params, self.skip, force) for path in files]
+        begin = time_lib.perf_counter()
+        if self.workers == 0 or len(jobs) <= 1:
+            results = [self._safe_process(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = [pool.submit(_process_file, *job) for job in jobs]
+                results = [self._result(job[0], future) for job, future in zip(jobs, futures)]
+        counts = {status: sum(r['status'] == status for r in results) for status in ('processed', 'skipped', 'failed')}
+        print(f"✅ Spectra of {len(files)} files in {time_lib.perf_counter() - begin:.1f} s: "
+              f"{counts['processed']} processed, {counts['skipped']} up to date, {counts['failed']} failed")
+        return results
+
+    @staticmethod
+    def _safe_process(*job):
+        try:
+            return _process_file(*job)
+        except Exception as e:
+            print(f"❌ Spectrum of {job[0]} failed: {e}")
+            return {'file': job[0], 'status': 'failed', 'error': repr(e)}
+
+    @staticmethod
+    def _result(path, future):
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"❌ Spectrum of {path} failed: {e}")
+            return {'file': path, 'status': 'failed', 'error': repr(e)}
+
+
+def read_spectra(folder='ffts/spectra', channels=None, start=None, end=None):
+    """
+    The spectrum table of ``folder`` as a DataFrame, one row per acquisition file and channel.
+
+    The frequencies of a row are ``np.arange(len(row.amplitude)) * row.df_hz``.
+    """
+    files = list_archive(folder, start, end)
+    if not files:
+        return pd.DataFrame(columns=['file', 'timestamp', 'channel', 'sampling_rate', 'df_hz', 'n_frames',
+                                     'amplitude', 'rms', 'peak', 'mean'])
+    filters = [('channel', 'in', list(channels))] if channels is not None else None
+    tables = [pq.read_table(path, filters=filters) for path in files]
+    return pa.concat_tables([t.replace_schema_metadata(None) for t in tables]).to_pandas()
+
+
+def spectrum_frequencies(row):
+    """Frequency axis in Hz of one row of the spectrum table."""
+    return np.arange(len(row['amplitude'])) * row['df_hz']
@@ -0,0 +1,442 @@
+# %%
+"""
+Compact Parquet format for captures: raw int16 ADC counts plus metadata.
+
+Instead of float64 mV columns, a float64 time column and constant columns
+repeated on every row, a file holds one int16 column of ADC counts per
+enabled channel. Everything needed to get back to mV and to the time axis
+(ranges, maxADC, sample interval, pre-trigger samples, units, timestamp) is
+stored once in the Parquet key-value metadata under the key ``picoscope``.
+Captures downsampled on the scope record the ratio mode and ratio there as
+well; AGGREGATE captures have an ``A_min``... column next to each channel.
+
+    path = write_capture(capture, 'aquisition_2025-04-11_17-43-19.parquet', compression='zstd')
+    acq = read_capture(path)
+    acq.mV('A')          # float32 mV, converted on first access
+    acq.time             # ns, rebuilt from the sample interval
+    df = read_dataframe(path)   # same columns as the old mV files
+
+Captures too long for memory are downloaded in chunks and written one row
+group at a time by ``CaptureWriter``. Readers memory-map the file and only
+decompress the columns and the row groups of the requested time range:
+
+    with CaptureWriter('long.parquet') as writer:
+        for chunk in session.capture_block_chunks(1024 * 1024):
+            writer.write(chunk)
+    time_ns, signals = read_capture('long.parquet').read(['A'], start_ns=60e9, end_ns=660e9)
+
+Event windows from picoscope_events.py are stored the same way; their
+metadata lists the sample ranges of the windows, which ``time`` and
+``read()`` use to place the rows in the capture. Their names start with
+``EVENTS_PREFIX``; the whole acquisition is in the background file next to
+them, so ``archive_files`` leaves them out unless asked.
+
+Archives are laid out in one folder per day, ``<root>/YYYY/MM/DD/<file>``
+(``partitioned_name``). ``archive_files`` lists them and only enters the
+day folders of the requested time range.
+"""
+import glob
+import json
+import math
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from picoscope_convert import MillivoltConverter, capture_views, mv_per_count, channelInputRanges
+from picoscope_metrics import NULL_METRICS
+
+FORMAT_VERSION = 1
+METADATA_KEY = b'picoscope'
+# Day folders of a partitioned archive
+PARTITION_FORMAT = '%Y/%m/%d'
+# MillivoltConverter per thread for write_capture_mV, see _converter()
+_converters = threading.local()
+# Event windows files (picoscope_events.py), written next to the background file of the same acquisition
+EVENTS_PREFIX = 'events_'
+
+
+def partitioned_name(filename, timestamp):
+    """``filename`` inside the day folder of ``timestamp``: 'YYYY/MM/DD/filename'."""
+    return f'{timestamp.strftime(PARTITION_FORMAT)}/{filename}'
+
+
+def time_key(value):
+    """Datetime or string as the '%Y-%m-%d_%H-%M-%S' form of the capture timestamps, which sorts by time."""
+    return pd.Timestamp(value).strftime("%Y-%m-%d_%H-%M-%S")
+
+
+def is_events_file(path):
+    """True for an event windows file: disjoint slices of an acquisition, not a continuous signal."""
+    return os.path.basename(path).startswith(EVENTS_PREFIX)
+
+
+def archive_files(folder, start=None, end=None, pattern='*.parquet', events=False):
+    """
+    Files matching ``pattern`` directly in ``folder`` and in its YYYY/MM/DD day folders, unsorted.
+
+    With ``start`` or ``end`` (datetimes), the year, month and day folders
+    entirely outside that range are not entered. Event windows files are
+    only listed with ``events=True``.
+    """
+    low = start.timetuple()[:3] if start is not None else None
+    high = end.timetuple()[:3] if end is not None else None
+    paths = glob.glob(os.path.join(folder, pattern))
+
+    def walk(path, prefix):
+        if len(prefix) == 3:
+            paths.extend(glob.glob(os.path.join(path, pattern)))
+            return
+        for entry in os.scandir(path):
+            if not entry.name.isdigit() or not entry.is_dir():
+                continue
+            key = prefix + (int(entry.name),)
+            if (low is not None and key < low[:len(key)]) or (high is not None and key > high[:len(key)]):
+                continue
+            walk(entry.path, key)
+
+    if os.path.isdir(folder):
+        walk(folder, ())
+    if not events:
+        paths = [path for path in paths if not is_events_file(path)]
+    return paths
+
+
+def capture_metadata(capture, channels):
+    """The ``picoscope`` metadata of a capture dictionary as returned by PicoScopeSession."""
+    interval = capture['time_interval_ns']
+    metadata = {
+        'format_version': FORMAT_VERSION,
+        'channels': list(channels),
+        'ranges': {ch: int(capture['ranges'][ch]) for ch in channels},
+        'range_mV': {ch: channelInputRanges[capture['ranges'][ch]] for ch in channels},
+        'maxADC': int(getattr(capture['maxADC'], 'value', capture['maxADC'])),
+        'sample_interval_ns': float(interval),
+        'sampling_rate': 1 / (interval * 1e-9),
+        'n_samples': int(capture['n_samples']),
+        'pre_trigger_samples': int(capture.get('pre_trigger_samples', 0)),
+        'time_unit': 'ns',
+        'voltage_unit': 'mV',
+        'timestamp': capture['timestamp'].strftime("%Y-%m-%d_%H-%M-%S"),
+    }
+    if capture.get('ratio_mode', 'NONE') != 'NONE':
+        # One value per downsample_ratio raw samples, sample_interval_ns is the interval between values
+        metadata['downsampling'] = {
+            'ratio_mode': capture['ratio_mode'],
+            'ratio': int(capture['downsample_ratio']),
+            'raw_sample_interval_ns': float(capture['raw_time_interval_ns']),
+            'min_columns': {ch: f'{ch}_min' for ch in capture.get('buffers_min', {})},
+        }
+    if 'n_segments' in capture:
+        # Rapid block: the segments follow each other in the columns
+        metadata['n_segments'] = int(capture['n_segments'])
+        metadata['trigger_time_ns'] = [float(t) for t in capture['trigger_time_ns']]
+    if 'windows' in capture:
+        # Event windows (picoscope_events.py): the rows are the samples of these ranges of the capture
+        metadata['windows'] = capture['windows']
+        metadata['events'] = capture['events']
+    return metadata
+
+
+def window_index(windows):
+    """Sample index in the capture of every row of an event windows file."""
+    pieces = [np.arange(start, stop) for start, stop in windows]
+    return np.concatenate(pieces) if pieces else np.empty(0, dtype=np.int64)
+
+
+def _capture_columns(capture):
+    """int16 Arrow arrays of the counts of every channel and of its Min buffer, without copying them."""
+    columns = {ch: pa.array(counts.ravel(), type=pa.int16()) for ch, counts in capture_views(capture).items()}
+    for ch, counts in capture_views(capture, 'buffers_min').items():
+        columns[f'{ch}_min'] = pa.array(counts.ravel(), type=pa.int16())
+    return columns
+
+
+def write_capture(capture, path, compression='zstd', compression_level=None, row_group_size=1024 * 1024,
+                  metrics=NULL_METRICS):
+    """
+    Write the raw counts of a capture to ``path``.
+
+    ``compression`` is any Parquet codec supported by pyarrow ('zstd', 'lz4',
+    'snappy', 'none', ...). ``row_group_size`` is in rows; smaller row groups
+    let readers skip more of the file when they only need a time slice.
+    ``metrics`` times the 'table' and 'parquet' stages (see picoscope_metrics.py).
+    """
+    with metrics.stage('table'):
+        views = capture_views(capture)
+        metadata = capture_metadata(capture, views)
+        table = pa.table(_capture_columns(capture))
+        table = table.replace_schema_metadata({METADATA_KEY: json.dumps(metadata)})
+    with metrics.stage('parquet'):
+        pq.write_table(table, path, compression=compression, compression_level=compression_level,
+                       row_group_size=row_group_size)
+    return path
+
+
+def _converter():
+    """MillivoltConverter of the calling thread, so each writer thread reuses its own float32 arrays."""
+    if not hasattr(_converters, 'converter'):
+        _converters.converter = MillivoltConverter()
+    return _converters.converter
+
+
+def write_capture_mV(capture, path, compression='snappy', metrics=NULL_METRICS):
+    """
+    Write a capture in the old format: float mV columns, time in ns, units and timestamp on every row.
+
+    The mV arrays are the ones of the thread's MillivoltConverter, reused
+    from one capture to the next. ``metrics`` times the 'conversion',
+    'dataframe' and 'parquet' stages.
+    """
+    interval = capture['time_interval_ns']
+    n = capture['n_samples']
+    mydict = {}
+    converter = _converter()
+    with metrics.stage('conversion'):
+        for ch, mV in converter.convert(capture).items():
+            mydict[f'adc2mVCh{ch}Max'] = mV.ravel()
+        for ch, mV in converter.convert(capture, 'buffers_min').items():
+            mydict[f'adc2mVCh{ch}Min'] = mV.ravel()
+    with metrics.stage('dataframe'):
+        n_segments = capture.get('n_segments', 1)
+        if 'windows' in capture:
+            mydict['time'] = window_index(capture['windows']) * float(interval)
+        else:
+            mydict['time'] = np.tile(np.linspace(0, (n - 1) * interval, n), n_segments)
+        if 'n_segments' in capture:
+            mydict['segment'] = np.repeat(np.arange(n_segments, dtype=np.int32), n)
+            mydict['trigger_time_ns'] = np.repeat(capture['trigger_time_ns'], n)
+        # Copied into the frame: the converter overwrites its arrays on the next capture
+        df = pd.DataFrame(mydict, copy=True)
+        df['sampling_rate'] = 1 / (interval * 1e-9)
+        df['time_unit'] = 'ns'
+        df['voltage_unit'] = 'mV'
+        df['timestamp'] = capture['timestamp'].strftime("%Y-%m-%d_%H-%M-%S")
+        if capture.get('ratio_mode', 'NONE') != 'NONE':
+            df['ratio_mode'] = capture['ratio_mode']
+            df['downsample_ratio'] = capture['downsample_ratio']
+    with metrics.stage('parquet'):
+        df.to_parquet(path, engine='pyarrow', compression=compression)
+    return path
+
+
+class CaptureWriter:
+    """
+    Raw capture file written chunk by chunk, as the chunks come from ``PicoScopeSession.capture_block_chunks()``.
+
+    The metadata is taken from the first chunk, with ``n_samples`` the
+    length of the whole capture. Every chunk becomes row groups of at most
+    ``row_group_size`` rows, so the host never holds more than one chunk.
+    The file is written under a temporary name and renamed by ``close()``;
+    leaving the ``with`` block on an exception deletes it.
+    """
+
+    def __init__(self, path, compression='zstd', compression_level=None, row_group_size=1024 * 1024,
+                 metrics=NULL_METRICS):
+        self.path = path
+        self.compression = compression
+        self.compression_level = compression_level
+        self.row_group_size = row_group_size
+        self.metrics = metrics
+        self.rows = 0
+        self._tmp = f'{path}.tmp'
+        self._writer = None
+        self._schema = None
+
+    def write(self, capture):
+        """Append the samples of a capture (or chunk of one)."""
+        with self.metrics.stage('table'):
+            columns = _capture_columns(capture)
+        if self._writer is None:
+            metadata = capture_metadata(capture, capture['buffers'])
+            metadata['n_samples'] = int(capture.get('total_samples', capture['n_samples']))
+            self._schema = pa.schema([(name, pa.int16()) for name in columns]).with_metadata(
+                {METADATA_KEY: json.dumps(metadata)})
+            self._writer = pq.ParquetWriter(self._tmp, self._schema, compression=self.compression,
+                                            compression_level=self.compression_level)
+        with self.metrics.stage('parquet'):
+            self._writer.write_table(pa.table(columns, schema=self._schema), row_group_size=self.row_group_size)
+        self.rows += capture['n_samples']
+
+    def close(self):
+        """Finish the file and give it its final name. Returns the path."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.replace(self._tmp, self.path)
+        return self.path
+
+    def abort(self):
+        """Drop the partly written file."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.remove(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class Acquisition:
+    """
+    Lazily loaded capture file.
+
+    Only the metadata is read when the object is created; the counts of a
+    channel are read on first access and converted to mV only when asked.
+    The file is memory-mapped, and ``counts(ch, start, stop)`` or ``read()``
+    of a time range only read the row groups that overlap it.
+    """
+
+    def __init__(self, path, memory_map=True):
+        self.path = path
+        self.parquet = pq.ParquetFile(path, memory_map=memory_map)
+        raw = self.parquet.schema_arrow.metadata or {}
+        if METADATA_KEY not in raw:
+            raise ValueError(f"{path} is not a raw capture file (no '{METADATA_KEY.decode()}' metadata)")
+        self.metadata = json.loads(raw[METADATA_KEY])
+        self.channels = self.metadata['channels']
+        self._counts = {}
+        # first row of every row group, and the total row count at the end
+        file_metadata = self.parquet.metadata
+        self._row_starts = np.cumsum([0] + [file_metadata.row_group(i).num_rows
+                                            for i in range(file_metadata.num_row_groups)])
+
+    @property
+    def n_samples(self):
+        return self.parquet.metadata.num_rows
+
+    @property
+    def sampling_rate(self):
+        return self.metadata['sampling_rate']
+
+    @property
+    def timestamp(self):
+        return self.metadata['timestamp']
+
+    @property
+    def downsampling(self):
+        """(ratio mode, ratio) of a capture downsampled on the scope, ('NONE', 1) otherwise."""
+        downsampling = self.metadata.get('downsampling')
+        if downsampling is None:
+            return 'NONE', 1
+        return downsampling['ratio_mode'], downsampling['ratio']
+
+    @property
+    def min_channels(self):
+        """Channels with a Min column (AGGREGATE downsampling)."""
+        return list(self.metadata.get('downsampling', {}).get('min_columns', {}))
+
+    @property
+    def time(self):
+        """Time of every sample in ns, as the old ``time`` column (per segment for rapid block files)."""
+        if 'windows' in self.metadata:
+            return window_index(self.metadata['windows']) * self.metadata['sample_interval_ns']
+        n = self.n_samples // self.metadata.get('n_segments', 1)
+        time = np.arange(n) * self.metadata['sample_interval_ns']
+        return np.tile(time, self.metadata.get('n_segments', 1))
+
+    def counts(self, channel, start=None, stop=None):
+        """
+        int16 counts of a channel ('A') or of its Min column ('A_min'), from row ``start`` up to ``stop``.
+
+        The whole column is cached on first access; a row range is not
+        cached and only reads the row groups it overlaps.
+        """
+        if channel in self._counts or (start is None and stop is None):
+            if channel not in self._counts:
+                column = self.parquet.read(columns=[channel]).column(0)
+                self._counts[channel] = column.to_numpy()
+            return self._counts[channel][start:stop]
+        start, stop, _ = slice(start, stop).indices(self.n_samples)
+        if start >= stop:
+            return np.empty(0, dtype=np.int16)
+        first = np.searchsorted(self._row_starts, start, side='right') - 1
+        last = np.searchsorted(self._row_starts, stop, side='left')
+        column = self.parquet.read_row_groups(range(first, last), columns=[channel]).column(0)
+        offset = self._row_starts[first]
+        return column.to_numpy()[start - offset:stop - offset]
+
+    def sample_range(self, start_ns=None, end_ns=None, segment=0):
+        """Rows of the samples from ``start_ns`` up to ``end_ns`` (time of the ``time`` column) of a segment."""
+        n = self.n_samples // self.metadata.get('n_segments', 1)
+        interval = self.metadata['sample_interval_ns']
+        if 'windows' in self.metadata:
+            # Rows of an event windows file before a sample: the part of every window that precedes it
+            windows = np.asarray(self.metadata['windows'], dtype=np.int64).reshape(-1, 2)
+
+            def row(t_ns):
+                sample = math.ceil(t_ns / interval)
+                return int(np.clip(sample - windows[:, 0], 0, windows[:, 1] - windows[:, 0]).sum())
+            start = 0 if start_ns is None else row(start_ns)
+            return start, n if end_ns is None else max(start, row(end_ns))
+        start = 0 if start_ns is None else min(n, max(0, math.ceil(start_ns / interval)))
+        stop = n if end_ns is None else min(n, max(start, math.ceil(end_ns / interval)))
+        return segment * n + start, segment * n + stop
+
+    def read(self, channels=None, start_ns=None, end_ns=None, segment=0, mV=True):
+        """
+        Time (ns) and signals of ``channels`` from ``start_ns`` up to ``end_ns``.
+
+        Only these columns and the row groups of the range are read. Returns
+        (time, {channel: float32 mV or, with ``mV=False``, int16 counts}).
+        """
+        start, stop = self.sample_range(start_ns, end_ns, segment)
+        channels = self.channels if channels is None else channels
+        n = self.n_samples // self.metadata.get('n_segments', 1)
+        if 'windows' in self.metadata:
+            time = self.time[start:stop]
+        else:
+            time = (np.arange(start, stop) - segment * n) * self.metadata['sample_interval_ns']
+        if mV:
+            return time, {ch: self.mV(ch, start=start, stop=stop) for ch in channels}
+        return time, {ch: self.counts(ch, start, stop) for ch in channels}
+
+    def mV(self, channel, out=None, start=None, stop=None):
+        """Channel in mV as float32. Not cached: keep the result if it is needed more than once."""
+        counts = self.counts(channel, start, stop)
+        if out is None:
+            out = np.empty(counts.shape, dtype=np.float32)
+        scale = mv_per_count(self.metadata['ranges'][channel.split('_')[0]], self.metadata['maxADC'])
+        return np.multiply(counts, np.float32(scale), out=out)
+
+    def to_dataframe(self):
+        """DataFrame with the columns of the old mV format."""
+        df = pd.DataFrame({f'adc2mVCh{ch}Max': self.mV(ch) for ch in self.channels})
+        for ch in self.min_channels:
+            df[f'adc2mVCh{ch}Min'] = self.mV(f'{ch}_min')
+        df['time'] = self.time
+        if 'n_segments' in self.metadata:
+            n = self.n_samples // self.metadata['n_segments']
+            df['segment'] = np.repeat(np.arange(self.metadata['n_segments'], dtype=np.int32), n)
+            df['trigger_time_ns'] = np.repeat(self.metadata['trigger_time_ns'], n)
+        df['sampling_rate'] = self.sampling_rate
+        df['time_unit'] = self.metadata['time_unit']
+        df['voltage_unit'] = self.metadata['voltage_unit']
+        df['timestamp'] = self.timestamp
+        if 'downsampling' in self.metadata:
+            df['ratio_mode'], df['downsample_ratio'] = self.downsampling
+        return df
+
+
+def read_capture(path, memory_map=True):
+    return Acquisition(path, memory_map)
+
+
+def is_raw_capture(path):
+    return METADATA_KEY in (pq.read_schema(path).metadata or {})
+
+
+def read_dataframe(path):
+    """Read a capture file of either format into a DataFrame with the old mV columns."""
+    if is_raw_capture(path):
+        return read_capture(path).to_dataframe()
+    return pd.read_parquet(path)
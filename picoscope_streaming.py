@@ -0,0 +1,351 @@
+# %%
+"""
+Gapless streaming acquisition with ps5000aRunStreaming.
+
+The driver callback copies every block of new samples into a preallocated
+ring buffer of int16 ADC counts. A consumer thread drains the ring buffer and
+hands the samples to a list of sinks (writing to disk, running statistics,
+...). When the consumer falls behind and the ring buffer is full, the samples
+that do not fit are dropped and counted as an overrun. Sinks are told where
+each chunk starts in the stream, so they can record the gaps. An error in
+the polling or in a sink stops the stream and is raised by ``stop()``.
+
+    session = PicoScopeSession()
+    configure_session(session)
+    stream = StreamingAcquisition(session, sample_interval_ns=1000,
+                                  sinks=[RawFileSink('stream'), RunningStats()])
+    stats = stream.run(duration=60)
+"""
+import json
+import os
+import threading
+import time as time_lib
+from datetime import datetime
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Single-producer, single-consumer ring buffer of int16 samples, one row per channel.
+
+    ``written`` and ``read`` count samples since the start, so their
+    difference is the number of samples waiting. The consumer looks at the
+    waiting samples with ``peek()`` without copying them and frees the space
+    with ``consume()`` once it is done. ``gaps`` lists the (ring position,
+    samples dropped) of every overrun, and ``stream_index`` is the index in
+    the whole stream, dropped samples included, of the next sample to read.
+    """
+
+    def __init__(self, n_channels, capacity):
+        self.data = np.zeros((n_channels, capacity), dtype=np.int16)
+        self.capacity = capacity
+        self.written = 0
+        self.read = 0
+        self.overruns = 0
+        self.dropped = 0
+        self.max_fill = 0
+        self.gaps = []
+        # Samples dropped before ``read`` and the first gap after it, only used by the consumer
+        self._skipped = 0
+        self._next_gap = 0
+        self._cond = threading.Condition()
+
+    @property
+    def fill(self):
+        return self.written - self.read
+
+    @property
+    def stream_index(self):
+        return self.read + self._skipped
+
+    def write(self, rows):
+        """Append one equally long array per channel. Returns the number of samples dropped."""
+        n = len(rows[0])
+        free = self.capacity - self.fill
+        dropped = max(0, n - free)
+        if dropped:
+            self.overruns += 1
+            self.dropped += dropped
+            n = free
+            with self._cond:
+                # The samples that fit are kept, the gap follows them
+                self.gaps.append((self.written + n, dropped))
+        # Only the producer moves ``written``, so the free region can be filled without the lock
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        for data, row in zip(self.data, rows):
+            data[start:start + first] = row[:first]
+            data[:n - first] = row[first:n]
+        with self._cond:
+            self.written += n
+            self.max_fill = max(self.max_fill, self.fill)
+            self._cond.notify()
+        return dropped
+
+    def peek(self, max_samples, timeout=None):
+        """Up to ``max_samples`` waiting samples (not wrapping nor crossing a gap), or None after ``timeout``."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.fill > 0, timeout):
+                return None
+            start = self.read % self.capacity
+            n = min(self.fill, max_samples, self.capacity - start)
+            if self._next_gap < len(self.gaps):
+                n = min(n, self.gaps[self._next_gap][0] - self.read)
+        return self.data[:, start:start + n]
+
+    def consume(self, n):
+        with self._cond:
+            self.read += n
+            while self._next_gap < len(self.gaps) and self.gaps[self._next_gap][0] <= self.read:
+                self._skipped += self.gaps[self._next_gap][1]
+                self._next_gap += 1
+
+
+class RawFileSink:
+    """
+    Appends the int16 counts of each channel to its own ``.bin`` file.
+
+    A JSON file next to them holds what is needed to read them back, e.g.
+    ``np.memmap('stream_..._A.bin', dtype=np.int16)``. Samples dropped in an
+    overrun are not in the files: its ``gaps`` list the [stream sample index,
+    number of samples] of every hole, and ``n_samples`` the samples written.
+    """
+
+    def __init__(self, folder='.'):
+        self.folder = folder
+        self.files = {}
+        self.gaps = []
+        self.next_sample = 0
+        self.n_samples = 0
+
+    def open(self, metadata):
+        os.makedirs(self.folder, exist_ok=True)
+        self.metadata = metadata
+        self.prefix = f"{self.folder}/stream_{metadata['timestamp']}"
+        self.gaps = []
+        self.next_sample = 0
+        self.n_samples = 0
+        self._write_metadata()
+        self.files = {ch: open(f'{self.prefix}_{ch}.bin', 'wb') for ch in metadata['channels']}
+
+    def _write_metadata(self):
+        with open(f'{self.prefix}.json', 'w') as f:
+            json.dump(dict(self.metadata, gaps=self.gaps, n_samples=self.n_samples), f, indent=2)
+
+    def __call__(self, chunk, first_sample):
+        if first_sample > self.next_sample:
+            self.gaps.append([self.next_sample, first_sample - self.next_sample])
+        for f, row in zip(self.files.values(), chunk):
+            row.tofile(f)
+        self.next_sample = first_sample + chunk.shape[1]
+        self.n_samples += chunk.shape[1]
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self._write_metadata()
+
+
+class RunningStats:
+    """Per-channel min, max, mean and RMS in ADC counts over the whole stream."""
+
+    def open(self, metadata):
+        n = len(metadata['channels'])
+        self.channels = metadata['channels']
+        self.count = 0
+        self.sum = np.zeros(n)
+        self.sum_sq = np.zeros(n)
+        self.min = np.full(n, np.iinfo(np.int16).max)
+        self.max = np.full(n, np.iinfo(np.int16).min)
+
+    def __call__(self, chunk, first_sample):
+        values = chunk.astype(np.float64)
+        self.count += chunk.shape[1]
+        self.sum += values.sum(axis=1)
+        self.sum_sq += np.einsum('ij,ij->i', values, values)
+        self.min = np.minimum(self.min, chunk.min(axis=1))
+        self.max = np.maximum(self.max, chunk.max(axis=1))
+
+    def close(self):
+        pass
+
+    def summary(self):
+        mean = self.sum / max(self.count, 1)
+        rms = np.sqrt(self.sum_sq / max(self.count, 1))
+        return {ch: {'min': int(self.min[i]), 'max': int(self.max[i]), 'mean': mean[i], 'rms': rms[i]}
+                for i, ch in enumerate(self.channels)}
+
+
+class StreamingAcquisition:
+    """
+    Runs a stream on a ``PicoScopeSession`` with a producer and a consumer thread.
+
+    The producer polls ``ps5000aGetStreamingLatestValues`` and its callback
+    copies the new samples from the driver buffers into the ring buffer. The
+    consumer passes the samples to every sink as ``sink(chunk, first_sample)``
+    where ``chunk`` has one row per enabled channel and ``first_sample`` is
+    the index of its first sample in the stream (samples dropped in overruns
+    included). Sinks may also define ``open(metadata)`` and ``close()``.
+
+    With ``max_samples`` the driver stops the stream by itself (autoStop)
+    after that many samples. Blocks whose voltage went over the range of a
+    channel are counted in ``overflows``.
+    """
+
+    def __init__(self, session, sample_interval_ns, sinks=(), ring_seconds=2.0, driver_buffer_size=100000,
+                 chunk_size=65536, poll_interval=0.001, max_samples=None):
+        self.session = session
+        self.sample_interval_ns = sample_interval_ns
+        self.max_samples = max_samples
+        self.sinks = list(sinks)
+        self.ring_seconds = ring_seconds
+        self.driver_buffer_size = driver_buffer_size
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+
+        self.ring = None
+        self.metadata = None
+        self._stop = threading.Event()
+        self._threads = []
+        self._callback = None
+        self._error = None
+        self.auto_stopped = False
+        self.overflows = {}
+        self.start_time = None
+        self.stop_time = None
+
+    def start(self):
+        session = self.session
+        channels = session.enabled_channels
+        buffers, interval = session.start_streaming(self.sample_interval_ns, self.driver_buffer_size,
+                                                    self.max_samples or 0, auto_stop=self.max_samples is not None)
+        self.sample_interval_ns = interval
+        # NumPy views on the driver buffers, no copy
+        self._driver_buffers = [np.ctypeslib.as_array(buffers[ch]) for ch in channels]
+
+        capacity = max(int(self.ring_seconds / (interval * 1e-9)), 2 * self.driver_buffer_size)
+        self.ring = RingBuffer(len(channels), capacity)
+        self.metadata = {
+            'channels': channels,
+            'ranges': {ch: session.channel_range(ch) for ch in channels},
+            'maxADC': session.maxADC.value,
+            'sample_interval_ns': interval,
+            'timestamp': datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+        }
+        for sink in self.sinks:
+            if hasattr(sink, 'open'):
+                sink.open(self.metadata)
+
+        # Keep a reference to the ctypes callback, the driver calls it until the stream stops
+        self._callback = session.ps.StreamingReadyType(self._streaming_ready)
+        self._stop.clear()
+        self._error = None
+        self.auto_stopped = False
+        self.overflows = {ch: 0 for ch in channels}
+        self._threads = [threading.Thread(target=self._produce, name='picoscope-stream-producer', daemon=True),
+                         threading.Thread(target=self._consume, name='picoscope-stream-consumer', daemon=True)]
+        self.start_time = time_lib.perf_counter()
+        for thread in self._threads:
+            thread.start()
+        print(f"▶️ Streaming {len(channels)} channels at {1e3 / interval:.3f} MS/s.")
+
+    def _streaming_ready(self, handle, noOfSamples, startIndex, overflow, triggerAt, triggered, autoStop, pParameter):
+        # Runs inside ps5000aGetStreamingLatestValues: copy out before the driver reuses its buffers
+        # ctypes only prints the exceptions of a callback: keep them for stop()
+        try:
+            if noOfSamples > 0:
+                self.ring.write([buffer[startIndex:startIndex + noOfSamples] for buffer in self._driver_buffers])
+            if overflow:
+                # Bit 0 is channel A, bit 1 channel B, ...
+                for ch in self.overflows:
+                    if overflow & (1 << (ord(ch) - ord('A'))):
+                        self.overflows[ch] += 1
+            if autoStop:
+                self.auto_stopped = True
+                self._stop.set()
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error):
+        """Keep the first error of a thread for ``stop()`` and stop the stream."""
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _produce(self):
+        try:
+            while not self._stop.is_set():
+                self.session.get_streaming_latest_values(self._callback)
+                time_lib.sleep(self.poll_interval)
+        except Exception as e:
+            print(f"❌ Streaming stopped: {e}")
+            self._fail(e)
+        finally:
+            self.stop_time = time_lib.perf_counter()
+            self._stop.set()
+            try:
+                self.session.stop_streaming()
+            except Exception as e:
+                self._fail(e)
+
+    def _consume(self):
+        while True:
+            chunk = self.ring.peek(self.chunk_size, timeout=0.1)
+            if chunk is None:
+                if self._stop.is_set() and not self._threads[0].is_alive():
+                    break
+                continue
+            try:
+                for sink in self.sinks:
+                    sink(chunk, self.ring.stream_index)
+            except Exception as e:
+                print(f"❌ Sink failed, stopping the stream: {e}")
+                self._fail(e)
+                break
+            self.ring.consume(chunk.shape[1])
+
+    def stop(self):
+        """
+        Stop the stream and wait until the consumer drained the ring buffer.
+
+        Raises the first error of the producer or of a sink, after closing the sinks.
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        for sink in self.sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+        return self.stats()
+
+    def run(self, duration):
+        """Stream for ``duration`` seconds, or less if the stream stopped by itself or failed."""
+        self.start()
+        try:
+            self._stop.wait(duration)
+        finally:
+            stats = self.stop()
+        return stats
+
+    def stats(self):
+        """Overruns and sustained throughput of the stream so far."""
+        end = self.stop_time or time_lib.perf_counter()
+        elapsed = end - self.start_time
+        samples = self.ring.read
+        return {
+            'elapsed_s': elapsed,
+            'samples_per_channel': samples,
+            'throughput_MSps_per_channel': samples / elapsed / 1e6,
+            'target_MSps_per_channel': 1e3 / self.sample_interval_ns,
+            'overruns': self.ring.overruns,
+            'dropped_samples': self.ring.dropped,
+            'gaps': len(self.ring.gaps),
+            'max_ring_fill': self.ring.max_fill / self.ring.capacity,
+            'overflows': dict(self.overflows),
+            'auto_stopped': self.auto_stopped,
+        }
+
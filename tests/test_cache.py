@@ -0,0 +1,80 @@
+# %%
+"""
+FeatureCache (picoscope_cache.py) on top of the spectrum files of SpectrumEngine (picoscope_spectra.py).
+
+    python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import picoscope_cache
+from picoscope_cache import FeatureCache
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+from picoscope_spectra import SpectrumEngine, read_spectra
+from picoscope_storage import write_capture
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """Three raw captures of channels A and B in a flat folder."""
+    folder = tmp_path / 'try'
+    folder.mkdir()
+    session = PicoScopeSession(driver=FakePs5000a())
+    for ch in 'AB':
+        session.set_channel(ch, range='2V')
+    session.set_timebase(128, 4096)
+    with session:
+        for i in range(3):
+            capture = dict(session.capture_block(), timestamp=datetime(2026, 10, 17, 12) + timedelta(minutes=i))
+            write_capture(capture, str(folder / f'aquisition_2026-10-17_12-0{i}-00.parquet'))
+    return str(folder)
+
+
+def no_transform(path, params):
+    raise AssertionError(f"{path} transformed again")
+
+
+def test_features_from_the_spectrum_files(archive, tmp_path, monkeypatch):
+    spectra = str(tmp_path / 'spectra')
+    SpectrumEngine(output=spectra, max_freq=5000, workers=0).run(archive)
+    table = read_spectra(spectra)
+    assert len(table) == 6
+    assert {'rms', 'peak', 'mean'} <= set(table.columns)
+
+    with FeatureCache(str(tmp_path / 'computed.sqlite'), max_freq=5000, workers=0) as cache:
+        cache.update(archive)
+        computed = cache.features()
+
+    # Same parameters as the engine: nothing is transformed again
+    monkeypatch.setattr(picoscope_cache, 'file_products', no_transform)
+    with FeatureCache(str(tmp_path / 'reused.sqlite'), max_freq=5000, workers=0, spectra=spectra) as cache:
+        assert cache.update(archive) == 3
+        reused = cache.features()
+        frequencies, amplitude = cache.spectrum(os.path.join(archive, 'aquisition_2026-10-17_12-01-00.parquet'), 'B')
+    for column in ('rms', 'peak', 'mean', 'dominant_hz', 'dominant_mV'):
+        assert reused[column].tolist() == pytest.approx(computed[column].tolist())
+    assert len(frequencies) == len(amplitude) == len(table['amplitude'][0])
+
+    # Other parameters than the engine's: the spectrum files are not used
+    with FeatureCache(str(tmp_path / 'other.sqlite'), max_freq=1000, workers=0, spectra=spectra) as cache:
+        with pytest.raises(AssertionError):
+            cache.get(os.path.join(archive, 'aquisition_2026-10-17_12-01-00.parquet'))
+
+
+def test_full_update_forgets_removed_files(archive, tmp_path):
+    with FeatureCache(str(tmp_path / 'cache.sqlite'), max_freq=5000, workers=0) as cache:
+        cache.update(archive)
+        os.remove(os.path.join(archive, 'aquisition_2026-10-17_12-00-00.parquet'))
+        # A time range only updates that range
+        cache.update(archive, start='2026-10-17 12:01')
+        assert cache.stats()['files'] == 3
+        cache.update(archive)
+        assert cache.stats()['files'] == 2
+        assert len(cache.features()) == 4
+        assert cache.db.execute("SELECT COUNT(*) FROM spectra").fetchone()[0] == 4
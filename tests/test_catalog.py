@@ -0,0 +1,116 @@
+# %%
+"""
+Catalog (picoscope_catalog.py) of a small day-partitioned archive.
+
+    python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_catalog import Catalog
+from picoscope_convert import mv_per_count
+from picoscope_fake import FakePs5000a
+from picoscope_io import WritePipeline, snapshot_capture
+from picoscope_session import PicoScopeSession
+from picoscope_storage import EVENTS_PREFIX, partitioned_name, write_capture
+
+
+@pytest.fixture
+def capture():
+    session = PicoScopeSession(driver=FakePs5000a())
+    for ch in 'AB':
+        session.set_channel(ch, range='2V')
+    session.set_timebase(128, 1000)
+    with session:
+        return snapshot_capture(session.capture_block())
+
+
+def with_peak(capture, timestamp, peak_mV):
+    """The capture at ``timestamp``, A flat at 0 and B at 0 except one sample at ``peak_mV``."""
+    capture = dict(capture, timestamp=timestamp)
+    scale = mv_per_count(capture['ranges']['B'], capture['maxADC'])
+    b = np.zeros(capture['n_samples'], dtype=np.int16)
+    b[10] = round(peak_mV / scale)
+    capture['buffers'] = {'A': np.zeros(capture['n_samples'], dtype=np.int16), 'B': b}
+    return capture
+
+
+def file_name(timestamp, prefix='aquisition'):
+    return partitioned_name(f'{prefix}_{timestamp.strftime("%Y-%m-%d_%H-%M-%S")}.parquet', timestamp)
+
+
+@pytest.fixture
+def archive(tmp_path, capture):
+    """Archive of 4 captures over 3 days with B peaking at 100, 800, 300 and 1200 mV."""
+    root = tmp_path / 'archive'
+    for timestamp, peak in ((datetime(2026, 10, 15, 23, 59), 100), (datetime(2026, 10, 16, 8, 0), 800),
+                            (datetime(2026, 10, 16, 9, 30), 300), (datetime(2026, 10, 17, 0, 0), 1200)):
+        path = root / file_name(timestamp)
+        os.makedirs(path.parent, exist_ok=True)
+        write_capture(with_peak(capture, timestamp, peak), str(path))
+    return str(root)
+
+
+def test_find_by_time(archive):
+    with Catalog(archive) as catalog:
+        assert catalog.update() == 4
+        assert catalog.update() == 0
+        df = catalog.find('2026-10-16', '2026-10-17')
+        assert list(df['timestamp']) == ['2026-10-16_08-00-00', '2026-10-16_09-30-00']
+        assert list(df['path']) == [os.path.join(archive, file) for file in df['file']]
+        assert df['file'][0] == '2026/10/16/aquisition_2026-10-16_08-00-00.parquet'
+        assert list(df['n_samples']) == [1000, 1000]
+        # The end is excluded
+        assert len(catalog.find(end='2026-10-17 00:00:00')) == 3
+        assert len(catalog.paths()) == 4
+
+
+def test_find_by_channel_statistics(archive):
+    with Catalog(archive) as catalog:
+        catalog.update()
+        df = catalog.find(channel='B', min_peak=500)
+        assert list(df['timestamp']) == ['2026-10-16_08-00-00', '2026-10-17_00-00-00']
+        assert df['peak_mV'].tolist() == pytest.approx([800, 1200], abs=1)
+        assert df['range_mV'].tolist() == [2000, 2000]
+
+        df = catalog.find('2026-10-16', channel='B', min_peak=200, max_peak=1000)
+        assert df['peak_mV'].tolist() == pytest.approx([800, 300], abs=1)
+        assert list(catalog.find(channel='A', min_peak=1)['file']) == []
+
+
+def test_update_follows_the_archive(archive, capture):
+    with Catalog(archive) as catalog:
+        catalog.update()
+        first = os.path.join(archive, file_name(datetime(2026, 10, 15, 23, 59)))
+        os.remove(first)
+        # Event windows files are never indexed
+        timestamp = datetime(2026, 10, 16, 8, 0)
+        events = os.path.join(archive, file_name(timestamp, EVENTS_PREFIX + 'aquisition'))
+        write_capture(with_peak(capture, timestamp, 800), events)
+        assert catalog.update() == 0
+        assert len(catalog.find()) == 3
+        assert not catalog.is_indexed(events)
+
+
+def test_pipeline_adds_what_it_writes(tmp_path, capture):
+    root = str(tmp_path / 'archive')
+    timestamp = datetime(2026, 10, 17, 12, 0)
+    with Catalog(root) as catalog:
+        with WritePipeline(local_folder=root, catalog=catalog) as pipeline:
+            pipeline.submit(with_peak(capture, timestamp, 700), file_name(timestamp))
+        in_memory = catalog.find(channel='B')
+        path = in_memory['path'][0]
+        assert catalog.is_indexed(path)
+
+        # Same statistics as when the file is read back
+        catalog.add(path)
+        from_file = catalog.find(channel='B')
+    assert in_memory['peak_mV'][0] == pytest.approx(700, abs=1)
+    for column in ('min_mV', 'max_mV', 'peak_mV', 'mean_mV', 'rms_mV'):
+        assert in_memory[column][0] == pytest.approx(from_file[column][0])
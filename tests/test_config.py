@@ -0,0 +1,107 @@
+# %%
+"""
+validate_config, profile_configs and apply_config of picoscope_config.py.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_config import DEFAULT_CONFIG, apply_config, profile_configs, validate_config
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+
+
+def test_defaults():
+    config = validate_config({})
+    assert config['capture'] == DEFAULT_CONFIG['capture']
+    assert config['channels'] == DEFAULT_CONFIG['channels']
+    assert config['schedule']['profiles'] == {'default': {'every': 10}}
+
+
+def test_merge():
+    config = validate_config({'channels': {'B': {'range': '5V'}}, 'output': {'layout': 'flat'}})
+    # A channels section replaces the default one, the other sections are merged key by key
+    assert list(config['channels']) == ['B']
+    assert config['channels']['B'] == {'enabled': True, 'coupling': 'DC', 'range': '5V', 'offset': 0.0}
+    assert config['trigger']['sources'] == ['B']
+    assert config['output']['layout'] == 'flat'
+    assert config['output']['destinations'] == ['try']
+
+
+def test_timebase_replaces_sample_rate():
+    config = validate_config({'capture': {'timebase': 10, 'n_samples': 1000, 'pre_trigger_samples': 0}})
+    capture = config['capture']
+    assert (capture['timebase'], capture['n_samples']) == (10, 1000)
+    assert capture['sample_rate'] is None and capture['duration'] is None
+
+
+@pytest.mark.parametrize('config, message', [
+    ({'colour': 'red'}, r'^colour: unknown setting'),
+    ({'channels': {'E': {}}}, r'^channels: '),
+    ({'channels': {'A': {'range': '3V'}}}, r'^channels\.A\.range: '),
+    ({'channels': {'A': {'enabled': False}}}, r'^channels: at least one'),
+    ({'trigger': {'direction': 'UP'}}, r'^trigger\.direction: '),
+    ({'capture': {'timebase': 10, 'sample_rate': 1000}}, r'^capture: give either sample_rate or timebase'),
+    ({'capture': {'timebase': 10}}, r'^capture: with a timebase number the length has to be given as n_samples'),
+    ({'capture': {'duration': 0.01}}, r'^capture\.pre_trigger_samples: 10000 is not between 0 and the 5000'),
+    ({'capture': {'downsampling': {'mode': 'median'}}}, r'^capture\.downsampling\.mode: '),
+    ({'output': 'here'}, r'^output: expected an object'),
+    ({'events': {'enabled': True}}, r'^events: enabled without rules'),
+    ({'events': {'rules': [{'type': 'excursion', 'channel': 'B'}]}}, r'^events\.rules\[0\]: '),
+    ({'schedule': {'profiles': {}}}, r'^schedule\.profiles: at least one'),
+    ({'schedule': {'profiles': {'a/b': {'every': 10}}}}, r'^schedule\.profiles\.a/b: the name'),
+    ({'schedule': {'profiles': {'p': {'every': 10, 'cron': '* * * * *'}}}}, r'^schedule\.profiles\.p: give either'),
+    ({'schedule': {'profiles': {'p': {'cron': '61 * * * *'}}}}, r'^schedule\.profiles\.p: cron minute'),
+])
+def test_errors(config, message):
+    with pytest.raises(ValueError, match=message):
+        validate_config(config)
+
+
+def test_profiles():
+    config = validate_config({
+        'channels': {'A': {}, 'B': {}},
+        'schedule': {'profiles': {
+            'trend': {'every': 60},
+            'fast': {'cron': '*/5 * * * *', 'channels': {'A': {'range': '5V'}},
+                     'capture': {'sample_rate': 1e8, 'n_samples': 1000, 'pre_trigger_samples': 0}},
+        }},
+    })
+    profiles = profile_configs(config)
+    assert list(profiles) == ['trend', 'fast']
+
+    timing, trend = profiles['trend']
+    assert timing == {'every': 60}
+    assert list(trend['channels']) == ['A', 'B']
+    assert trend['capture']['duration'] == 3.0
+
+    timing, fast = profiles['fast']
+    assert timing == {'cron': '*/5 * * * *'}
+    assert fast['channels'] == {'A': {'enabled': True, 'coupling': 'DC', 'range': '5V', 'offset': 0.0}}
+    # n_samples given alone replaces the duration of the file
+    assert (fast['capture']['n_samples'], fast['capture']['duration']) == (1000, None)
+    assert fast['trigger']['sources'] == ['A']
+
+
+def test_profile_error_names_the_profile():
+    config = validate_config({'schedule': {'profiles': {'p': {'every': 1, 'capture': {'pre_trigger_samples': -1}}}}})
+    with pytest.raises(ValueError, match=r'^schedule\.profiles\.p\.capture\.pre_trigger_samples: '):
+        profile_configs(config)
+
+
+def test_apply_config():
+    config = validate_config({'channels': {'A': {}, 'C': {'range': '5V'}},
+                              'capture': {'sample_rate': 500000, 'n_samples': 1000, 'pre_trigger_samples': 100}})
+    session = PicoScopeSession(driver=FakePs5000a())
+    apply_config(session, config)
+    with session:
+        capture = session.capture_block()
+    assert session.enabled_channels == ['A', 'C']
+    assert capture['n_samples'] == 1000
+    assert capture['time_interval_ns'] == 2000
+    assert capture['pre_trigger_samples'] == 100
@@ -0,0 +1,116 @@
+# %%
+"""
+Rules, windows and background of the EventDetector (picoscope_events.py).
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_convert import mv_per_count
+from picoscope_events import Edge, EventDetector, Excursion, SpectralLine, merge_windows
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+from picoscope_storage import read_capture, write_capture
+
+
+@pytest.fixture
+def session():
+    session = PicoScopeSession(driver=FakePs5000a())
+    for ch in 'AB':
+        session.set_channel(ch, range='2V')
+    session.set_timebase(128, 10000)
+    with session:
+        yield session
+
+
+def flat_capture(capture, hits):
+    """The capture with A at 0 and B at 0 except ``hits``, {sample: mV}."""
+    scale = mv_per_count(capture['ranges']['B'], capture['maxADC'])
+    b = np.zeros(capture['n_samples'], dtype=np.int16)
+    for sample, mV in hits.items():
+        b[sample] = round(mV / scale)
+    a = np.arange(capture['n_samples'], dtype=np.int16)
+    return dict(capture, buffers={'A': a, 'B': b})
+
+
+def test_merge_windows():
+    ranges = np.array([[150, 160], [100, 110], [1000, 1001]])
+    windows = merge_windows(ranges, 20, 30, 1010)
+    assert windows.tolist() == [[80, 190], [980, 1010]]
+    assert merge_windows(np.empty((0, 2), dtype=np.int64), 20, 30, 1010).shape == (0, 2)
+
+
+def test_rules():
+    counts = np.array([0, 0, 100, 120, 0, -150, 0, 0], dtype=np.int16)
+    assert Excursion('B', 90).detect(counts, 1.0, 1000).tolist() == [[2, 4], [5, 6]]
+    assert Excursion('B', 90, 'above').detect(counts, 1.0, 1000).tolist() == [[2, 4]]
+    assert Excursion('B', -90, 'below').detect(counts, 1.0, 1000).tolist() == [[5, 6]]
+    # 2 mV per count: 100 mV is 50 counts
+    assert Excursion('B', 220, 'above').detect(counts, 2.0, 1000).tolist() == [[3, 4]]
+    # the edge spans both samples of each difference of more than 110
+    assert Edge('B', 110).detect(counts, 1.0, 1000).tolist() == [[3, 7]]
+    assert Edge('B', 200, lag=3).detect(counts, 1.0, 1000).tolist() == [[2, 6]]
+    assert Edge('B', 200, lag=8).detect(counts, 1.0, 1000).tolist() == []
+    with pytest.raises(ValueError):
+        Excursion('B', 90, 'sideways')
+
+
+def test_spectral_line():
+    interval_ns = 1000
+    t = np.arange(8 * 256) * interval_ns * 1e-9
+    # 500 mV at 10 kHz in blocks 2 and 3 only, on a whole number of periods per block
+    signal = 500 * np.sin(2 * np.pi * 1e4 * t)
+    signal[:512] = 0
+    signal[1024:] = 0
+    hits = SpectralLine('B', 1e4, 300, nperseg=256).detect(signal.astype(np.int16), 1.0, interval_ns)
+    assert hits.tolist() == [[512, 1024]]
+
+
+def test_reduce(session):
+    capture = flat_capture(session.capture_block(), {2000: 800, 2003: 900, 7000: -600})
+    detector = EventDetector([Excursion('B', 500)], pre_samples=100, post_samples=200, background_ratio=100)
+    events, background = detector.reduce(capture)
+
+    assert events['windows'] == [[1900, 2204], [6900, 7201]]
+    assert events['events'] == {"Excursion('B', 500, 'abs')": 3}
+    assert events['n_samples'] == 304 + 301
+    np.testing.assert_array_equal(events['buffers']['A'], np.r_[1900:2204, 6900:7201])
+    # Plain int, not the session's ctypes value that the next capture may change
+    assert type(events['maxADC']) is int and type(background['maxADC']) is int
+
+    assert background['n_samples'] == 100
+    assert background['ratio_mode'] == 'AGGREGATE'
+    assert background['time_interval_ns'] == capture['time_interval_ns'] * 100
+    assert background['buffers']['B'][20] > 0 and background['buffers_min']['B'][70] < 0
+    np.testing.assert_array_equal(background['buffers']['A'], np.arange(99, 10000, 100))
+    np.testing.assert_array_equal(background['buffers_min']['A'], np.arange(0, 10000, 100))
+
+
+def test_nothing_fired(session):
+    capture = flat_capture(session.capture_block(), {2000: 100})
+    events, background = EventDetector([Excursion('B', 500)], background_ratio=1000).reduce(capture)
+    assert events is None
+    assert background['n_samples'] == 10
+
+
+def test_rapid_block_refused(session):
+    with pytest.raises(ValueError):
+        EventDetector([Excursion('B', 500)]).detect(session.capture_rapid_block(2))
+
+
+def test_windows_file(session, tmp_path):
+    capture = flat_capture(session.capture_block(), {2000: 800, 7000: -600})
+    detector = EventDetector([Excursion('B', 500)], pre_samples=10, post_samples=10)
+    events, _ = detector.reduce(capture)
+    acq = read_capture(write_capture(events, str(tmp_path / 'events_test.parquet')))
+    interval = capture['time_interval_ns']
+    # The rows are placed back at their sample times in the capture
+    np.testing.assert_allclose(acq.time, np.r_[1990:2011, 6990:7011] * interval)
+    time, signals = acq.read(['A'], start_ns=6995 * interval, end_ns=7005 * interval, mV=False)
+    np.testing.assert_array_equal(signals['A'], np.arange(6995, 7005))
@@ -0,0 +1,108 @@
+# %%
+"""
+WritePipeline (picoscope_io.py) writing and replicating captures of the simulated driver.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import time as time_lib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import picoscope_io
+from picoscope_fake import FakePs5000a
+from picoscope_io import WritePipeline, atomic_copy
+from picoscope_session import PicoScopeSession
+from picoscope_storage import write_capture
+
+
+@pytest.fixture
+def capture():
+    session = PicoScopeSession(driver=FakePs5000a())
+    session.set_channel('A', range='2V')
+    session.set_timebase(128, 1000)
+    with session:
+        yield session.capture_block()
+
+
+def failing_writer(capture, path):
+    raise OSError("disk full")
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time_lib.monotonic() + timeout
+    while not condition():
+        assert time_lib.monotonic() < deadline, "timed out"
+        time_lib.sleep(0.01)
+
+
+def test_write_error_does_not_drop_next_capture(tmp_path, capture):
+    pipeline = WritePipeline(local_folder=str(tmp_path))
+    pipeline.submit(capture, 'first.parquet', failing_writer)
+    wait_for(lambda: pipeline.errors)
+    assert not os.path.exists(tmp_path / 'first.parquet.tmp')
+
+    # The earlier error is raised, but only once the new capture is queued
+    with pytest.raises(OSError):
+        pipeline.submit(capture, 'second.parquet', write_capture)
+    pipeline.close()
+    assert pipeline.written == [os.path.join(str(tmp_path), 'second.parquet')]
+
+
+def test_write_and_replicate(tmp_path, capture):
+    local, remote = tmp_path / 'local', tmp_path / 'remote'
+    with WritePipeline(local_folder=str(local), destinations=[str(remote)]) as pipeline:
+        pipeline.submit(capture, '2026/10/17/a.parquet')
+    assert pipeline.written == [os.path.join(str(local), '2026/10/17/a.parquet')]
+    assert pipeline.replicated[str(remote)] == [os.path.join(str(remote), '2026/10/17/a.parquet')]
+    assert (remote / '2026/10/17/a.parquet').read_bytes() == (local / '2026/10/17/a.parquet').read_bytes()
+
+
+def test_existing_file_is_not_replaced(tmp_path, capture):
+    (tmp_path / 'a.parquet').write_bytes(b'first')
+    pipeline = WritePipeline(local_folder=str(tmp_path))
+    pipeline.submit(capture, 'a.parquet')
+    with pytest.raises(FileExistsError):
+        pipeline.close()
+    assert (tmp_path / 'a.parquet').read_bytes() == b'first'
+    assert [path for path, error in pipeline.errors] == [os.path.join(str(tmp_path), 'a.parquet')]
+
+
+def flaky_copy(failures):
+    """atomic_copy that fails ``failures`` times first, and the list of its attempts."""
+    attempts = []
+
+    def copy(source, destination):
+        attempts.append(destination)
+        if len(attempts) <= failures:
+            raise OSError("destination not mounted")
+        atomic_copy(source, destination)
+    return copy, attempts
+
+
+def test_copy_retried(tmp_path, capture, monkeypatch):
+    copy, attempts = flaky_copy(2)
+    monkeypatch.setattr(picoscope_io, 'atomic_copy', copy)
+    with WritePipeline(local_folder=str(tmp_path / 'local'), destinations=[str(tmp_path / 'remote')],
+                       retries=2, backoff=0.0) as pipeline:
+        pipeline.submit(capture, 'a.parquet')
+    assert len(attempts) == 3
+    assert len(pipeline.replicated[str(tmp_path / 'remote')]) == 1
+    assert pipeline.failed == []
+
+
+def test_copy_given_up(tmp_path, capture, monkeypatch):
+    copy, attempts = flaky_copy(10)
+    monkeypatch.setattr(picoscope_io, 'atomic_copy', copy)
+    remote = str(tmp_path / 'remote')
+    with WritePipeline(local_folder=str(tmp_path / 'local'), destinations=[remote], retries=2,
+                       backoff=0.0) as pipeline:
+        pipeline.submit(capture, 'a.parquet')
+    assert len(attempts) == 3
+    assert pipeline.replicated[remote] == []
+    assert [(destination, type(error)) for path, destination, error in pipeline.failed] == [(remote, OSError)]
+    # A failed copy does not stop the acquisition: the local file is there and nothing is raised
+    assert pipeline.written == [os.path.join(str(tmp_path / 'local'), 'a.parquet')]
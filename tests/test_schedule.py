@@ -0,0 +1,107 @@
+# %%
+"""
+Every, Cron and the missed-slot policies of the Scheduler (picoscope_schedule.py).
+
+    python -m pytest tests
+"""
+import os
+import sys
+import time as time_lib
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_schedule import Cron, Every, Scheduler
+
+
+def local(*args):
+    return datetime(*args).timestamp()
+
+
+def test_every():
+    every = Every(60, offset=5)
+    assert every.next_after(1000) == 1025
+    # strictly after: a slot time gives the next slot
+    assert every.next_after(1025) == 1085
+    with pytest.raises(ValueError):
+        Every(0)
+
+
+@pytest.mark.parametrize('expression, after, slot', [
+    ('0 * * * *', (2026, 10, 17, 13, 0), (2026, 10, 17, 14, 0)),
+    ('*/15 8-17 * * *', (2026, 10, 17, 17, 50), (2026, 10, 18, 8, 0)),
+    ('30 2 1 * *', (2026, 10, 17, 0, 0), (2026, 11, 1, 2, 30)),
+    ('0 0 * 2 *', (2026, 10, 17, 0, 0), (2027, 2, 1, 0, 0)),
+    # 2026-10-17 is a Saturday; Sunday is 0 or 7
+    ('0 12 * * 7', (2026, 10, 17, 0, 0), (2026, 10, 18, 12, 0)),
+    ('0 12 * * 1-5', (2026, 10, 17, 0, 0), (2026, 10, 19, 12, 0)),
+    # day of month and day of week both restricted: either one fires
+    ('0 12 20 * 0', (2026, 10, 17, 0, 0), (2026, 10, 18, 12, 0)),
+    ('0 12 19,20 * 3', (2026, 10, 18, 13, 0), (2026, 10, 19, 12, 0)),
+])
+def test_cron(expression, after, slot):
+    assert Cron(expression).next_after(local(*after)) == local(*slot)
+
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '* 1-x * * *', '* * * * */0', '0 0 31 2 *'])
+def test_cron_errors(expression):
+    with pytest.raises(ValueError):
+        Cron(expression).next_after(local(2026, 10, 17))
+
+
+def late_job(missed):
+    """Scheduler with one job every 10 s whose current slot passed 3 slots and a bit ago."""
+    runs = []
+    scheduler = Scheduler(missed=missed, verbose=False)
+    job = scheduler.add('job', Every(10), lambda: runs.append(time_lib.time()))
+    upcoming = job.schedule.next_after(time_lib.time())
+    job.next_slot = upcoming - 40
+    return scheduler, job, runs, upcoming
+
+
+def test_missed_slots_coalesce():
+    scheduler, job, runs, upcoming = late_job('coalesce')
+    assert scheduler.run_once() is job
+    # One run for the late slot and the 3 missed after it
+    assert len(runs) == 1
+    assert (job.runs, job.coalesced, job.skipped) == (1, 3, 0)
+    assert job.drifts[0] >= 30
+    assert job.next_slot == upcoming
+
+
+def test_missed_slots_skip():
+    scheduler, job, runs, upcoming = late_job('skip')
+    assert scheduler.run_once() is job
+    assert runs == []
+    assert (job.runs, job.coalesced, job.skipped) == (0, 0, 4)
+    assert job.next_slot == upcoming
+
+
+def test_on_time_within_tolerance():
+    scheduler, job, runs, upcoming = late_job('skip')
+    job.next_slot = time_lib.time() - 0.5
+    scheduler.run_once()
+    assert len(runs) == 1
+    assert job.skipped == 0
+
+
+def test_failed_run_is_counted():
+    scheduler = Scheduler(verbose=False)
+    job = scheduler.add('job', Every(10), lambda: 1 / 0)
+    job.next_slot = time_lib.time()
+    scheduler.run_once()
+    assert (job.runs, job.failures) == (0, 1)
+
+
+def test_earliest_slot_first():
+    scheduler = Scheduler(verbose=False)
+    order = []
+    first = scheduler.add('first', Every(10), lambda: order.append('first'))
+    second = scheduler.add('second', Every(10), lambda: order.append('second'))
+    now = time_lib.time()
+    first.next_slot, second.next_slot = now - 0.1, now - 0.2
+    scheduler.run_once()
+    scheduler.run_once()
+    assert order == ['second', 'first']
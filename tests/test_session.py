@@ -0,0 +1,172 @@
+# %%
+"""
+PicoScopeSession against the simulated driver of picoscope_fake.py.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_fake import FakePs5000a
+from picoscope_session import PICO_NOT_FOUND, PicoScopeError, PicoScopeSession
+
+
+@pytest.fixture
+def session():
+    session = PicoScopeSession(driver=FakePs5000a(), reconnect_delay=0.0)
+    for ch in 'ABCD':
+        session.set_channel(ch, range='2V')
+    session.set_sample_rate(500000, n_samples=10000)
+    with session:
+        yield session
+
+
+def test_apply_only_pushes_changes(session):
+    drv = session.ps
+    assert session.apply() != []
+    calls = len(drv.calls)
+    assert session.apply() == []
+    assert len(drv.calls) == calls
+
+    session.set_channel('B', range='5V')
+    assert session.apply() == [('channel', 'B')]
+    assert drv.count('ps5000aSetChannel') == 5
+
+
+def test_reconnect_after_unplug(session):
+    drv = session.ps
+    session.capture_block()
+    drv.unplug()
+    capture = session.capture_block()
+    assert capture['n_samples'] == 10000
+    assert drv.count('ps5000aOpenUnit') == 2
+    # A new handle starts from scratch: every channel is set up again
+    assert drv.count('ps5000aSetChannel') == 8
+
+
+def unit_back_after(drv, failed_opens):
+    """Make the unplugged unit of ``drv`` answer PICO_NOT_FOUND to the next ``failed_opens`` opens."""
+    drv.unplug()
+    drv.present = False
+    open_unit = drv.ps5000aOpenUnit
+    opens = drv.count('ps5000aOpenUnit')
+
+    def comes_back(*args):
+        status = open_unit(*args)
+        drv.present = drv.count('ps5000aOpenUnit') >= opens + failed_opens
+        return status
+    drv.ps5000aOpenUnit = comes_back
+
+
+def test_reconnect_waits_for_the_unit(session):
+    drv = session.ps
+    session.capture_block()
+    unit_back_after(drv, 2)
+    assert session.capture_block()['n_samples'] == 10000
+    assert drv.count('ps5000aOpenUnit') == 4
+
+
+def test_reconnect_gives_up(session):
+    drv = session.ps
+    session.capture_block()
+    unit_back_after(drv, 10)
+    with pytest.raises(PicoScopeError) as error:
+        session.capture_block()
+    assert error.value.status == PICO_NOT_FOUND
+    # The lost capture, then one open per reconnection
+    assert drv.count('ps5000aOpenUnit') == 1 + session.max_reconnects
+
+
+def test_buffers_are_reused(session):
+    drv = session.ps
+    first = session.capture_block()
+    registered = drv.count('ps5000aSetDataBuffers')
+    second = session.capture_block()
+    assert drv.count('ps5000aSetDataBuffers') == registered
+    assert second['buffers']['A'] is first['buffers']['A']
+
+
+def test_switch_between_rate_and_timebase(session):
+    session.apply()
+    assert session.time_interval_ns == 2000
+    rate_timebase = session.timebase[0]
+
+    session.set_timebase(10, 10000)
+    session.apply()
+    assert session.timebase[0] == 10
+    assert session.time_interval_ns != 2000
+
+    # Same rate as before: the solved timebase comes back without solving again
+    session.set_sample_rate(500000, n_samples=10000)
+    assert session.apply() == ['timebase']
+    assert session.timebase[0] == rate_timebase
+    assert session.time_interval_ns == 2000
+
+
+def test_pre_trigger_longer_than_capture(session):
+    with pytest.raises(ValueError):
+        session.set_timebase(10, 1000, pre_trigger_samples=2000)
+    session.set_sample_rate(500000, duration=0.001, pre_trigger_samples=1000)
+    with pytest.raises(ValueError):
+        session.apply()
+
+
+def test_trigger_cleared(session):
+    drv = session.ps
+    session.set_trigger(['A'])
+    session.apply()
+    assert len(drv.trigger['conditions']) == 1
+
+    session.trigger = None
+    assert 'trigger' in session.apply()
+    assert drv.trigger['conditions'] == []
+    assert session._applied['trigger'] is None
+
+    # A trigger on disabled channels only is no trigger either
+    session.set_trigger(['A'])
+    session.apply()
+    session.set_channel('A', enabled=False)
+    session.apply()
+    assert drv.trigger['conditions'] == []
+    assert session._applied['trigger'] is None
+
+
+def test_capped_capture_keeps_requested_timebase():
+    session = PicoScopeSession(driver=FakePs5000a(memory_samples=4 * 500000), reconnect_delay=0.0)
+    for ch in 'ABCD':
+        session.set_channel(ch, range='2V')
+    session.set_timebase(128, 500000)
+    with session:
+        assert session.capture_rapid_block(10)['n_samples'] == 50000
+        # The cap is for the segmented memory only: a single block gets the full length again
+        assert session.timebase == (128, 500000, 0)
+        assert session.capture_block()['n_samples'] == 500000
+
+
+@pytest.mark.parametrize('wait_mode', ['callback', 'poll', 'spin', 'async'])
+def test_no_trigger_times_out(wait_mode):
+    # A trigger about every 11 days, taking the real capture time
+    drv = FakePs5000a(time_scale=1.0, trigger_rate=1e-6)
+    session = PicoScopeSession(driver=drv, wait_mode='callback' if wait_mode == 'async' else wait_mode,
+                               wait_timeout=0.05)
+    session.set_channel('A')
+    session.set_timebase(128, 1000)
+    with session:
+        with pytest.raises(TimeoutError):
+            if wait_mode == 'async':
+                asyncio.run(session.capture_block_async())
+            else:
+                session.capture_block()
+        # The scope is disarmed
+        assert drv.calls[-1][0] == 'ps5000aStop'
+
+
+def test_async_capture(session):
+    capture = asyncio.run(session.capture_block_async())
+    assert capture['n_samples'] == 10000
+    assert session.ps.count('ps5000aRunBlock') == 1
@@ -0,0 +1,50 @@
+# %%
+"""
+amplitude_spectrum of the SpectrumEngine (picoscope_spectra.py).
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_spectra import amplitude_spectrum, window
+
+
+def test_sine_amplitude():
+    interval_ns = 1000
+    t = np.arange(4096) * interval_ns * 1e-9
+    signal = 300 + 500 * np.sin(2 * np.pi * 31.25e3 * t)
+    frequencies, amplitude, n_frames = amplitude_spectrum(signal, interval_ns, 'rect', pad=False)
+    assert n_frames == 1
+    assert amplitude[0] == pytest.approx(300, rel=1e-5)
+    assert frequencies[np.argmax(amplitude[1:]) + 1] == pytest.approx(31.25e3)
+    assert amplitude[1:].max() == pytest.approx(500, rel=1e-5)
+
+
+def test_nyquist_bin():
+    # +-500 mV on every other sample is a cosine at the Nyquist frequency, which has no twin to fold in
+    signal = 500 * (-1.0) ** np.arange(4096)
+    frequencies, amplitude, _ = amplitude_spectrum(signal, 1000, 'rect', pad=False)
+    assert frequencies[-1] == pytest.approx(5e5)
+    assert amplitude[-1] == pytest.approx(500, rel=1e-5)
+
+
+def test_welch_frames():
+    rng = np.random.default_rng(0)
+    signal = rng.normal(size=(3, 5000))
+    frequencies, amplitude, n_frames = amplitude_spectrum(signal, 1000, nperseg=512, overlap=0.5, pad=False)
+
+    # Every frame cut and transformed at once
+    frames = np.concatenate([[row[i:i + 512] for i in range(0, 5000 - 511, 256)] for row in signal])
+    w = window('hann', 512)
+    power = (np.abs(np.fft.rfft(frames * w, axis=-1)) ** 2).mean(axis=0)
+    expected = np.sqrt(power) * 2 / w.sum()
+    expected[0] /= 2
+    expected[-1] /= 2
+    assert n_frames == len(frames) == 3 * 18
+    np.testing.assert_allclose(amplitude, expected, rtol=1e-5)
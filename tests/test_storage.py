@@ -0,0 +1,115 @@
+# %%
+"""
+Raw Parquet files of picoscope_storage.py written from captures of the simulated driver and read back.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_convert import MillivoltConverter, capture_views
+from picoscope_fake import FakePs5000a
+from picoscope_session import PicoScopeSession
+from picoscope_storage import CaptureWriter, read_capture, read_dataframe, write_capture, write_capture_mV
+
+
+@pytest.fixture
+def session():
+    session = PicoScopeSession(driver=FakePs5000a())
+    session.set_channel('A', range='5V')
+    session.set_channel('B', range='2V')
+    session.set_timebase(128, 10000, 1000)
+    with session:
+        yield session
+
+
+def check_counts(acq, capture, name='buffers', suffix=''):
+    for ch, counts in capture_views(capture, name).items():
+        assert acq.counts(ch + suffix).dtype == np.int16
+        np.testing.assert_array_equal(acq.counts(ch + suffix), counts.ravel())
+
+
+def test_block(session, tmp_path):
+    capture = session.capture_block()
+    acq = read_capture(write_capture(capture, str(tmp_path / 'block.parquet')))
+    assert acq.channels == ['A', 'B']
+    assert acq.n_samples == 10000
+    assert acq.metadata['pre_trigger_samples'] == 1000
+    assert acq.sampling_rate == pytest.approx(1e9 / capture['time_interval_ns'])
+    check_counts(acq, capture)
+    np.testing.assert_allclose(acq.time[:3], np.arange(3) * capture['time_interval_ns'])
+
+    # Same values as a file in the old mV format
+    mV = MillivoltConverter().convert(capture)
+    np.testing.assert_array_equal(acq.mV('A'), mV['A'])
+    old = pd.read_parquet(write_capture_mV(capture, str(tmp_path / 'block_mV.parquet')))
+    new = read_dataframe(str(tmp_path / 'block.parquet'))
+    pd.testing.assert_frame_equal(new[old.columns], old, check_dtype=False)
+
+
+def test_rapid_block(session, tmp_path):
+    capture = session.capture_rapid_block(5)
+    acq = read_capture(write_capture(capture, str(tmp_path / 'rapid.parquet')))
+    assert acq.metadata['n_segments'] == 5
+    assert acq.n_samples == 5 * 10000
+    assert acq.metadata['trigger_time_ns'] == [float(t) for t in capture['trigger_time_ns']]
+    check_counts(acq, capture)
+
+    time, signals = acq.read(['B'], segment=3, mV=False)
+    np.testing.assert_array_equal(signals['B'], capture_views(capture)['B'][3])
+    np.testing.assert_allclose(time, acq.time[:10000])
+    df = acq.to_dataframe()
+    assert df['segment'].tolist() == np.repeat(np.arange(5), 10000).tolist()
+
+
+def test_aggregate(session, tmp_path):
+    session.set_downsampling('AGGREGATE', 4)
+    capture = session.capture_block()
+    acq = read_capture(write_capture(capture, str(tmp_path / 'aggregate.parquet')))
+    assert acq.downsampling == ('AGGREGATE', 4)
+    assert acq.min_channels == ['A', 'B']
+    assert acq.n_samples == 2500
+    check_counts(acq, capture)
+    check_counts(acq, capture, 'buffers_min', '_min')
+    assert (acq.counts('A_min') <= acq.counts('A')).all()
+    assert 'adc2mVChAMin' in acq.to_dataframe()
+
+
+def test_chunked_writer(session, tmp_path):
+    path = str(tmp_path / 'long.parquet')
+    chunks = []
+    with CaptureWriter(path, row_group_size=1000) as writer:
+        for chunk in session.capture_block_chunks(3000):
+            # The session reuses the chunk buffers
+            chunks.append({ch: counts.copy() for ch, counts in capture_views(chunk).items()})
+            writer.write(chunk)
+    assert [len(chunk['A']) for chunk in chunks] == [3000, 3000, 3000, 1000]
+    assert not os.path.exists(f'{path}.tmp')
+
+    acq = read_capture(path)
+    assert acq.n_samples == acq.metadata['n_samples'] == 10000
+    assert acq.parquet.metadata.num_row_groups == 10
+    expected = np.concatenate([chunk['A'] for chunk in chunks])
+    np.testing.assert_array_equal(acq.counts('A'), expected)
+
+    # A time slice only reads its row groups and gives the same samples
+    interval = acq.metadata['sample_interval_ns']
+    time, signals = read_capture(path).read(['A'], start_ns=2500 * interval, end_ns=4200 * interval, mV=False)
+    np.testing.assert_array_equal(signals['A'], expected[2500:4200])
+    np.testing.assert_allclose(time, np.arange(2500, 4200) * interval)
+
+
+def test_chunked_writer_abort(session, tmp_path):
+    path = str(tmp_path / 'long.parquet')
+    with pytest.raises(RuntimeError):
+        with CaptureWriter(path) as writer:
+            for chunk in session.capture_block_chunks(3000):
+                writer.write(chunk)
+                raise RuntimeError("download failed")
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,80 @@
+# %%
+"""
+RingBuffer and RawFileSink of picoscope_streaming.py.
+
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from picoscope_streaming import RawFileSink, RingBuffer
+
+
+def rows(start, n):
+    """Two channels counting up from ``start``, the second one negated."""
+    samples = np.arange(start, start + n, dtype=np.int16)
+    return [samples, -samples]
+
+
+def read_all(ring, max_samples=100):
+    """(stream index, samples of channel 0) of every peek until the ring is empty."""
+    chunks = []
+    while ring.fill:
+        chunk = ring.peek(max_samples, timeout=0)
+        chunks.append((ring.stream_index, chunk[0].tolist()))
+        assert (chunk[1] == -chunk[0]).all()
+        ring.consume(chunk.shape[1])
+    return chunks
+
+
+def test_wrap_around():
+    ring = RingBuffer(2, 10)
+    assert ring.write(rows(0, 6)) == 0
+    ring.consume(ring.peek(4, timeout=0).shape[1])
+    assert ring.write(rows(6, 6)) == 0
+    assert ring.fill == 8
+
+    # A peek stops at the end of the memory, the rest comes from its start
+    assert read_all(ring) == [(4, [4, 5, 6, 7, 8, 9]), (10, [10, 11])]
+    assert ring.max_fill == 8
+    assert ring.overruns == 0 and ring.gaps == []
+
+
+def test_peek_timeout_when_empty():
+    ring = RingBuffer(2, 4)
+    assert ring.peek(4, timeout=0) is None
+
+
+def test_overrun_keeps_what_fits_and_records_the_gap():
+    ring = RingBuffer(2, 8)
+    ring.write(rows(0, 6))
+    ring.consume(4)
+    # 6 places are free: samples 6-11 are kept, 12-15 dropped
+    assert ring.write(rows(6, 10)) == 4
+    assert (ring.overruns, ring.dropped) == (1, 4)
+    assert ring.gaps == [(12, 4)]
+
+    ring.consume(ring.peek(100, timeout=0).shape[1])
+    ring.write(rows(16, 3))
+    # A peek stops at the gap, and the samples after it follow the hole in the stream numbering
+    assert read_all(ring) == [(8, [8, 9, 10, 11]), (16, [16, 17, 18])]
+
+
+def test_raw_file_sink_gaps(tmp_path):
+    sink = RawFileSink(str(tmp_path))
+    sink.open({'timestamp': 'test', 'channels': ['A', 'B']})
+    sink(np.array(rows(0, 5)), 0)
+    sink(np.array(rows(8, 2)), 8)
+    sink.close()
+
+    with open(tmp_path / 'stream_test.json') as f:
+        metadata = json.load(f)
+    assert metadata['gaps'] == [[5, 3]]
+    assert metadata['n_samples'] == 7
+    a = np.fromfile(tmp_path / 'stream_test_A.bin', dtype=np.int16)
+    assert a.tolist() == [0, 1, 2, 3, 4, 8, 9]